@@ -0,0 +1,31 @@
+"""
+Gunicorn settings for the web interface
+
+Usage:
+    gunicorn -c gunicorn.conf.py src.web_interface.wsgi:app
+"""
+
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.getenv('WEB_INTERFACE_PORT', 5000)}"
+
+# Threaded workers: an open /api/jobs/events stream holds one thread, so
+# workers * threads bounds the number of browser tabs watching jobs at once.
+# Nothing slow runs in a request, so a handful of processes is enough.
+worker_class = "gthread"
+workers = int(os.getenv("WEB_WORKERS", 0)) or min(4, multiprocessing.cpu_count())
+threads = int(os.getenv("WEB_THREADS", 32))
+
+# Worker heartbeat timeout; with gthread an open event stream does not count against it
+timeout = int(os.getenv("WEB_TIMEOUT", 60))
+graceful_timeout = 30
+keepalive = 5
+
+# The app is created in each worker after the fork, so in-process generation
+# worker threads and SQLite connections are never shared between processes
+preload_app = False
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("WEB_LOG_LEVEL", "info")
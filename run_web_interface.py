@@ -4,8 +4,35 @@ InstaNexus Web Interface Entry Point
 """
 
 import os
+import runpy
+import logging
 from dotenv import load_dotenv
-from src.web_interface.app import create_app
+
+logger = logging.getLogger(__name__)
+
+def run_gunicorn(port: int) -> bool:
+    # Production server: several threaded worker processes configured by
+    # gunicorn.conf.py. Gunicorn does not run on Windows, where the threaded
+    # development server below is used instead.
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        return False
+    
+    class Application(BaseApplication):
+        def load_config(self):
+            config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gunicorn.conf.py")
+            for key, value in runpy.run_path(config_path).items():
+                if key in self.cfg.settings and value is not None:
+                    self.cfg.set(key, value)
+            self.cfg.set("bind", f"0.0.0.0:{port}")
+        
+        def load(self):
+            from src.web_interface.app import create_app
+            return create_app()
+    
+    Application().run()
+    return True
 
 def main():
     # Load environment variables
@@ -13,10 +40,19 @@ def main():
     
     # Get port from environment or use default
     port = int(os.getenv('WEB_INTERFACE_PORT', 5000))
+    debug = os.getenv('DEBUG', 'False').lower() == 'true'
+    
+    if not debug and run_gunicorn(port):
+        return
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if not debug:
+        logger.warning("gunicorn is not installed, falling back to the threaded development server")
     
     # Create and run the application
+    from src.web_interface.app import create_app
     app = create_app()
-    app.run(host='0.0.0.0', port=port, debug=os.getenv('DEBUG', 'False').lower() == 'true')
+    app.run(host='0.0.0.0', port=port, debug=debug, threaded=True)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
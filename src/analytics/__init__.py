@@ -2,8 +2,14 @@
 Analytics Module - Performance tracking and reporting
 """
 
-from .analytics import InstagramAnalytics
-from .metrics import EngagementMetrics
-from .reporting import ReportGenerator
+from ..utils.lazy import lazy_exports
 
-__all__ = ['InstagramAnalytics', 'EngagementMetrics', 'ReportGenerator']
\ No newline at end of file
+_EXPORTS = {
+    'InstagramAnalytics': '.analytics',
+    'EngagementMetrics': '.metrics',
+    'ReportGenerator': '.reporting',
+    'AggregationStore': '.aggregation'
+}
+
+__all__ = list(_EXPORTS)
+__getattr__ = lazy_exports(__name__, _EXPORTS)
@@ -0,0 +1,400 @@
+"""
+Aggregation - Append-only engagement snapshots with pre-rolled hourly and daily buckets
+
+Usage:
+    python -m src.analytics.aggregation bench [--accounts 300] [--posts 60] [--days 365]
+
+Snapshots are cumulative per-post counters (likes so far, reach so far, ...)
+as returned by the Instagram insights endpoints. On ingest they are turned
+into per-post deltas and added into dense NumPy arrays indexed by
+(account, bucket, metric), so a report over any range is a slice and a sum
+rather than a pass over the post history.
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import logging
+import tempfile
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple, Any
+
+import numpy as np
+
+from ..utils.paths import data_path
+
+logger = logging.getLogger(__name__)
+
+METRICS = ("likes", "comments", "saves", "shares", "reach", "impressions")
+INTERACTIONS = ("likes", "comments", "saves", "shares")
+
+HOUR = 3600
+DAY = 86400
+
+
+class _Rollup:
+    # Dense (account, bucket, metric) totals for one bucket width. Index 0 of
+    # the bucket axis is self.origin; the axis grows as new buckets arrive.
+    # With a retention, buckets older than that are dropped as time moves on.
+
+    def __init__(self, width: int, dtype, retention: Optional[int] = None):
+        self.width = width
+        self.dtype = np.dtype(dtype)
+        self.retention = retention
+        self._max_capacity = retention + retention // 4 if retention is not None else None
+        self.origin: Optional[int] = None
+        self.data = np.zeros((0, 0, len(METRICS)), dtype=self.dtype)
+        self.dropped = 0
+
+    def _resize(self, accounts: int, origin: int, capacity: int):
+        data = np.zeros((accounts, capacity, len(METRICS)), dtype=self.dtype)
+        if self.origin is not None and self.data.size:
+            # Copy the overlap between the old and the new bucket window
+            start = max(origin, self.origin)
+            end = min(origin + capacity, self.origin + self.data.shape[1])
+            if end > start:
+                data[:self.data.shape[0], start - origin:end - origin] = \
+                    self.data[:, start - self.origin:end - self.origin]
+        self.data = data
+        self.origin = origin
+
+    def _ensure(self, accounts: int, first: int, last: int):
+        current_accounts, capacity = self.data.shape[:2]
+        origin = self.origin if self.origin is not None else first
+        # The end comes from the current origin, so moving the origin back
+        # for an older batch keeps every bucket already held
+        end = max(origin + capacity, last + 1)
+        if self.retention is None:
+            origin = min(origin, first)
+        if self.retention is not None and end - origin > self._max_capacity:
+            # Shift by at least a quarter of the retention at a time, not bucket by bucket
+            origin = end - self.retention
+
+        if accounts <= current_accounts and origin == self.origin and end - origin <= capacity:
+            return
+        # Grow geometrically so a steady stream of new buckets costs amortised O(1)
+        new_accounts = max(accounts, current_accounts, 1)
+        if new_accounts > current_accounts:
+            new_accounts = max(new_accounts, current_accounts * 2)
+        new_capacity = max(end - origin, capacity)
+        if new_capacity > capacity:
+            new_capacity = max(new_capacity, capacity + capacity // 2, 32)
+            if self.retention is not None:
+                new_capacity = min(new_capacity, self._max_capacity)
+        self._resize(new_accounts, origin, new_capacity)
+
+    def add(self, accounts: np.ndarray, timestamps: np.ndarray, deltas: np.ndarray):
+        buckets = np.floor_divide(timestamps, self.width).astype(np.int64)
+        self._ensure(int(accounts.max()) + 1, int(buckets.min()), int(buckets.max()))
+        offsets = buckets - self.origin
+        keep = (offsets >= 0) & (offsets < self.data.shape[1])
+        self.dropped += int((~keep).sum())
+        np.add.at(self.data, (accounts[keep], offsets[keep]), deltas[keep].astype(self.dtype))
+
+    def window(self, start: float, end: float) -> Tuple[np.ndarray, int]:
+        # View of the buckets overlapping [start, end) and the first bucket number
+        if self.origin is None:
+            return self.data[:, :0], 0
+        first = max(int(start // self.width), self.origin)
+        last = min(int(-(-end // self.width)), self.origin + self.data.shape[1])
+        if last <= first:
+            return self.data[:, :0], first
+        return self.data[:, first - self.origin:last - self.origin], first
+
+
+class AggregationStore:
+    # Every ingested batch is first written as its own .npz chunk (the
+    # append-only log), then applied to the in-memory rollups. The rollups
+    # and the last snapshot of each post are checkpointed every
+    # checkpoint_every chunks; on start the checkpoint is loaded and any newer
+    # chunks are replayed. One process writes to a store at a time.
+    #
+    # Snapshots that are not newer than the post's latest one are ignored,
+    # so re-ingesting the same export is harmless. A post's first snapshot
+    # counts everything it had gathered by then towards that hour.
+
+    def __init__(self, directory: Optional[str] = None, batch_size: Optional[int] = None,
+                 hourly_retention_days: Optional[int] = None, checkpoint_every: Optional[int] = None):
+        self.directory = directory or os.getenv("ANALYTICS_STORE_DIR") or data_path("analytics")
+        self.chunk_dir = os.path.join(self.directory, "snapshots")
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        self.batch_size = batch_size or int(os.getenv("ANALYTICS_BATCH_SIZE", 5000))
+        self.checkpoint_every = checkpoint_every or int(os.getenv("ANALYTICS_CHECKPOINT_EVERY", 20))
+        retention_days = hourly_retention_days or int(os.getenv("ANALYTICS_HOURLY_RETENTION_DAYS", 90))
+
+        self.hourly = _Rollup(HOUR, np.int32, retention=retention_days * 24)
+        self.daily = _Rollup(DAY, np.int64)
+
+        self.accounts: Dict[str, int] = {}
+        self.posts: Dict[Tuple[str, str], int] = {}
+        self._last_values = np.zeros((0, len(METRICS)), dtype=np.int64)
+        self._last_ts = np.zeros(0, dtype=np.float64)
+        self._applied = 0
+        self._pending: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self.stats = {"ingested": 0, "stale": 0}
+
+        self._load()
+
+    # Ingestion
+
+    def add(self, snapshot: Dict[str, Any]):
+        # Buffer one snapshot ({"account", "post_id", "timestamp", <metrics>});
+        # the buffer is written out as a chunk once it reaches batch_size
+        with self._lock:
+            self._pending.append(snapshot)
+            if len(self._pending) >= self.batch_size:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._pending:
+            snapshots, self._pending = self._pending, []
+            self._ingest_locked(snapshots)
+
+    def ingest(self, snapshots: Iterable[Dict[str, Any]]):
+        with self._lock:
+            self._flush_locked()
+            self._ingest_locked(list(snapshots))
+
+    def _ingest_locked(self, snapshots: List[Dict[str, Any]]):
+        if not snapshots:
+            return
+        columns = {
+            "account": np.array([s["account"] for s in snapshots], dtype=object),
+            "post_id": np.array([str(s["post_id"]) for s in snapshots], dtype=object),
+            "timestamp": np.array([float(s["timestamp"]) for s in snapshots], dtype=np.float64),
+            "values": np.array([[int(s.get(name) or 0) for name in METRICS] for s in snapshots], dtype=np.int64)
+        }
+        self._applied += 1
+        path = os.path.join(self.chunk_dir, f"{self._applied:08d}.npz")
+        np.savez(path, account=columns["account"].astype(str), post_id=columns["post_id"].astype(str),
+                 timestamp=columns["timestamp"], values=columns["values"])
+        self._apply(columns)
+        if self._applied % self.checkpoint_every == 0:
+            self._checkpoint()
+
+    def _index(self, keys: Iterable, mapping: Dict) -> np.ndarray:
+        indices = []
+        for key in keys:
+            index = mapping.get(key)
+            if index is None:
+                index = mapping[key] = len(mapping)
+            indices.append(index)
+        return np.array(indices, dtype=np.int64)
+
+    def _apply(self, columns: Dict[str, np.ndarray]):
+        accounts = self._index(columns["account"].tolist(), self.accounts)
+        posts = self._index(zip(columns["account"].tolist(), columns["post_id"].tolist()), self.posts)
+        timestamps = columns["timestamp"]
+        values = columns["values"]
+
+        if len(self.posts) > len(self._last_ts):
+            grow = max(len(self.posts), 2 * len(self._last_ts)) - len(self._last_ts)
+            self._last_values = np.concatenate([self._last_values, np.zeros((grow, len(METRICS)), dtype=np.int64)])
+            self._last_ts = np.concatenate([self._last_ts, np.full(grow, -np.inf)])
+
+        # Sort by post, then time, and keep only snapshots newer than each post's last one
+        order = np.lexsort((timestamps, posts))
+        accounts, posts, timestamps, values = accounts[order], posts[order], timestamps[order], values[order]
+        fresh = timestamps > self._last_ts[posts]
+        self.stats["stale"] += int((~fresh).sum())
+        accounts, posts, timestamps, values = accounts[fresh], posts[fresh], timestamps[fresh], values[fresh]
+        if not len(posts):
+            return
+
+        # Each snapshot minus the previous one of the same post
+        first = np.ones(len(posts), dtype=bool)
+        first[1:] = posts[1:] != posts[:-1]
+        previous = np.empty_like(values)
+        previous[first] = self._last_values[posts[first]]
+        previous[~first] = values[np.flatnonzero(~first) - 1]
+        deltas = values - previous
+
+        last = np.ones(len(posts), dtype=bool)
+        last[:-1] = posts[1:] != posts[:-1]
+        self._last_values[posts[last]] = values[last]
+        self._last_ts[posts[last]] = timestamps[last]
+
+        self.hourly.add(accounts, timestamps, deltas)
+        self.daily.add(accounts, timestamps, deltas)
+        self.stats["ingested"] += len(posts)
+
+    # Persistence
+
+    def _checkpoint(self):
+        path = os.path.join(self.directory, "rollups.npz")
+        tmp_path = path + ".tmp.npz"
+        meta = {
+            "applied": self._applied,
+            "accounts": self.accounts,
+            "posts": [[account, post_id, index] for (account, post_id), index in self.posts.items()],
+            "hourly_origin": self.hourly.origin,
+            "daily_origin": self.daily.origin
+        }
+        np.savez(tmp_path, meta=np.array(json.dumps(meta)), hourly=self.hourly.data, daily=self.daily.data,
+                 last_values=self._last_values[:len(self.posts)], last_ts=self._last_ts[:len(self.posts)])
+        os.replace(tmp_path, path)
+        logger.debug(f"Analytics checkpoint written after {self._applied} chunks")
+
+    def _load(self):
+        path = os.path.join(self.directory, "rollups.npz")
+        if os.path.exists(path):
+            with np.load(path) as checkpoint:
+                meta = json.loads(str(checkpoint["meta"]))
+                self.hourly.data = checkpoint["hourly"]
+                self.daily.data = checkpoint["daily"]
+                self._last_values = checkpoint["last_values"]
+                self._last_ts = checkpoint["last_ts"]
+            self._applied = meta["applied"]
+            self.accounts = meta["accounts"]
+            self.posts = {(account, post_id): index for account, post_id, index in meta["posts"]}
+            self.hourly.origin = meta["hourly_origin"]
+            self.daily.origin = meta["daily_origin"]
+
+        replayed = 0
+        for chunk_path in sorted(glob.glob(os.path.join(self.chunk_dir, "*.npz"))):
+            number = int(os.path.splitext(os.path.basename(chunk_path))[0])
+            if number <= self._applied:
+                continue
+            with np.load(chunk_path) as chunk:
+                self._apply({
+                    "account": chunk["account"].astype(object),
+                    "post_id": chunk["post_id"].astype(object),
+                    "timestamp": chunk["timestamp"],
+                    "values": chunk["values"]
+                })
+            self._applied = number
+            replayed += 1
+        if replayed:
+            logger.info(f"Replayed {replayed} analytics chunks after the last checkpoint")
+            self._checkpoint()
+
+    def close(self):
+        with self._lock:
+            self._flush_locked()
+            self._checkpoint()
+
+    # Queries
+
+    def _rollup(self, granularity: str) -> _Rollup:
+        if granularity not in ("hour", "day"):
+            raise ValueError(f"Unknown granularity '{granularity}', expected 'hour' or 'day'")
+        return self.hourly if granularity == "hour" else self.daily
+
+    def _rows(self, accounts: Optional[List[str]]) -> Tuple[List[str], np.ndarray]:
+        names = list(self.accounts) if accounts is None else [name for name in accounts if name in self.accounts]
+        return names, np.array([self.accounts[name] for name in names], dtype=np.int64)
+
+    def totals(self, start: float, end: float, accounts: Optional[List[str]] = None,
+               granularity: str = "day") -> Dict[str, Dict[str, float]]:
+        # Per-account metric totals over [start, end), rounded out to whole buckets
+        with self._lock:
+            window, _ = self._rollup(granularity).window(start, end)
+            names, rows = self._rows(accounts)
+            sums = np.zeros((len(rows), len(METRICS)), dtype=np.int64)
+            present = rows < window.shape[0]
+            sums[present] = window[rows[present]].sum(axis=1, dtype=np.int64)
+
+        report = {}
+        for name, row in zip(names, sums):
+            entry = dict(zip(METRICS, row.tolist()))
+            interactions = sum(entry[metric] for metric in INTERACTIONS)
+            entry["interactions"] = interactions
+            entry["engagement_rate"] = interactions / entry["reach"] if entry["reach"] else 0.0
+            report[name] = entry
+        return report
+
+    def series(self, account: str, start: float, end: float, granularity: str = "day") -> List[Dict[str, Any]]:
+        with self._lock:
+            rollup = self._rollup(granularity)
+            window, first = rollup.window(start, end)
+            index = self.accounts.get(account)
+            if index is None or index >= window.shape[0]:
+                return []
+            rows = window[index].copy()
+        return [{"start": (first + offset) * rollup.width, **dict(zip(METRICS, row.tolist()))}
+                for offset, row in enumerate(rows)]
+
+    def post_totals(self, posts: List[Tuple[str, str]]) -> Tuple[np.ndarray, np.ndarray]:
+        # Latest cumulative counters of each (account, post_id) as a (posts, metrics)
+        # array, plus a mask of the posts that have any snapshot at all
+        with self._lock:
+            indices = np.array([self.posts.get((account, str(post_id)), -1) for account, post_id in posts],
+                               dtype=np.int64)
+            found = indices >= 0
+            totals = np.zeros((len(indices), len(METRICS)), dtype=np.int64)
+            totals[found] = self._last_values[indices[found]]
+        return totals, found
+
+    def fleet_series(self, start: float, end: float, granularity: str = "day") -> np.ndarray:
+        # (buckets, metrics) totals across every account
+        with self._lock:
+            window, _ = self._rollup(granularity).window(start, end)
+            return window.sum(axis=0, dtype=np.int64)
+
+
+def run_benchmark(accounts: int = 300, posts: int = 60, days: int = 365, snapshots: int = 12) -> Dict[str, Any]:
+    rng = np.random.default_rng(11)
+    end = time.time() // DAY * DAY
+    start = end - days * DAY
+
+    batch = []
+    for account in range(accounts):
+        for post in range(posts):
+            posted = start + rng.uniform(0, days - 2) * DAY
+            counts = np.zeros(len(METRICS), dtype=np.int64)
+            for step in range(snapshots):
+                counts = counts + rng.poisson([40, 4, 3, 1, 300, 450])
+                batch.append({"account": f"account{account}", "post_id": f"{account}-{post}",
+                              "timestamp": posted + step * 4 * HOUR,
+                              **dict(zip(METRICS, counts.tolist()))})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = AggregationStore(tmp, batch_size=20000)
+        began = time.perf_counter()
+        for offset in range(0, len(batch), store.batch_size):
+            store.ingest(batch[offset:offset + store.batch_size])
+        ingest_seconds = time.perf_counter() - began
+
+        timings = []
+        for _ in range(20):
+            began = time.perf_counter()
+            store.totals(start, end)
+            timings.append(time.perf_counter() - began)
+
+        began = time.perf_counter()
+        store.close()
+        AggregationStore(tmp)
+        reload_seconds = time.perf_counter() - began
+
+    return {
+        "accounts": accounts,
+        "snapshots": len(batch),
+        "ingest_per_second": round(len(batch) / ingest_seconds),
+        "report_ms": round(1000 * float(np.median(timings)), 3),
+        "checkpoint_and_reload_seconds": round(reload_seconds, 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the analytics aggregation store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    bench = subparsers.add_parser("bench", help="Ingest a synthetic year of snapshots and time a fleet report")
+    bench.add_argument("--accounts", type=int, default=300)
+    bench.add_argument("--posts", type=int, default=60, help="Posts per account")
+    bench.add_argument("--days", type=int, default=365)
+    args = parser.parse_args()
+
+    print(json.dumps(run_benchmark(args.accounts, args.posts, args.days), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,8 +2,13 @@
 Content Generation Module - AI-powered content creation using OpenAI and Midjourney
 """
 
-from .content_generator import ContentGenerator
-from .image_generator import ImageGenerator
-from .caption_generator import CaptionGenerator
+from ..utils.lazy import lazy_exports
 
-__all__ = ['ContentGenerator', 'ImageGenerator', 'CaptionGenerator']
\ No newline at end of file
+_EXPORTS = {
+    'ContentGenerator': '.content_generator',
+    'ImageGenerator': '.image_generator',
+    'CaptionGenerator': '.caption_generator'
+}
+
+__all__ = list(_EXPORTS)
+__getattr__ = lazy_exports(__name__, _EXPORTS)
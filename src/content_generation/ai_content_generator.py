@@ -1,53 +1,62 @@
 import os
 import json
-import time
-import random
+import shutil
 import logging
-import requests
-from typing import Dict, List, Optional, Tuple, Any
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+from typing import Dict, Iterator, List, Optional, Tuple, Any
 from dotenv import load_dotenv
 import subprocess
 from PIL import Image
 from .image_analyzer import ImageAnalyzer
+from .task_tracker import MidjourneyTaskTracker
+from .job_store import GenerationJob
+from .api_health import ApiHealth
+from .text_cache import TextResponseCache, NearDuplicateIndex
+from .renditions import RenditionEngine, store_renditions
+from .media_store import MediaStore
+from .phash_index import PerceptualHashIndex
+from .calibration import ImageFeatureStore
+from ..utils.http_pool import HttpPool, get_http_pool
+from ..utils.downloads import stream_download
+from ..utils.metrics import get_registry, record_span, span
 
-# Load environment variables
-load_dotenv()
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("content_generator.log"),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
+# Identifier of the caption template, part of every cached caption key.
+# Bump it when the template changes so old responses are not reused.
+CAPTION_TEMPLATE = "historical-caption-v1"
+
 class AIContentGenerator:
-    def __init__(self):
+    def __init__(self, http_pool: Optional[HttpPool] = None):
         try:
+            # Load environment variables
+            load_dotenv()
+            
+            # Shared keep-alive transport for every OpenAI/Midjourney request
+            self.http = http_pool or get_http_pool()
+            
             self.openai_api_key = os.getenv("OPENAI_API_KEY")
             self.midjourney_api_key = os.getenv("MIDJOURNEY_API_KEY")
             self.midjourney_api_url = os.getenv("MIDJOURNEY_API_URL", "https://api.goapi.ai")
-            
-            # Flag to track API availability
-            self.openai_available = False
-            self.midjourney_available = False
+            self.batch_max_in_flight = int(os.getenv("CONTENT_BATCH_MAX_IN_FLIGHT", 4))
+            self.task_timeout = float(os.getenv("MIDJOURNEY_TASK_TIMEOUT", 300))
+            self.upscale_top_k = int(os.getenv("MIDJOURNEY_UPSCALE_TOP_K", 1))
+            self.upscale_strategy = os.getenv("MIDJOURNEY_UPSCALE_STRATEGY", "first")
+            self.text_model = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+            self.max_text_attempts = int(os.getenv("TEXT_DEDUP_MAX_ATTEMPTS", 3))
             
             if not self.openai_api_key:
                 logger.warning("OpenAI API key not found in environment variables")
-            else:
-                logger.info("OpenAI API key found")
-                self.openai_available = True
                 
             if not self.midjourney_api_key:
                 logger.warning("Midjourney API key not found in environment variables")
-            else:
-                logger.info("Midjourney API key found")
             
-            # Test API keys by making minimal API calls
-            self._test_api_keys()
+            # Keys are validated lazily on first use of openai_available /
+            # midjourney_available, or in the background if configured.
+            # Results are cached on disk and shared by every process.
+            self.api_health = ApiHealth(self.http, self.openai_api_key, self.midjourney_api_key, self.midjourney_api_url)
+            if os.getenv("API_HEALTH_CHECK", "lazy").lower() == "background":
+                self.api_health.refresh_in_background()
             
             # Set up image directories
             self.static_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "web_interface", "static")
@@ -57,283 +66,417 @@ class AIContentGenerator:
             os.makedirs(self.generated_images_dir, exist_ok=True)
             os.makedirs(self.fallback_images_dir, exist_ok=True)
             
+            # Grids, final images and renditions are stored under their
+            # SHA-256 and served from /media with immutable cache headers
+            self.media_store = MediaStore()
+            
             # Initialize image analyzer
-            self.image_analyzer = ImageAnalyzer()
+            self.image_analyzer = ImageAnalyzer(http_pool=self.http)
+            
+            # Perceptual hashes of every final image, so visually repeated
+            # grid quadrants are dropped before paying for an upscale
+            self.image_dedup_enabled = os.getenv("IMAGE_DEDUP_ENABLED", "true").lower() == "true"
+            self.image_hash_index = PerceptualHashIndex() if self.image_dedup_enabled else None
+            
+            # Raw metrics of each final image, joined with engagement later to
+            # calibrate the analyzer's weights (content_generation.calibration)
+            self.image_features_enabled = os.getenv("IMAGE_FEATURES_ENABLED", "true").lower() == "true"
+            self.image_features = ImageFeatureStore() if self.image_features_enabled else None
+            
+            # Instagram and web renditions of each final image; the worker
+            # processes only start when the first image needs them
+            self.renditions_enabled = os.getenv("RENDITIONS_ENABLED", "true").lower() == "true"
+            self.rendition_timeout = float(os.getenv("RENDITION_TIMEOUT", 120))
+            self.rendition_engine = RenditionEngine()
+            
+            # Cached OpenAI responses and near-duplicate checks for prompts and captions
+            self.text_cache = TextResponseCache()
+            self.prompt_index = NearDuplicateIndex("image_prompt")
+            self.caption_index = NearDuplicateIndex("caption")
+            
+            # Status tracking for every Midjourney task this generator starts
+            self.task_tracker = MidjourneyTaskTracker(self.http, self.midjourney_api_url, self.midjourney_api_key)
             
             logger.info("AIContentGenerator initialized successfully")
         except Exception as e:
             logger.error(f"Error initializing AIContentGenerator: {str(e)}")
             raise
 
+    @property
+    def openai_available(self) -> bool:
+        return self.api_health.is_available("openai")
+
+    @property
+    def midjourney_available(self) -> bool:
+        return self.api_health.is_available("midjourney")
+
     def _test_api_keys(self):
-        # Test OpenAI API key
-        if self.openai_api_key:
+        # Force a fresh check of both keys, bypassing the cache
+        for service in ("openai", "midjourney"):
+            self.api_health.refresh(service)
+        return self.openai_available or self.midjourney_available
+
+    def _midjourney_headers(self) -> Dict[str, str]:
+        return {
+            "Content-Type": "application/json",
+            "x-api-key": self.midjourney_api_key
+        }
+
+    def _submit_midjourney_task(self, task_type: str, task_input: Dict[str, Any]) -> str:
+        payload = {
+            "model": "midjourney",
+            "task_type": task_type,
+            "input": task_input
+        }
+        
+        config = self.task_tracker.task_config()
+        if config:
+            payload["config"] = config
+        
+        response = self.http.post(
+            f"{self.midjourney_api_url}/api/v1/task",
+            headers=self._midjourney_headers(),
+            json=payload,
+            rate_limit=f"midjourney_{task_type}"
+        )
+        
+        if response.status_code != 200:
+            error_msg = f"Midjourney API error: {response.status_code} - {response.text}"
+            logger.error(error_msg)
+            raise Exception(error_msg)
+        
+        response_data = response.json()
+        logger.debug(f"API response: {response_data}")
+        
+        task_id = response_data.get("data", {}).get("task_id")
+        
+        if not task_id:
+            error_msg = f"No task_id in Midjourney {task_type} response"
+            logger.error(error_msg)
+            raise Exception(error_msg)
+        
+        return task_id
+
+    def _record(self, job: Optional[GenerationJob], **fields):
+        if job is not None:
+            job.record(**fields)
+
+    def _check_lease(self, job: Optional[GenerationJob]):
+        # Called before spending Midjourney credits on a job another worker now owns
+        if job is not None:
+            job.check()
+
+    def _abandon_task(self, job: Optional[GenerationJob]):
+        # The imagine task can never finish, so the retry must submit a new
+        # one instead of resuming it; the prompt is kept
+        self._record(job, stage="prompt", imagine_task_id=None, upscale_tasks=None, image_url=None)
+
+    def _upscale_best_quadrant(self, task_id: str, grid_url: str, top_k: int = 1, strategy: str = "first",
+                               job: Optional[GenerationJob] = None) -> Tuple[str, Optional[Dict[str, Any]]]:
+        # Returns the URL of the final image and, when it was already
+        # downloaded while comparing candidates, the download result
+        upscale_tasks = job.get("upscale_tasks") if job else None
+        if upscale_tasks:
+            logger.info(f"Resuming upscale tasks {list(upscale_tasks)} for job {job.id}")
+        else:
+            upscale_tasks = self._submit_upscales(task_id, grid_url, top_k, job)
+        
+        if not upscale_tasks:
+            return grid_url, None
+        
+        with span("upscale", candidates=len(upscale_tasks), strategy=strategy):
+            return self._wait_for_upscales(task_id, grid_url, upscale_tasks, strategy)
+
+    def _wait_for_upscales(self, task_id: str, grid_url: str, upscale_tasks: Dict[str, int],
+                           strategy: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        # Speculative mode: several quadrants are upscaled at once. "first"
+        # keeps whichever finishes first; "best" waits for all of them and
+        # keeps the one that scores highest after upscaling.
+        completed = []
+        finished = self.task_tracker.wait_many(list(upscale_tasks), timeout=self.task_timeout)
+        try:
+            for upscale_task_id, upscale in finished:
+                upscale_url = (upscale.get("output") or {}).get("image_url")
+                if (upscale.get("status") or "").lower() != "completed" or not upscale_url:
+                    logger.error(f"Upscale of image {upscale_tasks[upscale_task_id] + 1} failed")
+                    continue
+                completed.append((upscale_tasks[upscale_task_id], upscale_url))
+                if strategy != "best":
+                    break
+        finally:
+            finished.close()
+        
+        if not completed:
+            logger.error("No upscale task completed, using the grid image")
+            return grid_url, None
+        
+        if len(completed) == 1:
+            logger.info(f"Successfully retrieved upscaled image {completed[0][0] + 1}")
+            return completed[0][1], None
+        
+        return self._select_best_upscale(task_id, completed)
+
+    def _submit_upscales(self, task_id: str, grid_url: str, top_k: int,
+                         job: Optional[GenerationJob] = None) -> Dict[str, int]:
+        logger.info("Multiple images available. Analyzing grid for best image.")
+        
+        try:
+            with span("grid_download"):
+                grid = stream_download(self.http, grid_url, self.media_store.incoming_path(source_url=grid_url),
+                                       keep_in_memory=True)
+        except Exception as e:
+            logger.error(f"Error downloading grid image: {str(e)}")
+            return {}
+        grid_path = self.media_store.put_file(grid["path"], "grid", sha256=grid["sha256"], source=task_id)["path"]
+        logger.info(f"Grid image saved to {grid_path}")
+        
+        with span("grid_analysis"):
+            # Decode from the bytes already in memory instead of reading the file back
+            grid_image = Image.open(grid["buffer"])
+            ranking = self.image_analyzer.rank_grid_image(grid_image)
+            logger.info(f"Grid ranking: {[(index + 1, round(score, 3)) for index, score in ranking]}")
+            
+            duplicates = self._duplicate_quadrants(grid_image) if self.image_hash_index is not None else {}
+        
+        ranking = [(index, score) for index, score in ranking if index not in duplicates]
+        if not ranking:
+            # Start over from a new prompt on retry rather than resuming this grid
+            self._record(job, stage="prompt", prompt=None, imagine_task_id=None)
+            raise Exception("Every image in the grid duplicates an earlier image")
+        
+        candidates = [index for index, _ in ranking[:max(1, min(top_k, len(ranking)))]]
+        self._check_lease(job)
+        
+        upscale_tasks = {}
+        for index in candidates:
+            logger.info(f"Requesting upscale of image {index + 1}")
             try:
-                headers = {
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {self.openai_api_key}"
-                }
-                
-                data = {
-                    "model": "gpt-3.5-turbo",
-                    "messages": [
-                        {"role": "user", "content": "test"}
-                    ],
-                    "max_tokens": 5
-                }
-                
-                response = requests.post(
-                    "https://api.openai.com/v1/chat/completions",
-                    headers=headers,
-                    json=data,
-                    timeout=10
-                )
-                
-                if response.status_code == 200:
-                    self.openai_available = True
-                    logger.info("OpenAI API key is valid")
-                else:
-                    self.openai_available = False
-                    logger.warning(f"OpenAI API key test failed: {response.status_code} - {response.text}")
+                upscale_task_id = self._submit_midjourney_task("upscale", {
+                    "origin_task_id": task_id,
+                    "index": str(index + 1)
+                })
+                upscale_tasks[upscale_task_id] = index
             except Exception as e:
-                self.openai_available = False
-                logger.warning(f"Error testing OpenAI API key: {str(e)}")
+                logger.error(f"Upscale request failed: {str(e)}")
         
-        # Test Midjourney API key
-        if self.midjourney_api_key:
+        self._record(job, stage="upscale", grid_url=grid_url, grid_path=grid_path, upscale_tasks=upscale_tasks)
+        return upscale_tasks
+
+    def _duplicate_quadrants(self, grid_image: Image.Image) -> Dict[int, str]:
+        duplicates = {}
+        for index, (phash_value, dhash_value) in enumerate(self.image_analyzer.grid_perceptual_hashes(grid_image)):
+            match = self.image_hash_index.find_duplicate(phash_value, dhash_value)
+            if match:
+                logger.info(f"Grid image {index + 1} duplicates {match[0]} (distance {match[1]}), skipping it")
+                duplicates[index] = match[0]
+        return duplicates
+
+    def _index_final_image(self, image_path: str, public_path: str):
+        if self.image_hash_index is None:
+            return
+        try:
+            with Image.open(image_path) as image:
+                # Hashes only need a 32x32 thumbnail, so let the JPEG decoder scale down
+                image.draft("L", (64, 64))
+                self.image_hash_index.add(public_path, *self.image_analyzer.perceptual_hashes(image))
+        except Exception as e:
+            logger.warning(f"Could not index {image_path} for duplicate detection: {str(e)}")
+
+    def _record_image_features(self, image_path: str, public_path: str):
+        if self.image_features is None:
+            return
+        try:
+            with Image.open(image_path) as image:
+                # Served from the score cache when the "best" strategy already scored this upscale
+                raw_metrics = self.image_analyzer.image_raw_metrics(image)
+            self.image_features.record(public_path, raw_metrics, self.image_analyzer.metric_version)
+        except Exception as e:
+            logger.warning(f"Could not record image metrics for {image_path}: {str(e)}")
+
+    def _select_best_upscale(self, task_id: str,
+                             completed: List[Tuple[int, str]]) -> Tuple[str, Optional[Dict[str, Any]]]:
+        # Each candidate is downloaded once and scored from memory; the winner
+        # becomes the final image without being fetched again
+        best = None
+        for index, upscale_url in completed:
+            candidate_path = self.media_store.incoming_path(source_url=upscale_url)
             try:
-                headers = {
-                    "Content-Type": "application/json",
-                    "x-api-key": self.midjourney_api_key
-                }
-                
-                test_payload = {
-                    "model": "midjourney",
-                    "task_type": "imagine",
-                    "input": {
-                        "prompt": "test",
-                        "aspect_ratio": "1:1",
-                        "process_mode": "fast",
-                        "skip_prompt_check": True
-                    }
-                }
-                
-                response = requests.post(
-                    f"{self.midjourney_api_url}/api/v1/task",
-                    headers=headers,
-                    json=test_payload,
-                    timeout=10
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    task_id = result.get("data", {}).get("task_id")
-                    
-                    if task_id:
-                        self.midjourney_available = True
-                        logger.info(f"Midjourney API key is valid (task ID: {task_id})")
-                    else:
-                        self.midjourney_available = False
-                        logger.warning("Midjourney API key test failed: No task_id in response")
-                else:
-                    self.midjourney_available = False
-                    logger.warning(f"Midjourney API key test failed: {response.status_code} - {response.text}")
-                    
+                download = stream_download(self.http, upscale_url, candidate_path, keep_in_memory=True)
             except Exception as e:
-                self.midjourney_available = False
-                logger.warning(f"Error testing Midjourney API key: {str(e)}")
-                
-        return self.openai_available or self.midjourney_available
+                logger.error(f"Error downloading upscale of image {index + 1}: {str(e)}")
+                continue
+            
+            score = self.image_analyzer.analyze_image(Image.open(download["buffer"]))
+            download["buffer"] = None
+            logger.info(f"Upscaled image {index + 1} scored {score:.3f}")
+            
+            if best is None or score > best[0]:
+                if best is not None:
+                    os.remove(best[3]["path"])
+                best = (score, index, upscale_url, download)
+            else:
+                os.remove(candidate_path)
+        
+        if best is None:
+            return completed[0][1], None
+        
+        logger.info(f"Kept upscaled image {best[1] + 1} (score {best[0]:.3f})")
+        return best[2], best[3]
 
-    def generate_image(self, prompt: str) -> Optional[str]:
+    def generate_image(self, prompt: str, upscale_top_k: Optional[int] = None,
+                       upscale_strategy: Optional[str] = None,
+                       job: Optional[GenerationJob] = None) -> Optional[str]:
+        # upscale_top_k > 1 upscales that many of the best-ranked quadrants in
+        # parallel, trading extra credits for latency; upscale_strategy picks
+        # "first" (first to finish) or "best" (highest score after upscaling)
+        upscale_top_k = upscale_top_k or self.upscale_top_k
+        upscale_strategy = upscale_strategy or self.upscale_strategy
+        # With a job, every stage is persisted and a resumed job skips the
+        # stages it already finished instead of spending credits again
         try:
-            logger.info(f"Generating image with Midjourney: {prompt}")
-            
-            headers = {
-                "Content-Type": "application/json",
-                "x-api-key": self.midjourney_api_key
-            }
+            task_id = job.get("imagine_task_id") if job else None
+            image_url = job.get("image_url") if job else None
+            if image_url:
+                logger.info(f"Resuming final download for job {job.id}")
+                return self._download_final_image(task_id, image_url, None, job)
             
-            payload = {
-                "model": "midjourney",
-                "task_type": "imagine",
-                "input": {
-                    "prompt": prompt,
-                    "aspect_ratio": "1:1",
-                    "process_mode": "fast",
-                    "skip_prompt_check": False
-                }
-            }
+            if task_id:
+                logger.info(f"Resuming Midjourney task {task_id} for job {job.id}")
+            else:
+                logger.info(f"Generating image with Midjourney: {prompt}")
+                self._check_lease(job)
+                
+                with span("imagine_submit"):
+                    task_id = self._submit_midjourney_task("imagine", {
+                        "prompt": prompt,
+                        "aspect_ratio": "1:1",
+                        "process_mode": "fast",
+                        "skip_prompt_check": False
+                    })
+                logger.info(f"Midjourney task started with ID: {task_id}")
+                self._record(job, stage="imagine", imagine_task_id=task_id)
             
-            response = requests.post(
-                f"{self.midjourney_api_url}/api/v1/task",
-                headers=headers,
-                json=payload,
-                timeout=15
-            )
+            timings = {}
+            try:
+                task = self.task_tracker.wait(task_id, timeout=self.task_timeout, timings=timings)
+                record_span("midjourney_task", timings["total"], task_id=task_id)
+                if "render" in timings:
+                    record_span("queue_wait", timings["queue_wait"], task_id=task_id)
+                    record_span("render", timings["render"], task_id=task_id)
+            except TimeoutError:
+                error_msg = "Timed out waiting for Midjourney task to complete"
+                logger.error(error_msg)
+                self._abandon_task(job)
+                raise Exception(error_msg)
             
-            response_data = response.json()
-            logger.info(f"API response: {response_data}")
+            status = (task.get("status") or "").lower()
             
-            if response.status_code != 200:
-                error_msg = f"Midjourney API error: {response.status_code} - {response.text}"
+            if status == "failed":
+                error = (task.get("error") or {}).get("message", "Unknown error")
+                error_msg = f"Midjourney task failed: {error}"
                 logger.error(error_msg)
+                self._abandon_task(job)
                 raise Exception(error_msg)
             
-            task_id = response_data.get("data", {}).get("task_id")
+            image_url = (task.get("output") or {}).get("image_url")
+            actions = (task.get("output") or {}).get("actions", [])
             
-            if not task_id:
-                error_msg = "No task_id in Midjourney API response"
+            if not image_url:
+                error_msg = "No image_url in completed task"
                 logger.error(error_msg)
+                self._abandon_task(job)
                 raise Exception(error_msg)
             
-            logger.info(f"Midjourney task started with ID: {task_id}")
-            
-            max_polls = 30
-            poll_interval = 10
+            download = None
+            if "upscale1" in actions:
+                image_url, download = self._upscale_best_quadrant(task_id, image_url, upscale_top_k,
+                                                                  upscale_strategy, job)
             
-            for i in range(max_polls):
-                logger.info(f"Polling Midjourney API for results (attempt {i+1}/{max_polls})")
-                
-                status_response = requests.get(
-                    f"{self.midjourney_api_url}/api/v1/task/{task_id}",
-                    headers=headers,
-                    timeout=15
-                )
-                
-                if status_response.status_code != 200:
-                    logger.error(f"Error getting task status: {status_response.status_code} - {status_response.text}")
-                    time.sleep(poll_interval)
-                    continue
-                
-                status_result = status_response.json()
-                logger.info(f"Status result: {status_result}")
-                
-                status = status_result.get("data", {}).get("status", "").lower()
-                
-                if status == "completed":
-                    image_url = status_result.get("data", {}).get("output", {}).get("image_url")
-                    actions = status_result.get("data", {}).get("output", {}).get("actions", [])
-                    
-                    if not image_url:
-                        error_msg = "No image_url in completed task"
-                        logger.error(error_msg)
-                        raise Exception(error_msg)
-                    
-                    if "upscale1" in actions:
-                        logger.info("Multiple images available. Analyzing grid for best image.")
-                        
-                        grid_filename = f"midjourney_grid_{int(time.time())}.jpg"
-                        grid_path = os.path.join(self.generated_images_dir, grid_filename)
-                        grid_response = requests.get(image_url, timeout=30)
-                        
-                        if grid_response.status_code == 200:
-                            with open(grid_path, 'wb') as f:
-                                f.write(grid_response.content)
-                            logger.info(f"Grid image saved to {grid_path}")
-                            
-                            grid_image = Image.open(grid_path)
-                            best_index = self.image_analyzer.analyze_grid_image(grid_image)
-                            logger.info(f"Selected image {best_index + 1} as the best option")
-                            
-                            upscale_payload = {
-                                "model": "midjourney",
-                                "task_type": "upscale",
-                                "input": {
-                                    "origin_task_id": task_id,
-                                    "index": str(best_index + 1)
-                                }
-                            }
-                            
-                            logger.info(f"Requesting upscale of image {best_index + 1}")
-                            upscale_response = requests.post(
-                                f"{self.midjourney_api_url}/api/v1/task",
-                                headers=headers,
-                                json=upscale_payload,
-                                timeout=15
-                            )
-                            
-                            if upscale_response.status_code != 200:
-                                logger.error(f"Upscale request failed: {upscale_response.status_code} - {upscale_response.text}")
-                                image_url = image_url
-                            else:
-                                upscale_data = upscale_response.json()
-                                upscale_task_id = upscale_data.get("data", {}).get("task_id")
-                                
-                                if not upscale_task_id:
-                                    logger.error("No task_id in upscale response")
-                                    image_url = image_url
-                                else:
-                                    for j in range(max_polls):
-                                        logger.info(f"Polling for upscale result (attempt {j+1}/{max_polls})")
-                                        
-                                        upscale_status_response = requests.get(
-                                            f"{self.midjourney_api_url}/api/v1/task/{upscale_task_id}",
-                                            headers=headers,
-                                            timeout=15
-                                        )
-                                        
-                                        if upscale_status_response.status_code == 200:
-                                            upscale_status = upscale_status_response.json()
-                                            upscale_status_str = upscale_status.get("data", {}).get("status", "").lower()
-                                            
-                                            if upscale_status_str == "completed":
-                                                upscale_url = upscale_status.get("data", {}).get("output", {}).get("image_url")
-                                                if upscale_url:
-                                                    image_url = upscale_url
-                                                    logger.info("Successfully retrieved upscaled image")
-                                                    break
-                                            elif upscale_status_str == "failed":
-                                                logger.error("Upscale task failed")
-                                                break
-                                        
-                                        time.sleep(poll_interval)
-                    
-                    logger.info(f"Downloading final image from {image_url}")
-                    image_filename = f"midjourney_{int(time.time())}.jpg"
-                    image_path = os.path.join(self.generated_images_dir, image_filename)
-                    
-                    img_response = requests.get(image_url, timeout=30)
-                    
-                    if img_response.status_code != 200:
-                        error_msg = f"Error downloading image: {img_response.status_code}"
-                        logger.error(error_msg)
-                        raise Exception(error_msg)
-                    
-                    with open(image_path, 'wb') as f:
-                        f.write(img_response.content)
-                    
-                    logger.info(f"Final image saved to {image_path}")
-                    return f"/static/generated_images/{image_filename}"
-                
-                elif status == "failed":
-                    error = status_result.get("data", {}).get("error", {}).get("message", "Unknown error")
-                    error_msg = f"Midjourney task failed: {error}"
-                    logger.error(error_msg)
-                    raise Exception(error_msg)
-                
-                elif status in ["processing", "pending", "staged"]:
-                    progress = status_result.get("data", {}).get("output", {}).get("progress", 0)
-                    logger.info(f"Task is {status} ({progress}% complete), waiting...")
-                    time.sleep(poll_interval)
-                else:
-                    logger.warning(f"Unknown status: {status}")
-                    time.sleep(poll_interval)
-            
-            error_msg = "Timed out waiting for Midjourney task to complete"
-            logger.error(error_msg)
-            raise Exception(error_msg)
+            self._record(job, stage="download", image_url=image_url)
+            return self._download_final_image(task_id, image_url, download, job)
             
         except Exception as e:
             logger.error(f"Error generating image: {str(e)}")
             raise Exception(f"Failed to generate image with Midjourney: {str(e)}")
 
-    def generate_historical_content(self, theme: Optional[str] = None) -> Dict[str, Any]:
+    def _download_final_image(self, task_id: str, image_url: str, download: Optional[Dict[str, Any]],
+                              job: Optional[GenerationJob] = None) -> str:
+        with span("final_download", cached=download is not None):
+            if download is None:
+                logger.info(f"Downloading final image from {image_url}")
+                download = stream_download(self.http, image_url, self.media_store.incoming_path(source_url=image_url))
+            item = self.media_store.put_file(download["path"], "original", sha256=download["sha256"],
+                                             source=task_id)
+        image_path = item["path"]
+        public_path = item["url"]
+        logger.info(f"Final image saved to {image_path} ({download['size']} bytes)")
+        self.media_store.maybe_evict()
+        self._index_final_image(image_path, public_path)
+        self._record_image_features(image_path, public_path)
+        self._record(job, stage="caption", image_path=public_path)
+        return public_path
+
+    def _unique_image_prompt(self, theme: Optional[str] = None) -> str:
+        # Every prompt is checked against recent ones before a Midjourney
+        # task is submitted, so near-duplicates never cost an image
+        # generation. The check and the insert are atomic, so concurrent
+        # batch threads cannot both accept near-duplicates. Prompts are not
+        # cached: an accepted one is recorded on its job and reused when a
+        # failed generation is retried.
+        for attempt in range(1, self.max_text_attempts + 1):
+            prompt = self.generate_image_prompt(theme)
+            match = self.prompt_index.add_if_unique(prompt)
+            if match is None:
+                return prompt
+            
+            logger.info(f"Image prompt is a near-duplicate ({match[1]:.2f}) of a recent prompt, "
+                        f"regenerating (attempt {attempt}/{self.max_text_attempts})")
+        
+        raise Exception(f"Could not generate a distinct image prompt after {self.max_text_attempts} attempts")
+
+    def _unique_caption(self, image_prompt: str, theme: Optional[str] = None) -> str:
+        key = self.text_cache.make_key("caption", theme, CAPTION_TEMPLATE, self.text_model, image_prompt)
+        caption = self.text_cache.get(key)
+        if caption is not None:
+            return caption
+        
+        for attempt in range(1, self.max_text_attempts + 1):
+            caption = self.generate_caption(image_prompt, theme)
+            match = self.caption_index.add_if_unique(caption)
+            if match is None:
+                break
+            logger.info(f"Caption is a near-duplicate ({match[1]:.2f}) of a recent caption, "
+                        f"regenerating (attempt {attempt}/{self.max_text_attempts})")
+        else:
+            logger.warning("Keeping a near-duplicate caption after exhausting regeneration attempts")
+            self.caption_index.add(caption)
+        
+        self.text_cache.put(key, "caption", caption)
+        return caption
+
+    def generate_historical_content(self, theme: Optional[str] = None, job: Optional[GenerationJob] = None,
+                                    upscale_top_k: Optional[int] = None,
+                                    upscale_strategy: Optional[str] = None) -> Dict[str, Any]:
+        # One trace per package; the stages below are its child spans
+        with span("generate_content", theme=theme or "Historical", job_id=job.id if job else None) as current:
+            content = self._generate_historical_content(theme, job, upscale_top_k, upscale_strategy)
+            current.set(success=bool(content.get("success")))
+        get_registry().inc("instanexus_generations_total", status="success" if content.get("success") else "failed")
+        return content
+
+    def _generate_historical_content(self, theme: Optional[str], job: Optional[GenerationJob],
+                                     upscale_top_k: Optional[int], upscale_strategy: Optional[str]) -> Dict[str, Any]:
         try:
-            image_prompt = self.generate_image_prompt(theme)
+            image_prompt = job.get("prompt") if job else None
+            if not image_prompt:
+                with span("prompt"):
+                    image_prompt = self._unique_image_prompt(theme)
+                self._record(job, stage="prompt", prompt=image_prompt)
             
             try:
-                image_path = self.generate_image(image_prompt)
+                image_path = job.get("image_path") if job else None
+                if not image_path:
+                    image_path = self.generate_image(image_prompt, upscale_top_k, upscale_strategy, job)
                 if not image_path:
                     raise Exception("Failed to generate image")
             except Exception as e:
@@ -343,13 +486,25 @@ class AIContentGenerator:
                     "error": f"Failed to generate image: {str(e)}"
                 }
             
-            caption = self.generate_caption(image_prompt, theme)
+            # Renditions are built in worker processes while the caption is written
+            renditions = rendition_dir = None
+            if self.renditions_enabled:
+                local_path = self.media_store.local_path(image_path)
+                if local_path is None:
+                    # Image from before the media store
+                    local_path = os.path.join(self.generated_images_dir, os.path.basename(image_path))
+                rendition_dir = self.media_store.incoming_path("")
+                renditions = self.rendition_engine.submit(local_path, rendition_dir)
+            
+            with span("caption"):
+                caption = self._unique_caption(image_prompt, theme)
             
             return {
                 "success": True,
                 "theme": theme or "Historical",
                 "image_prompt": image_prompt,
                 "image_path": image_path,
+                "renditions": self._collect_renditions(renditions, rendition_dir),
                 "caption": caption
             }
         except Exception as e:
@@ -359,7 +514,32 @@ class AIContentGenerator:
                 "error": str(e)
             }
 
-    def generate_batch_content(self, count: int = 3, theme: Optional[str] = None) -> List[Dict[str, Any]]:
+    def _collect_renditions(self, future, output_dir: Optional[str]) -> Dict[str, Dict[str, str]]:
+        # name -> format -> /media URL of the finished renditions, if any
+        if future is None:
+            return {}
+        try:
+            try:
+                result = future.result(timeout=self.rendition_timeout)
+            except FutureTimeoutError:
+                future.cancel()
+                logger.warning(f"Renditions not ready after {self.rendition_timeout:.0f}s, continuing without them")
+                return {}
+            if "error" in result:
+                # The original image is still usable, so a failed rendition is not fatal
+                logger.warning(f"Could not build renditions for {result['source']}: {result['error']}")
+                return {}
+            
+            return store_renditions(self.media_store, result)
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    def generate_batch_content(self, count: int = 3, theme: Optional[str] = None,
+                               max_in_flight: Optional[int] = None) -> List[Dict[str, Any]]:
+        max_in_flight = max_in_flight or self.batch_max_in_flight
+        if max_in_flight > 1:
+            return list(self.iter_batch_content(count, theme, max_in_flight))
+        
         results = []
         
         for i in range(count):
@@ -367,14 +547,36 @@ class AIContentGenerator:
             content = self.generate_historical_content(theme)
             results.append(content)
             
-            if i < count - 1:
-                delay = random.uniform(5, 15)
-                logger.info(f"Waiting {delay:.2f} seconds before next generation...")
-                time.sleep(delay)
-        
         return results
 
+    def iter_batch_content(self, count: int = 3, theme: Optional[str] = None,
+                           max_in_flight: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        # Each package spends nearly all of its time waiting on Midjourney, so
+        # running them side by side makes the batch as slow as its slowest task.
+        # Results are yielded in completion order, not submission order.
+        max_in_flight = max(1, min(max_in_flight or self.batch_max_in_flight, count))
+        logger.info(f"Generating {count} content packages with up to {max_in_flight} in flight")
+        
+        executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="content-batch")
+        try:
+            futures = [executor.submit(self.generate_historical_content, theme) for _ in range(count)]
+            for done, future in enumerate(as_completed(futures), 1):
+                content = future.result()
+                logger.info(f"Content package {done}/{count} finished (success={content.get('success')})")
+                yield content
+        finally:
+            # Stop queued packages if the caller abandons the stream early
+            executor.shutdown(wait=True, cancel_futures=True)
+
 if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("content_generator.log"),
+            logging.StreamHandler()
+        ]
+    )
     generator = AIContentGenerator()
     content = generator.generate_historical_content()
     print(json.dumps(content, indent=2))
\ No newline at end of file
@@ -0,0 +1,131 @@
+"""
+API Health - Cheap, cached credential checks for OpenAI and Midjourney
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import Dict, Optional, Any
+
+from ..utils.http_pool import HttpPool
+from ..utils.paths import data_path
+
+logger = logging.getLogger(__name__)
+
+SERVICES = ("openai", "midjourney")
+
+
+class ApiHealth:
+    # Results are cached in a small JSON file, keyed by a fingerprint of the
+    # service and key, and reused for API_HEALTH_TTL seconds by every process
+    # on the host. The probes are read-only: listing OpenAI models and looking
+    # up a Midjourney task id that does not exist. Neither costs a generation.
+
+    def __init__(self, http: HttpPool, openai_api_key: Optional[str], midjourney_api_key: Optional[str],
+                 midjourney_api_url: str, ttl: Optional[float] = None, cache_path: Optional[str] = None):
+        self.http = http
+        self.keys = {"openai": openai_api_key, "midjourney": midjourney_api_key}
+        self.midjourney_api_url = midjourney_api_url
+        self.ttl = ttl if ttl is not None else float(os.getenv("API_HEALTH_TTL", 900))
+        self.cache_path = cache_path or os.getenv("API_HEALTH_CACHE_PATH") or data_path("api_health.json")
+
+        self._lock = threading.Lock()
+        self._results: Dict[str, Dict[str, Any]] = {}
+        self._background = None
+
+    def _fingerprint(self, service: str) -> str:
+        return hashlib.sha256(f"{service}:{self.keys[service]}".encode()).hexdigest()[:16]
+
+    def _read_cache(self) -> Dict[str, Any]:
+        try:
+            with open(self.cache_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_cache(self, service: str, result: Dict[str, Any]):
+        cache = self._read_cache()
+        cache[self._fingerprint(service)] = result
+        # Write-then-rename so concurrent readers never see a partial file
+        directory = os.path.dirname(self.cache_path)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".api_health")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(cache, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.warning(f"Could not write API health cache: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _fresh(self, result: Optional[Dict[str, Any]]) -> bool:
+        return bool(result) and time.time() - result.get("checked_at", 0) < self.ttl
+
+    def is_available(self, service: str) -> bool:
+        if not self.keys[service]:
+            return False
+
+        result = self._results.get(service)
+        if not self._fresh(result):
+            result = self._read_cache().get(self._fingerprint(service))
+            if self._fresh(result):
+                self._results[service] = result
+            else:
+                result = self.refresh(service)
+        return result["available"]
+
+    def refresh(self, service: str) -> Dict[str, Any]:
+        with self._lock:
+            probe = self._probe_openai if service == "openai" else self._probe_midjourney
+            available, detail = probe()
+            result = {"available": available, "detail": detail, "checked_at": time.time()}
+            self._results[service] = result
+            self._write_cache(service, result)
+
+        log = logger.info if available else logger.warning
+        log(f"{service} API key check: {'valid' if available else 'unavailable'} ({detail})")
+        return result
+
+    def refresh_in_background(self) -> threading.Thread:
+        def run():
+            for service in SERVICES:
+                if self.keys[service]:
+                    self.is_available(service)
+
+        self._background = threading.Thread(target=run, name="api-health", daemon=True)
+        self._background.start()
+        return self._background
+
+    def _probe_openai(self):
+        try:
+            response = self.http.get(
+                "https://api.openai.com/v1/models",
+                headers={"Authorization": f"Bearer {self.keys['openai']}"},
+                rate_limit="openai"
+            )
+            if response.status_code == 200:
+                return True, "ok"
+            return False, f"{response.status_code} - {response.text[:200]}"
+        except Exception as e:
+            return False, str(e)
+
+    def _probe_midjourney(self):
+        # Looking up an unknown task id is free. Authentication failures
+        # answer 401/403; any other 4xx means the key itself was accepted.
+        try:
+            response = self.http.get(
+                f"{self.midjourney_api_url}/api/v1/task/00000000-0000-0000-0000-000000000000",
+                headers={"x-api-key": self.keys["midjourney"]},
+                rate_limit="midjourney_status"
+            )
+            if response.status_code in (401, 403):
+                return False, f"{response.status_code} - {response.text[:200]}"
+            if response.status_code >= 500:
+                return False, f"service error {response.status_code}"
+            return True, "ok"
+        except Exception as e:
+            return False, str(e)
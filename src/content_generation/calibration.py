@@ -0,0 +1,307 @@
+"""
+Calibration - Fit ImageAnalyzer weights and normalization limits against post engagement
+
+Usage:
+    python -m src.content_generation.calibration fit [--dry-run] [--force]
+    python -m src.content_generation.calibration bench [--posts 100000]
+
+Every final image's raw metric vector (sharpness, contrast, detail, noise) is
+stored with the post it was published as. A fit joins those vectors with the
+latest engagement counters from the analytics store, solves one ridge
+regression over the whole history, and writes the result to
+IMAGE_CALIBRATION_PATH, where running ImageAnalyzers pick it up.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import sqlite3
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple, Any
+
+import numpy as np
+
+from .image_analyzer import METRIC_NAMES, normalize_raw_metrics, calibration_path
+from ..analytics.aggregation import METRICS, INTERACTIONS, AggregationStore
+from ..utils.paths import data_path
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS image_features (
+    source TEXT PRIMARY KEY,
+    metric_version TEXT NOT NULL,
+    sharpness REAL NOT NULL,
+    contrast REAL NOT NULL,
+    detail REAL NOT NULL,
+    noise REAL NOT NULL,
+    account TEXT,
+    post_id TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS image_features_post ON image_features (account, post_id);
+"""
+
+DEFAULT_WEIGHTS = {"sharpness": 0.3, "contrast": 0.2, "detail": 0.3, "noise": 0.2}
+DEFAULT_NORMALIZATION = {"sharpness": 1000, "contrast": 100, "detail": 50, "noise": 30}
+
+
+class ImageFeatureStore:
+    # Raw metrics of each final image keyed by its public path, plus the
+    # (account, post_id) it went out as once it has been posted. Rows are
+    # never updated by the scoring path, so recording is a single upsert.
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv("IMAGE_FEATURES_DB") or data_path("image_features.sqlite3")
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def record(self, source: str, raw_metrics: np.ndarray, metric_version: str):
+        values = [float(value) for value in np.asarray(raw_metrics, dtype=np.float64)]
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO image_features (source, metric_version, sharpness, contrast, detail, noise, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(source) DO UPDATE SET "
+                "metric_version = excluded.metric_version, sharpness = excluded.sharpness, "
+                "contrast = excluded.contrast, detail = excluded.detail, noise = excluded.noise",
+                (source, metric_version, *values, time.time())
+            )
+
+    def record_many(self, rows: List[Tuple[str, str, Optional[str], Optional[str], np.ndarray]]):
+        # (source, metric_version, account, post_id, raw_metrics) tuples, for backfills
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO image_features "
+                "(source, metric_version, account, post_id, sharpness, contrast, detail, noise, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(source, version, account, post_id, *map(float, raw), now)
+                 for source, version, account, post_id, raw in rows]
+            )
+
+    def link_post(self, source: str, account: str, post_id: str) -> bool:
+        with self._connect() as conn:
+            cursor = conn.execute("UPDATE image_features SET account = ?, post_id = ? WHERE source = ?",
+                                  (account, str(post_id), source))
+        return cursor.rowcount > 0
+
+    def load(self, metric_version: str) -> Tuple[List[Tuple[str, str]], np.ndarray]:
+        # (account, post_id) keys and a (posts, 4) raw metric matrix of every posted image
+        rows = self._connect().execute(
+            "SELECT account, post_id, sharpness, contrast, detail, noise FROM image_features "
+            "WHERE metric_version = ? AND post_id IS NOT NULL", (metric_version,)
+        ).fetchall()
+        keys = [(row[0], row[1]) for row in rows]
+        raw = np.array([row[2:] for row in rows], dtype=np.float64).reshape(-1, len(METRIC_NAMES))
+        return keys, raw
+
+    def get_counts(self) -> Dict[str, int]:
+        total, posted = self._connect().execute(
+            "SELECT COUNT(*), COUNT(post_id) FROM image_features"
+        ).fetchone()
+        return {"images": total, "posted": posted}
+
+
+def engagement_targets(totals: np.ndarray, accounts: List[str]) -> np.ndarray:
+    # log(1 + interactions), centred per account. Follower count dominates raw
+    # engagement, so each post is only compared with the rest of its account.
+    columns = [METRICS.index(name) for name in INTERACTIONS]
+    target = np.log1p(totals[:, columns].sum(axis=1).astype(np.float64))
+    codes, inverse = np.unique(np.asarray(accounts, dtype=object).astype(str), return_inverse=True)
+    means = np.bincount(inverse, weights=target, minlength=len(codes)) / np.bincount(inverse, minlength=len(codes))
+    return target - means[inverse]
+
+
+def _correlation(scores: np.ndarray, target: np.ndarray) -> float:
+    if len(scores) < 2 or scores.std() == 0 or target.std() == 0:
+        return 0.0
+    return float(np.corrcoef(scores, target)[0, 1])
+
+
+def fit_calibration(raw: np.ndarray, target: np.ndarray, current_weights: Optional[Dict[str, float]] = None,
+                    current_normalization: Optional[Dict[str, float]] = None, ridge: Optional[float] = None,
+                    percentile: Optional[float] = None, holdout: float = 0.2, seed: int = 7) -> Dict[str, Any]:
+    # Normalization limits become a high percentile of each raw metric, so
+    # the 1.0 cap is hit by the best few percent of real images rather than
+    # by a guessed constant. Weights are a ridge regression of the target on
+    # the normalized metrics, solved in one lstsq call on the augmented
+    # system [X; sqrt(ridge) I] b = [y; 0], then clipped to be non-negative
+    # and scaled to sum to 1 like the defaults. Both models are scored by
+    # their correlation with the target on a held-out split.
+    ridge = ridge if ridge is not None else float(os.getenv("IMAGE_CALIBRATION_RIDGE", 1.0))
+    percentile = percentile if percentile is not None else float(os.getenv("IMAGE_CALIBRATION_PERCENTILE", 95))
+    current_weights = current_weights or DEFAULT_WEIGHTS
+    current_normalization = current_normalization or DEFAULT_NORMALIZATION
+
+    samples = len(raw)
+    order = np.random.default_rng(seed).permutation(samples)
+    split = samples - int(samples * holdout)
+    train, test = order[:split], order[split:]
+
+    limits = np.percentile(raw[train], percentile, axis=0)
+    # A metric that is constant at zero would divide by zero; keep its old limit
+    fallback = np.array([current_normalization[name] for name in METRIC_NAMES], dtype=np.float64)
+    limits = np.where(limits > 0, limits, fallback)
+
+    features = normalize_raw_metrics(raw, limits)
+    x_train = features[train] - features[train].mean(axis=0)
+    y_train = target[train] - target[train].mean()
+    system = np.vstack([x_train, np.sqrt(ridge) * np.eye(len(METRIC_NAMES))])
+    rhs = np.concatenate([y_train, np.zeros(len(METRIC_NAMES))])
+    coefficients = np.linalg.lstsq(system, rhs, rcond=None)[0]
+
+    weights = np.clip(coefficients, 0.0, None)
+    if weights.sum() > 0:
+        weights = weights / weights.sum()
+    else:
+        # Nothing helps engagement on this history; keep the current weights
+        weights = np.array([current_weights[name] for name in METRIC_NAMES], dtype=np.float64)
+
+    current = normalize_raw_metrics(raw[test], fallback) @ np.array(
+        [current_weights[name] for name in METRIC_NAMES], dtype=np.float64)
+    return {
+        "weights": {name: round(float(value), 6) for name, value in zip(METRIC_NAMES, weights)},
+        "normalization": {name: round(float(value), 6) for name, value in zip(METRIC_NAMES, limits)},
+        "coefficients": {name: round(float(value), 6) for name, value in zip(METRIC_NAMES, coefficients)},
+        "samples": samples,
+        "ridge": ridge,
+        "percentile": percentile,
+        "holdout": {
+            "samples": len(test),
+            "current_correlation": round(_correlation(current, target[test]), 4),
+            "calibrated_correlation": round(_correlation(features[test] @ weights, target[test]), 4)
+        }
+    }
+
+
+def save_calibration(calibration: Dict[str, Any], path: Optional[str] = None) -> str:
+    # Written to a temporary file and renamed, so a reader never sees half a file
+    path = path or calibration_path()
+    directory = os.path.dirname(path) or "."
+    with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".tmp", delete=False) as f:
+        json.dump(calibration, f, indent=2)
+    os.replace(f.name, path)
+    return path
+
+
+class Calibrator:
+    # Joins the feature store with the analytics store and fits. The new
+    # model is only saved when it beats the current one on the holdout by
+    # at least IMAGE_CALIBRATION_MIN_GAIN, so a refit on a noisy week of
+    # data does not undo a good calibration.
+
+    def __init__(self, features: Optional[ImageFeatureStore] = None, analytics: Optional[AggregationStore] = None,
+                 min_posts: Optional[int] = None, min_gain: Optional[float] = None):
+        self.features = features or ImageFeatureStore()
+        self.analytics = analytics or AggregationStore()
+        self.min_posts = min_posts or int(os.getenv("IMAGE_CALIBRATION_MIN_POSTS", 200))
+        self.min_gain = min_gain if min_gain is not None else float(os.getenv("IMAGE_CALIBRATION_MIN_GAIN", 0.0))
+
+    def dataset(self, metric_version: str) -> Tuple[np.ndarray, np.ndarray]:
+        keys, raw = self.features.load(metric_version)
+        totals, found = self.analytics.post_totals(keys)
+        accounts = [account for (account, _), present in zip(keys, found) if present]
+        return raw[found], engagement_targets(totals[found], accounts)
+
+    def fit(self, analyzer, save: bool = True, force: bool = False) -> Dict[str, Any]:
+        start = time.perf_counter()
+        raw, target = self.dataset(analyzer.metric_version)
+        load_seconds = time.perf_counter() - start
+        if len(raw) < self.min_posts:
+            raise Exception(f"Only {len(raw)} posts with both image metrics and engagement, "
+                            f"need {self.min_posts} to calibrate")
+
+        start = time.perf_counter()
+        calibration = fit_calibration(raw, target, analyzer.metrics, analyzer.normalization)
+        calibration["metric_version"] = analyzer.metric_version
+        calibration["fitted_at"] = time.time()
+        calibration["timings"] = {"load_seconds": round(load_seconds, 3),
+                                  "fit_seconds": round(time.perf_counter() - start, 3)}
+
+        holdout = calibration["holdout"]
+        gain = holdout["calibrated_correlation"] - holdout["current_correlation"]
+        calibration["applied"] = False
+        if save and (force or gain >= self.min_gain):
+            calibration["applied"] = True
+            calibration["path"] = save_calibration(calibration)
+            analyzer.apply_calibration(calibration["weights"], calibration["normalization"])
+            logger.info(f"Saved image calibration ({calibration['samples']} posts, holdout correlation "
+                        f"{holdout['current_correlation']} -> {holdout['calibrated_correlation']})")
+        elif save:
+            logger.info(f"Kept current image weights: calibrated holdout correlation "
+                        f"{holdout['calibrated_correlation']} vs {holdout['current_correlation']}")
+        return calibration
+
+
+def run_benchmark(posts: int = 100000, accounts: int = 300, seed: int = 7) -> Dict[str, Any]:
+    # Synthetic history where engagement depends on sharpness and detail only,
+    # timed end to end through the real feature store and analytics store
+    rng = np.random.default_rng(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        features = ImageFeatureStore(os.path.join(tmp, "features.sqlite3"))
+        analytics = AggregationStore(os.path.join(tmp, "analytics"), batch_size=posts)
+
+        raw = np.column_stack([rng.gamma(2.0, 300.0, posts), rng.normal(60, 15, posts).clip(1),
+                               rng.gamma(2.0, 12.0, posts), rng.gamma(2.0, 4.0, posts)])
+        account_ids = rng.integers(accounts, size=posts)
+        signal = 0.6 * np.minimum(raw[:, 0] / 1500, 1) + 0.4 * np.minimum(raw[:, 2] / 60, 1)
+        likes = np.exp(3 + account_ids % 5 + signal + rng.normal(0, 0.5, posts)).astype(np.int64)
+
+        features.record_many([(f"/static/generated_images/{i}.jpg", "bench", f"account_{account_ids[i]}", str(i), raw[i])
+                              for i in range(posts)])
+        analytics.ingest({"account": f"account_{account_ids[i]}", "post_id": str(i), "timestamp": 1.7e9 + i,
+                          "likes": int(likes[i]), "comments": int(likes[i] // 20)} for i in range(posts))
+
+        class _Analyzer:
+            metric_version = "bench"
+            metrics = dict(DEFAULT_WEIGHTS)
+            normalization = dict(DEFAULT_NORMALIZATION)
+
+            def apply_calibration(self, weights, normalization):
+                self.metrics, self.normalization = dict(weights), dict(normalization)
+
+        start = time.perf_counter()
+        calibration = Calibrator(features, analytics, min_posts=1).fit(_Analyzer(), save=False)
+        calibration["timings"]["total_seconds"] = round(time.perf_counter() - start, 3)
+        analytics.close()
+    return calibration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate image scoring against post engagement")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    fit = subparsers.add_parser("fit", help="Fit and save weights from the stored history")
+    fit.add_argument("--dry-run", action="store_true", help="Report the fit without saving it")
+    fit.add_argument("--force", action="store_true", help="Save even if the holdout correlation does not improve")
+    bench = subparsers.add_parser("bench", help="Time a fit on a synthetic history")
+    bench.add_argument("--posts", type=int, default=100000)
+    bench.add_argument("--accounts", type=int, default=300)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.command == "fit":
+        from .image_analyzer import ImageAnalyzer
+        analyzer = ImageAnalyzer()
+        result = Calibrator().fit(analyzer, save=not args.dry_run, force=args.force)
+    else:
+        result = run_benchmark(posts=args.posts, accounts=args.accounts)
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
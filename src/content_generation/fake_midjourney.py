@@ -0,0 +1,265 @@
+"""
+Fake Midjourney - Local stand-in for the Midjourney task API, for latency and quota measurements
+
+Usage:
+    python -m src.content_generation.fake_midjourney [--port 8765] [--render-seconds 5]
+
+Then point MIDJOURNEY_API_URL at http://127.0.0.1:8765.
+"""
+
+import io
+import sys
+import json
+import time
+import uuid
+import zlib
+import argparse
+import logging
+import threading
+import urllib.request
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Any
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+class FakeMidjourneyServer:
+    # Tasks move from pending to processing to completed purely by wall
+    # clock, so status polls see the same progress reports as with the real
+    # provider. Prompts containing "[fail]" end in a failed task.
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 queue_seconds: float = 0.5, render_seconds: float = 3.0,
+                 upscale_seconds: float = 1.0, image_size: int = 512,
+                 api_key: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.queue_seconds = queue_seconds
+        self.render_seconds = render_seconds
+        self.upscale_seconds = upscale_seconds
+        self.image_size = image_size
+        self.api_key = api_key
+
+        self.tasks: Dict[str, Dict[str, Any]] = {}
+        self.request_counts = Counter()
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                server._dispatch(self, "POST")
+
+            def do_GET(self):
+                server._dispatch(self, "GET")
+
+            def log_message(self, format, *args):
+                logger.debug(f"Fake Midjourney: {format % args}")
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-midjourney", daemon=True)
+        self._thread.start()
+        logger.info(f"Fake Midjourney server listening on {self.url}")
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _dispatch(self, handler: BaseHTTPRequestHandler, method: str):
+        path = handler.path.split("?", 1)[0]
+        body = None
+        if method == "POST":
+            length = int(handler.headers.get("Content-Length", 0))
+            body = json.loads(handler.rfile.read(length) or b"{}")
+
+        if path.startswith("/api/") and self.api_key and handler.headers.get("x-api-key") != self.api_key:
+            return self._send_json(handler, 401, {"code": 401, "message": "invalid api key"})
+
+        if method == "POST" and path == "/api/v1/task":
+            self._count("submit")
+            return self._send_json(handler, 200, {"code": 200, "data": self._create_task(body), "message": "success"})
+
+        if method == "POST" and path == "/api/v1/task/batch":
+            self._count("status")
+            data = [self._task_view(task_id) for task_id in body.get("task_ids", []) if task_id in self.tasks]
+            return self._send_json(handler, 200, {"code": 200, "data": data, "message": "success"})
+
+        if method == "GET" and path.startswith("/api/v1/task/"):
+            self._count("status")
+            task_id = path.rsplit("/", 1)[-1]
+            if task_id not in self.tasks:
+                return self._send_json(handler, 404, {"code": 404, "message": "task not found"})
+            return self._send_json(handler, 200, {"code": 200, "data": self._task_view(task_id), "message": "success"})
+
+        if method == "GET" and path.startswith("/images/"):
+            self._count("download")
+            task_id = path.rsplit("/", 1)[-1].split(".", 1)[0]
+            if task_id not in self.tasks:
+                return self._send_bytes(handler, 404, b"", "text/plain")
+            return self._send_bytes(handler, 200, self._image_bytes(task_id), "image/jpeg")
+
+        self._send_json(handler, 404, {"code": 404, "message": "not found"})
+
+    def _count(self, kind: str):
+        with self._lock:
+            self.request_counts[kind] += 1
+
+    def _send_json(self, handler: BaseHTTPRequestHandler, status: int, payload: Dict[str, Any]):
+        self._send_bytes(handler, status, json.dumps(payload).encode(), "application/json")
+
+    def _send_bytes(self, handler: BaseHTTPRequestHandler, status: int, body: bytes, content_type: str):
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _create_task(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        task_type = body.get("task_type", "imagine")
+        task_input = body.get("input", {})
+        duration = self.upscale_seconds if task_type == "upscale" else self.render_seconds
+
+        task_id = uuid.uuid4().hex
+        task = {
+            "task_id": task_id,
+            "task_type": task_type,
+            "input": task_input,
+            "created": time.monotonic(),
+            "duration": duration,
+            "fail": "[fail]" in str(task_input.get("prompt", "")),
+            "image": None
+        }
+        with self._lock:
+            self.tasks[task_id] = task
+
+        webhook = (body.get("config") or {}).get("webhook_config") or {}
+        if webhook.get("endpoint"):
+            timer = threading.Timer(self.queue_seconds + duration, self._send_webhook,
+                                    args=(task_id, webhook["endpoint"], webhook.get("secret", "")))
+            timer.daemon = True
+            timer.start()
+
+        return {"task_id": task_id, "status": "pending"}
+
+    def _task_view(self, task_id: str) -> Dict[str, Any]:
+        task = self.tasks[task_id]
+        elapsed = time.monotonic() - task["created"]
+        output: Dict[str, Any] = {"progress": 0}
+        error = {"message": ""}
+
+        if elapsed < self.queue_seconds:
+            status = "pending"
+        elif elapsed < self.queue_seconds + task["duration"]:
+            status = "processing"
+            output["progress"] = int(100 * (elapsed - self.queue_seconds) / task["duration"])
+        elif task["fail"]:
+            status = "failed"
+            error = {"message": "fake task failure"}
+        else:
+            status = "completed"
+            output = {
+                "progress": 100,
+                "image_url": f"{self.url}/images/{task_id}.jpg",
+                "actions": ["upscale1", "upscale2", "upscale3", "upscale4"] if task["task_type"] == "imagine" else []
+            }
+
+        return {
+            "task_id": task_id,
+            "model": "midjourney",
+            "task_type": task["task_type"],
+            "status": status,
+            "input": task["input"],
+            "output": output,
+            "error": error
+        }
+
+    def _send_webhook(self, task_id: str, endpoint: str, secret: str):
+        body = json.dumps({"timestamp": int(time.time()), "data": self._task_view(task_id)}).encode()
+        request = urllib.request.Request(endpoint, data=body, method="POST", headers={
+            "Content-Type": "application/json",
+            "X-Webhook-Secret": secret
+        })
+        try:
+            urllib.request.urlopen(request, timeout=5).close()
+            self._count("webhook")
+        except Exception as e:
+            logger.warning(f"Fake Midjourney webhook to {endpoint} failed: {str(e)}")
+
+    def _image_bytes(self, task_id: str) -> bytes:
+        task = self.tasks[task_id]
+        if task["image"] is None:
+            task["image"] = self._render(task_id, grid=task["task_type"] == "imagine")
+        return task["image"]
+
+    def _render(self, task_id: str, grid: bool) -> bytes:
+        # Each quadrant gets its own noise level so grid analysis has a real choice to make
+        rng = np.random.default_rng(zlib.crc32(task_id.encode()))
+        size = self.image_size
+        cells = 2 if grid else 1
+        cell = size // cells
+        yy, xx = np.mgrid[0:cell, 0:cell].astype(np.float32) / cell
+
+        pixels = np.zeros((size, size, 3), dtype=np.float32)
+        for index in range(cells * cells):
+            quadrant = rng.uniform(40, 200, size=3) + xx[..., None] * rng.uniform(-60, 60, size=3)
+            for _ in range(4):
+                cx, cy, radius = rng.uniform(0.1, 0.9), rng.uniform(0.1, 0.9), rng.uniform(0.05, 0.25)
+                quadrant[(xx - cx) ** 2 + (yy - cy) ** 2 < radius ** 2] = rng.uniform(0, 255, size=3)
+            quadrant += rng.normal(0.0, rng.uniform(0, 16), size=quadrant.shape)
+
+            top = (index // cells) * cell
+            left = (index % cells) * cell
+            pixels[top:top + cell, left:left + cell] = quadrant
+
+        buffer = io.BytesIO()
+        Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), "RGB").save(buffer, format="JPEG", quality=90)
+        return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local fake Midjourney API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--queue-seconds", type=float, default=0.5)
+    parser.add_argument("--render-seconds", type=float, default=3.0)
+    parser.add_argument("--upscale-seconds", type=float, default=1.0)
+    parser.add_argument("--image-size", type=int, default=512)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    server = FakeMidjourneyServer(args.host, args.port, args.queue_seconds, args.render_seconds,
+                                  args.upscale_seconds, args.image_size)
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
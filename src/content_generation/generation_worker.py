@@ -0,0 +1,122 @@
+"""
+Generation Worker - Pulls generation jobs from the shared JobStore and runs them to completion
+
+Usage:
+    python -m src.content_generation.generation_worker [--enqueue N] [--theme THEME] [--once]
+
+Any number of worker processes can run against the same job database.
+"""
+
+import os
+import sys
+import uuid
+import socket
+import argparse
+import logging
+import threading
+from typing import Optional
+
+from .job_store import JobStore, GenerationJob
+from ..utils.metrics import start_metrics_server
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationWorker:
+    def __init__(self, generator, store: Optional[JobStore] = None, worker_id: Optional[str] = None,
+                 lease_seconds: Optional[float] = None, idle_interval: Optional[float] = None):
+        self.generator = generator
+        self.store = store or JobStore()
+        # A stable WORKER_ID lets a restarted worker take back its own jobs
+        # immediately instead of waiting for their lease to run out; it must
+        # be unique to one worker. Without one, the id is unique per instance.
+        self.worker_id = (worker_id or os.getenv("WORKER_ID")
+                          or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}")
+        self.lease_seconds = lease_seconds or float(os.getenv("GENERATION_JOB_LEASE_SECONDS", 120))
+        self.idle_interval = idle_interval or float(os.getenv("GENERATION_WORKER_IDLE_INTERVAL", 5))
+        self._stop = threading.Event()
+        self._released = False
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self) -> bool:
+        if not self._released:
+            self.store.release(self.worker_id)
+            self._released = True
+
+        row = self.store.claim(self.worker_id, self.lease_seconds)
+        if row is None:
+            return False
+
+        job = GenerationJob(self.store, row, self.worker_id, self.lease_seconds)
+        heartbeat_stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, heartbeat_stop), daemon=True)
+        heartbeat.start()
+
+        try:
+            options = job.get("options", {})
+            content = self.generator.generate_historical_content(
+                job.get("theme"),
+                job=job,
+                upscale_top_k=options.get("upscale_top_k"),
+                upscale_strategy=options.get("upscale_strategy")
+            )
+            if content.get("success"):
+                self.store.complete(job.id, content, self.worker_id)
+            else:
+                self.store.fail(job.id, content.get("error", "Unknown error"), self.worker_id)
+        except Exception as e:
+            logger.error(f"Error processing generation job {job.id}: {str(e)}")
+            self.store.fail(job.id, str(e), self.worker_id)
+        finally:
+            heartbeat_stop.set()
+            heartbeat.join()
+
+        return True
+
+    def run_forever(self):
+        logger.info(f"Generation worker {self.worker_id} started")
+        while not self._stop.is_set():
+            if not self.run_once():
+                self._stop.wait(self.idle_interval)
+        logger.info(f"Generation worker {self.worker_id} stopped")
+
+    def _heartbeat(self, job: GenerationJob, stop: threading.Event):
+        # Keep the lease alive through long Midjourney waits. Once another
+        # worker has claimed the job, the run stops at its next stage.
+        while not stop.wait(self.lease_seconds / 3):
+            if not self.store.heartbeat(job.id, self.worker_id, self.lease_seconds):
+                logger.warning(f"Worker {self.worker_id} lost the lease on job {job.id}, stopping it")
+                job.lost.set()
+                return
+
+
+def main():
+    from .ai_content_generator import AIContentGenerator
+
+    parser = argparse.ArgumentParser(description="Run a content generation worker")
+    parser.add_argument("--enqueue", type=int, default=0, help="Queue this many jobs before starting")
+    parser.add_argument("--theme", help="Theme for queued jobs")
+    parser.add_argument("--once", action="store_true", help="Exit when the queue is empty")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    # Serves /metrics and /traces when METRICS_PORT is set
+    start_metrics_server()
+
+    store = JobStore()
+    for _ in range(args.enqueue):
+        store.enqueue(args.theme)
+
+    worker = GenerationWorker(AIContentGenerator(), store)
+    if args.once:
+        while worker.run_once():
+            pass
+    else:
+        worker.run_forever()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
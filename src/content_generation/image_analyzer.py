@@ -1,26 +1,98 @@
 import os
+import json
+import time
 import logging
-import requests
+import threading
 from PIL import Image
 import numpy as np
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 import cv2
 import io
+from ..utils.http_pool import HttpPool, get_http_pool
+from .score_cache import ScoreCache, content_hash
+from .phash_index import phash, dhash
+from ..utils.paths import data_path
+from ..utils.metrics import get_registry
 
 logger = logging.getLogger(__name__)
 
+# Column order of every raw/normalized metric array produced by ImageAnalyzer
+METRIC_NAMES = ("sharpness", "contrast", "detail", "noise")
+
+# Bump when the definition of a raw metric changes, so cached values are not reused
+METRICS_VERSION = 1
+
+# Noise estimators selectable through IMAGE_NOISE_METHOD:
+#   nlmeans     - mean residual against cv2.fastNlMeansDenoising (slow, reference)
+#   mad         - robust sigma from a high-pass residual (Immerkaer kernel + MAD)
+#   downsampled - nlmeans residual on an area-downsampled copy
+NOISE_METHODS = ("nlmeans", "mad", "downsampled")
+
+# Immerkaer's difference-of-Laplacians kernel. It cancels smooth image
+# structure, and its response to white noise of std sigma has std 6 * sigma.
+NOISE_KERNEL = np.array([[1, -2, 1],
+                         [-2, 4, -2],
+                         [1, -2, 1]], dtype=np.float32)
+
+# For zero-mean Gaussian noise: E|x| = sqrt(2/pi) * sigma and median|x| = 0.6745 * sigma
+MEAN_ABS_PER_SIGMA = float(np.sqrt(2.0 / np.pi))
+MEDIAN_ABS_PER_SIGMA = 0.6745
+
+
+def normalize_raw_metrics(raw_metrics: np.ndarray, limits: np.ndarray) -> np.ndarray:
+    # Raw values divided by their limits and capped at 1.0, for any number of
+    # leading dimensions. Less noise is better, so the noise column is inverted.
+    normalized = np.minimum(np.asarray(raw_metrics, dtype=np.float64) / limits, 1.0)
+    noise_index = METRIC_NAMES.index("noise")
+    normalized[..., noise_index] = 1.0 - normalized[..., noise_index]
+    return normalized
+
+
+def calibration_path() -> str:
+    return os.getenv("IMAGE_CALIBRATION_PATH") or data_path("image_calibration.json")
+
+
 class ImageAnalyzer:
-    def __init__(self):
+    def __init__(self, http_pool: Optional[HttpPool] = None, noise_method: Optional[str] = None,
+                 score_cache: Optional[ScoreCache] = None):
+        self.http = http_pool or get_http_pool()
+        self.score_cache = score_cache if score_cache is not None else ScoreCache.from_env()
+        
+        self.noise_method = noise_method or os.getenv("IMAGE_NOISE_METHOD", "mad")
+        if self.noise_method not in NOISE_METHODS:
+            raise ValueError(f"Unknown noise method '{self.noise_method}', expected one of {NOISE_METHODS}")
+        self.noise_downsample_factor = int(os.getenv("IMAGE_NOISE_DOWNSAMPLE_FACTOR", 2))
+        
         self.metrics = {
             "sharpness": 0.3,
             "contrast": 0.2,
             "detail": 0.3,
             "noise": 0.2
         }
+        
+        # Raw metric value that maps to a normalized score of 1.0
+        self.normalization = {
+            "sharpness": 1000,
+            "contrast": 100,
+            "detail": 50,
+            "noise": 30
+        }
+        
+        # Weights and normalization fitted against engagement by
+        # content_generation.calibration replace the defaults above. The file
+        # is re-checked every IMAGE_CALIBRATION_CHECK_INTERVAL seconds, so a
+        # refit is picked up by running processes without a restart.
+        self.calibration_enabled = os.getenv("IMAGE_CALIBRATION_ENABLED", "true").lower() == "true"
+        self.calibration_check_interval = float(os.getenv("IMAGE_CALIBRATION_CHECK_INTERVAL", 300))
+        self.calibration = None
+        self._calibration_mtime = None
+        self._calibration_checked = 0.0
+        self._calibration_lock = threading.Lock()
+        self._maybe_reload_calibration()
     
     def download_image(self, url: str) -> Optional[Image.Image]:
         try:
-            response = requests.get(url, timeout=30)
+            response = self.http.get(url, timeout=self.http.download_timeout)
             if response.status_code == 200:
                 return Image.open(io.BytesIO(response.content))
             return None
@@ -28,49 +100,156 @@ class ImageAnalyzer:
             logger.error(f"Error downloading image: {str(e)}")
             return None
     
+    def _to_array(self, image: Image.Image) -> np.ndarray:
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        return np.asarray(image)
+    
+    def _to_gray(self, img_array: np.ndarray) -> np.ndarray:
+        if img_array.ndim == 2:
+            return img_array
+        return cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+    
     def calculate_sharpness(self, img_array: np.ndarray) -> float:
-        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+        gray = self._to_gray(img_array)
         return cv2.Laplacian(gray, cv2.CV_64F).var()
     
     def calculate_contrast(self, img_array: np.ndarray) -> float:
-        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+        gray = self._to_gray(img_array)
         return gray.std()
     
     def calculate_detail(self, img_array: np.ndarray) -> float:
-        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+        gray = self._to_gray(img_array)
         edges = cv2.Canny(gray, 100, 200)
         return np.mean(edges)
     
-    def calculate_noise(self, img_array: np.ndarray) -> float:
-        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-        noise = cv2.fastNlMeansDenoising(gray)
-        return np.mean(np.abs(gray - noise))
+    def calculate_noise(self, img_array: np.ndarray, method: Optional[str] = None) -> float:
+        # Every estimator reports the mean absolute noise residual, so the same
+        # normalization limit applies whichever one is selected
+        gray = self._to_gray(img_array)
+        method = method or self.noise_method
+        
+        if method == "nlmeans":
+            return self._noise_nlmeans(gray)
+        if method == "mad":
+            return self._noise_mad(gray)
+        if method == "downsampled":
+            return self._noise_downsampled(gray)
+        raise ValueError(f"Unknown noise method '{method}', expected one of {NOISE_METHODS}")
+    
+    def _noise_nlmeans(self, gray: np.ndarray) -> float:
+        denoised = cv2.fastNlMeansDenoising(gray)
+        # Subtract in a signed type; uint8 arithmetic wraps negative residuals to ~255
+        return float(np.mean(np.abs(gray.astype(np.int16) - denoised)))
+    
+    def _noise_mad(self, gray: np.ndarray) -> float:
+        residual = cv2.filter2D(gray, cv2.CV_32F, NOISE_KERNEL)[1:-1, 1:-1]
+        # The median ignores the strong responses left by real edges
+        sigma = np.median(np.abs(residual)) / MEDIAN_ABS_PER_SIGMA / 6.0
+        return float(sigma * MEAN_ABS_PER_SIGMA)
+    
+    def _noise_downsampled(self, gray: np.ndarray) -> float:
+        factor = self.noise_downsample_factor
+        small = cv2.resize(gray, None, fx=1.0 / factor, fy=1.0 / factor, interpolation=cv2.INTER_AREA)
+        denoised = cv2.fastNlMeansDenoising(small)
+        # Averaging factor x factor pixels divides the std of white noise by factor
+        return float(np.mean(np.abs(small.astype(np.int16) - denoised)) * factor)
+    
+    def calculate_raw_metrics(self, gray: np.ndarray) -> np.ndarray:
+        # Each metric is timed into instanexus_image_metric_seconds{metric=...}
+        registry = get_registry()
+        values = []
+        for name, calculate in zip(METRIC_NAMES, (self.calculate_sharpness, self.calculate_contrast,
+                                                  self.calculate_detail, self.calculate_noise)):
+            started = time.perf_counter()
+            values.append(calculate(gray))
+            registry.observe("instanexus_image_metric_seconds", time.perf_counter() - started, metric=name)
+        return np.array(values, dtype=np.float64)
+    
+    def normalize_metrics(self, raw_metrics: np.ndarray) -> np.ndarray:
+        limits = np.array([self.normalization[name] for name in METRIC_NAMES], dtype=np.float64)
+        return normalize_raw_metrics(raw_metrics, limits)
+    
+    def weighted_scores(self, raw_metrics: np.ndarray) -> np.ndarray:
+        self._maybe_reload_calibration()
+        weights = np.array([self.metrics[name] for name in METRIC_NAMES], dtype=np.float64)
+        return self.normalize_metrics(raw_metrics) @ weights
+    
+    def apply_calibration(self, weights: Dict[str, float], normalization: Dict[str, float]):
+        # Both dicts are replaced rather than updated in place, so a scoring
+        # call running concurrently sees either the old or the new values
+        self.metrics = {name: float(weights[name]) for name in METRIC_NAMES}
+        self.normalization = {name: float(normalization[name]) for name in METRIC_NAMES}
+    
+    def _maybe_reload_calibration(self):
+        if not self.calibration_enabled:
+            return
+        now = time.time()
+        if now - self._calibration_checked < self.calibration_check_interval:
+            return
+        with self._calibration_lock:
+            if now - self._calibration_checked < self.calibration_check_interval:
+                return
+            self._calibration_checked = now
+            path = calibration_path()
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                return
+            if mtime == self._calibration_mtime:
+                return
+            self._calibration_mtime = mtime
+            try:
+                with open(path) as f:
+                    calibration = json.load(f)
+            except Exception as e:
+                logger.warning(f"Could not read image calibration {path}: {str(e)}")
+                return
+            # Fitted limits only make sense for the raw metrics they were fitted on
+            if calibration.get("metric_version") != self.metric_version:
+                logger.warning(f"Ignoring image calibration for metric version {calibration.get('metric_version')} "
+                               f"(current {self.metric_version})")
+                return
+            self.apply_calibration(calibration["weights"], calibration["normalization"])
+            self.calibration = calibration
+            logger.info(f"Loaded image calibration fitted on {calibration.get('samples')} posts: "
+                        f"weights {self.metrics}")
+    
+    @property
+    def metric_version(self) -> str:
+        # Everything that changes raw metric values; weights and normalization
+        # are applied after the cache and are deliberately not part of it
+        version = f"v{METRICS_VERSION}:{self.noise_method}"
+        if self.noise_method == "downsampled":
+            version += f":{self.noise_downsample_factor}"
+        return version
+    
+    def image_raw_metrics(self, image: Image.Image, kind: str = "image", url: Optional[str] = None) -> np.ndarray:
+        img_array = self._to_array(image)
+        
+        key = None
+        if self.score_cache is not None:
+            key = content_hash(img_array)
+            if url:
+                self.score_cache.put_url_hash(url, key)
+            cached = self.score_cache.get(key, kind, self.metric_version)
+            if cached is not None:
+                return cached
+        
+        gray = self._to_gray(img_array)
+        if kind == "grid":
+            raw_metrics = np.stack([self.calculate_raw_metrics(view) for view in self.grid_quadrant_views(gray)])
+        else:
+            raw_metrics = self.calculate_raw_metrics(gray)
+        
+        if key is not None:
+            self.score_cache.put(key, kind, self.metric_version, raw_metrics)
+        return raw_metrics
     
     def analyze_image(self, image: Image.Image) -> float:
         try:
-            img_array = np.array(image)
-            
-            sharpness = self.calculate_sharpness(img_array)
-            contrast = self.calculate_contrast(img_array)
-            detail = self.calculate_detail(img_array)
-            noise = self.calculate_noise(img_array)
-            
-            max_sharpness = 1000
-            max_contrast = 100
-            max_detail = 50
-            max_noise = 30
-            
-            normalized_scores = {
-                "sharpness": min(sharpness / max_sharpness, 1.0),
-                "contrast": min(contrast / max_contrast, 1.0),
-                "detail": min(detail / max_detail, 1.0),
-                "noise": 1.0 - min(noise / max_noise, 1.0)
-            }
-            
-            total_score = sum(score * self.metrics[metric] 
-                            for metric, score in normalized_scores.items())
-            
-            return total_score
+            raw_metrics = self.image_raw_metrics(image)
+            return float(self.weighted_scores(raw_metrics))
             
         except Exception as e:
             logger.error(f"Error analyzing image: {str(e)}")
@@ -81,12 +260,7 @@ class ImageAnalyzer:
             scores = []
             
             for url in image_urls:
-                image = self.download_image(url)
-                if image:
-                    score = self.analyze_image(image)
-                    scores.append(score)
-                else:
-                    scores.append(0.0)
+                scores.append(self.score_url(url))
             
             if not scores:
                 return 0, 0.0
@@ -98,6 +272,28 @@ class ImageAnalyzer:
             logger.error(f"Error selecting best image: {str(e)}")
             return 0, 0.0
     
+    def score_url(self, url: str) -> float:
+        try:
+            raw_metrics = None
+            
+            # URLs scored before are answered from the cache without downloading
+            if self.score_cache is not None:
+                key = self.score_cache.get_url_hash(url)
+                if key:
+                    raw_metrics = self.score_cache.get(key, "image", self.metric_version)
+            
+            if raw_metrics is None:
+                image = self.download_image(url)
+                if not image:
+                    return 0.0
+                raw_metrics = self.image_raw_metrics(image, url=url)
+            
+            return float(self.weighted_scores(raw_metrics))
+            
+        except Exception as e:
+            logger.error(f"Error scoring image {url}: {str(e)}")
+            return 0.0
+    
     def split_grid_image(self, grid_image: Image.Image) -> List[Image.Image]:
         width, height = grid_image.size
         cell_width = width // 2
@@ -116,12 +312,60 @@ class ImageAnalyzer:
         
         return images
     
+    def grid_quadrant_views(self, img_array: np.ndarray) -> List[np.ndarray]:
+        # Same geometry and order as split_grid_image, but as slices of the
+        # decoded array instead of PIL crops, so no pixels are copied
+        height, width = img_array.shape[:2]
+        cell_width = width // 2
+        cell_height = height // 2
+        
+        views = []
+        for y in range(2):
+            for x in range(2):
+                top = y * cell_height
+                left = x * cell_width
+                views.append(img_array[top:top + cell_height, left:left + cell_width])
+        
+        return views
+    
+    def grid_metric_matrix(self, grid_image: Image.Image) -> np.ndarray:
+        # Decode and convert to grayscale once for the whole grid. OpenCV treats
+        # each view as a standalone image, so the values match scoring the
+        # cropped quadrants one by one.
+        return self.image_raw_metrics(grid_image, kind="grid")
+    
+    def score_grid_image(self, grid_image: Image.Image) -> Dict[str, np.ndarray]:
+        raw_metrics = self.grid_metric_matrix(grid_image)
+        return {
+            "raw": raw_metrics,
+            "normalized": self.normalize_metrics(raw_metrics),
+            "scores": self.weighted_scores(raw_metrics)
+        }
+    
+    def perceptual_hashes(self, image: Image.Image) -> Tuple[int, int]:
+        # (pHash, dHash) of the whole image, for duplicate detection
+        gray = self._to_gray(self._to_array(image))
+        return phash(gray), dhash(gray)
+    
+    def grid_perceptual_hashes(self, grid_image: Image.Image) -> List[Tuple[int, int]]:
+        gray = self._to_gray(self._to_array(grid_image))
+        return [(phash(view), dhash(view)) for view in self.grid_quadrant_views(gray)]
+    
+    def rank_grid_image(self, grid_image: Image.Image) -> List[Tuple[int, float]]:
+        try:
+            scores = self.score_grid_image(grid_image)["scores"]
+            order = np.argsort(-scores, kind="stable")
+            return [(int(index), float(scores[index])) for index in order]
+            
+        except Exception as e:
+            logger.error(f"Error ranking grid image: {str(e)}")
+            return [(index, 0.0) for index in range(4)]
+    
     def analyze_grid_image(self, grid_image: Image.Image) -> int:
         try:
-            images = self.split_grid_image(grid_image)
-            scores = [self.analyze_image(img) for img in images]
-            return scores.index(max(scores))
+            scores = self.score_grid_image(grid_image)["scores"]
+            return int(np.argmax(scores))
             
         except Exception as e:
             logger.error(f"Error analyzing grid image: {str(e)}")
-            return 0
\ No newline at end of file
+            return 0
@@ -0,0 +1,249 @@
+"""
+Job Store - Durable queue and stage-by-stage state for content generation jobs
+"""
+
+import os
+import json
+import time
+import logging
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Any
+
+from ..utils.paths import data_path
+
+logger = logging.getLogger(__name__)
+
+# Stages a job passes through; each one is written before moving on, so a
+# restarted worker continues where the previous one stopped
+STAGES = ("queued", "prompt", "imagine", "upscale", "download", "caption", "done")
+
+_JSON_FIELDS = ("options", "upscale_tasks", "result")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS generation_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    theme TEXT,
+    options TEXT NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    prompt TEXT,
+    imagine_task_id TEXT,
+    grid_url TEXT,
+    grid_path TEXT,
+    upscale_tasks TEXT,
+    image_url TEXT,
+    image_path TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker_id TEXT,
+    lease_expires REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_generation_jobs_status ON generation_jobs (status, id);
+CREATE INDEX IF NOT EXISTS idx_generation_jobs_updated ON generation_jobs (updated_at);
+"""
+
+
+class JobStore:
+    def __init__(self, path: Optional[str] = None, max_attempts: Optional[int] = None):
+        self.path = path or os.getenv("GENERATION_JOB_DB") or data_path("generation_jobs.sqlite3")
+        self.max_attempts = max_attempts or int(os.getenv("GENERATION_JOB_MAX_ATTEMPTS", 3))
+        self._local = threading.local()
+
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode so claim() can take the write lock explicitly
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _decode(self, row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(row)
+        for field in _JSON_FIELDS:
+            job[field] = json.loads(job[field]) if job[field] else None
+        return job
+
+    def enqueue(self, theme: Optional[str] = None, options: Optional[Dict[str, Any]] = None) -> int:
+        now = time.time()
+        cursor = self._connect().execute(
+            "INSERT INTO generation_jobs (theme, options, status, stage, created_at, updated_at) "
+            "VALUES (?, ?, 'queued', 'queued', ?, ?)",
+            (theme, json.dumps(options or {}), now, now)
+        )
+        logger.info(f"Queued generation job {cursor.lastrowid} (theme: {theme or 'Historical'})")
+        return cursor.lastrowid
+
+    def claim(self, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        # BEGIN IMMEDIATE takes the database write lock before reading, so two
+        # workers (threads or processes) can never claim the same job. Running
+        # jobs whose lease ran out belong to a dead worker and are picked up
+        # again; a live lease is never taken over, whatever its worker id.
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id FROM generation_jobs "
+                "WHERE status = 'queued' OR (status = 'running' AND lease_expires < ?) "
+                "ORDER BY id LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+
+            conn.execute(
+                "UPDATE generation_jobs SET status = 'running', worker_id = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (worker_id, now + lease_seconds, now, row["id"])
+            )
+            job = self._decode(conn.execute("SELECT * FROM generation_jobs WHERE id = ?", (row["id"],)).fetchone())
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        logger.info(f"Worker {worker_id} claimed job {job['id']} at stage {job['stage']} (attempt {job['attempts']})")
+        return job
+
+    def release(self, worker_id: str) -> int:
+        # Requeue the running jobs recorded under worker_id, keeping their
+        # stage. For a worker that restarted under the same stable id, before
+        # it claims anything: its previous run's jobs resume immediately
+        # instead of waiting for their leases to run out.
+        count = self._connect().execute(
+            "UPDATE generation_jobs SET status = 'queued', worker_id = NULL, lease_expires = NULL, updated_at = ? "
+            "WHERE status = 'running' AND worker_id = ?",
+            (time.time(), worker_id)
+        ).rowcount
+        if count:
+            logger.info(f"Requeued {count} jobs left running by a previous run of worker {worker_id}")
+        return count
+
+    def heartbeat(self, job_id: int, worker_id: str, lease_seconds: float) -> bool:
+        cursor = self._connect().execute(
+            "UPDATE generation_jobs SET lease_expires = ? WHERE id = ? AND worker_id = ? AND status = 'running'",
+            (time.time() + lease_seconds, job_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def update(self, job_id: int, owner: Optional[str] = None, **fields) -> bool:
+        # With an owner, the write only applies while that worker still holds
+        # the job; returns False once another worker has taken it over
+        for field in _JSON_FIELDS:
+            if field in fields:
+                fields[field] = json.dumps(fields[field])
+        fields["updated_at"] = time.time()
+
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        if owner is None:
+            cursor = self._connect().execute(
+                f"UPDATE generation_jobs SET {assignments} WHERE id = ?",
+                (*fields.values(), job_id)
+            )
+        else:
+            cursor = self._connect().execute(
+                f"UPDATE generation_jobs SET {assignments} WHERE id = ? AND worker_id = ? AND status = 'running'",
+                (*fields.values(), job_id, owner)
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id: int, result: Dict[str, Any], owner: Optional[str] = None) -> bool:
+        if not self.update(job_id, owner, status="completed", stage="done", result=result, error=None,
+                           lease_expires=None):
+            logger.warning(f"Worker {owner} no longer holds generation job {job_id}, result discarded")
+            return False
+        logger.info(f"Generation job {job_id} completed")
+        return True
+
+    def fail(self, job_id: int, error: str, owner: Optional[str] = None) -> bool:
+        job = self.get(job_id)
+        if job and job["attempts"] < self.max_attempts:
+            # Keep the recorded stage so the retry resumes rather than restarts
+            if self.update(job_id, owner, status="queued", error=error, worker_id=None, lease_expires=None):
+                logger.warning(f"Generation job {job_id} failed (attempt {job['attempts']}/{self.max_attempts}), requeued: {error}")
+                return True
+        elif self.update(job_id, owner, status="failed", error=error, lease_expires=None):
+            logger.error(f"Generation job {job_id} failed permanently: {error}")
+            return True
+        logger.warning(f"Worker {owner} no longer holds generation job {job_id}, failure not recorded: {error}")
+        return False
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        return self._decode(self._connect().execute(
+            "SELECT * FROM generation_jobs WHERE id = ?", (job_id,)
+        ).fetchone())
+
+    def list_jobs(self, status: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        if status:
+            rows = self._connect().execute(
+                "SELECT * FROM generation_jobs WHERE status = ? ORDER BY id DESC LIMIT ?", (status, limit)
+            ).fetchall()
+        else:
+            rows = self._connect().execute(
+                "SELECT * FROM generation_jobs ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._decode(row) for row in rows]
+
+    def list_updated(self, since: float, ids: Optional[List[int]] = None, limit: int = 500) -> List[Dict[str, Any]]:
+        # Jobs changed after `since`, oldest change first; used to stream progress
+        if ids:
+            placeholders = ", ".join("?" for _ in ids)
+            rows = self._connect().execute(
+                f"SELECT * FROM generation_jobs WHERE updated_at > ? AND id IN ({placeholders}) "
+                "ORDER BY updated_at LIMIT ?", (since, *ids, limit)
+            ).fetchall()
+        else:
+            rows = self._connect().execute(
+                "SELECT * FROM generation_jobs WHERE updated_at > ? ORDER BY updated_at LIMIT ?", (since, limit)
+            ).fetchall()
+        return [self._decode(row) for row in rows]
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class GenerationJob:
+    # Handle passed through the generation pipeline. record() persists each
+    # stage as soon as it is reached and renews the worker's lease. Once
+    # another worker has claimed the job, record() and check() raise
+    # LeaseLost so this run stops instead of spending more credits.
+
+    def __init__(self, store: JobStore, row: Dict[str, Any], worker_id: str, lease_seconds: float):
+        self.store = store
+        self.row = row
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.lost = threading.Event()
+
+    @property
+    def id(self) -> int:
+        return self.row["id"]
+
+    def get(self, field: str, default: Any = None) -> Any:
+        value = self.row.get(field)
+        return default if value is None else value
+
+    def check(self):
+        if self.lost.is_set():
+            raise LeaseLost(f"Worker {self.worker_id} lost the lease on job {self.id}")
+
+    def record(self, **fields):
+        self.check()
+        if not self.store.update(self.id, self.worker_id, **dict(fields)):
+            self.lost.set()
+            self.check()
+        self.row.update(fields)
+        self.store.heartbeat(self.id, self.worker_id, self.lease_seconds)
@@ -0,0 +1,306 @@
+"""
+Media Store - Content-addressed, sharded storage for generated images with retention and eviction
+
+Usage:
+    python -m src.content_generation.media_store import DIR [--kind original]
+    python -m src.content_generation.media_store evict [--dry-run]
+    python -m src.content_generation.media_store stats
+
+Files are named by the SHA-256 of their bytes and sharded two levels deep
+(ab/cd/abcd....jpg), so names never collide, a directory never holds more
+than a few hundred files, and a URL always refers to the same bytes. The
+URL doubles as an immutable cache key: the web interface serves it with
+the hash as ETag and a one-year immutable Cache-Control. Every file has a
+row in an SQLite index, so lookups, retention and eviction never scan the
+directory tree.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import argparse
+import logging
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Any
+
+from ..utils.paths import data_path
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    sha256 TEXT PRIMARY KEY,
+    ext TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    parent TEXT,
+    source TEXT,
+    created_at REAL NOT NULL,
+    last_used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_media_kind_used ON media (kind, last_used_at);
+CREATE INDEX IF NOT EXISTS idx_media_parent ON media (parent);
+"""
+
+# Kinds of stored file. Grids are only needed until their upscale has been
+# requested; originals are the final images; renditions belong to an
+# original and are removed with it.
+KINDS = ("grid", "original", "rendition")
+
+_EXTENSIONS = {".jpg": "jpg", ".jpeg": "jpg", ".png": "png", ".webp": "webp"}
+
+# Public file name: 64 hex digits and a known extension
+FILENAME_PATTERN = re.compile(r"^([0-9a-f]{64})\.(jpg|png|webp)$")
+
+
+def file_sha256(path: str, chunk_size: int = 64 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaStore:
+    def __init__(self, root: Optional[str] = None, index_path: Optional[str] = None,
+                 url_prefix: Optional[str] = None):
+        self.root = root or os.getenv("MEDIA_STORE_DIR") or data_path("media")
+        self.index_path = index_path or os.getenv("MEDIA_INDEX_DB") or os.path.join(self.root, "index.sqlite3")
+        self.url_prefix = (url_prefix or os.getenv("MEDIA_URL_PREFIX", "/media")).rstrip("/")
+        self.incoming_dir = os.path.join(self.root, "incoming")
+        os.makedirs(self.incoming_dir, exist_ok=True)
+
+        self.grid_retention = float(os.getenv("MEDIA_GRID_RETENTION_HOURS", 24)) * 3600
+        self.original_retention = float(os.getenv("MEDIA_ORIGINAL_RETENTION_DAYS", 30)) * 86400
+        self.max_bytes = int(os.getenv("MEDIA_MAX_BYTES", 0))
+        self.evict_interval = float(os.getenv("MEDIA_EVICT_INTERVAL", 3600))
+        self._last_evict = 0.0
+
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.index_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    # Paths and URLs
+
+    def relative_path(self, sha256: str, ext: str) -> str:
+        return f"{sha256[:2]}/{sha256[2:4]}/{sha256}.{ext}"
+
+    def path_for(self, sha256: str, ext: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], f"{sha256}.{ext}")
+
+    def url_for(self, sha256: str, ext: str) -> str:
+        return f"{self.url_prefix}/{self.relative_path(sha256, ext)}"
+
+    def parse_url(self, url: str) -> Optional[Dict[str, str]]:
+        # sha256 and extension of a media URL (or bare file name), None for anything else
+        match = FILENAME_PATTERN.match(url.rsplit("/", 1)[-1])
+        if match is None:
+            return None
+        return {"sha256": match.group(1), "ext": match.group(2)}
+
+    def local_path(self, url: str) -> Optional[str]:
+        parsed = self.parse_url(url)
+        return self.path_for(parsed["sha256"], parsed["ext"]) if parsed else None
+
+    def incoming_path(self, suffix: str = ".jpg", source_url: Optional[str] = None) -> str:
+        # Scratch path for a download; put_file() moves it into place. Named
+        # after the source URL when there is one, so a download interrupted
+        # by a crash or restart finds its .part file again and resumes it.
+        name = hashlib.sha256(source_url.encode()).hexdigest()[:32] if source_url else uuid.uuid4().hex
+        return os.path.join(self.incoming_dir, f"{name}{suffix}")
+
+    # Writing
+
+    def put_file(self, path: str, kind: str, sha256: Optional[str] = None, parent: Optional[str] = None,
+                 source: Optional[str] = None, move: bool = True) -> Dict[str, Any]:
+        # Store a file under its content hash. An identical file that is
+        # already stored is reused, and the new copy is dropped.
+        if kind not in KINDS:
+            raise ValueError(f"Unknown media kind '{kind}', expected one of {KINDS}")
+        ext = _EXTENSIONS.get(os.path.splitext(path)[1].lower())
+        if ext is None:
+            raise ValueError(f"Unsupported media file type: {path}")
+        sha256 = sha256 or file_sha256(path)
+        dest = self.path_for(sha256, ext)
+        size = os.path.getsize(path)
+
+        if os.path.exists(dest):
+            if move:
+                os.remove(path)
+        else:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            if move:
+                os.replace(path, dest)
+            else:
+                # Copy next to the destination first so the final rename is atomic
+                tmp = f"{dest}.{uuid.uuid4().hex}.tmp"
+                shutil.copyfile(path, tmp)
+                os.replace(tmp, dest)
+
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO media (sha256, ext, kind, size, parent, source, created_at, last_used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(sha256) DO UPDATE SET last_used_at = excluded.last_used_at",
+                (sha256, ext, kind, size, parent, source, now, now)
+            )
+        return {"sha256": sha256, "ext": ext, "kind": kind, "size": size,
+                "path": dest, "url": self.url_for(sha256, ext)}
+
+    def touch(self, url: str):
+        # Mark an item (and its renditions) as used, pushing back its eviction
+        parsed = self.parse_url(url)
+        if parsed is None:
+            return
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("UPDATE media SET last_used_at = ? WHERE sha256 = ? OR parent = ?",
+                         (now, parsed["sha256"], parsed["sha256"]))
+
+    def get(self, sha256: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute("SELECT * FROM media WHERE sha256 = ?", (sha256,)).fetchone()
+        if row is None:
+            return None
+        item = dict(row)
+        item["url"] = self.url_for(item["sha256"], item["ext"])
+        return item
+
+    def renditions(self, sha256: str) -> List[Dict[str, Any]]:
+        rows = self._connect().execute("SELECT * FROM media WHERE parent = ?", (sha256,)).fetchall()
+        return [dict(row, url=self.url_for(row["sha256"], row["ext"])) for row in rows]
+
+    # Retention
+
+    def _delete(self, conn: sqlite3.Connection, rows: List[sqlite3.Row], dry_run: bool) -> int:
+        freed = 0
+        for row in rows:
+            freed += row["size"]
+            if dry_run:
+                continue
+            try:
+                os.remove(self.path_for(row["sha256"], row["ext"]))
+            except FileNotFoundError:
+                pass
+            conn.execute("DELETE FROM media WHERE sha256 = ?", (row["sha256"],))
+        return freed
+
+    def _with_renditions(self, conn: sqlite3.Connection, rows: List[sqlite3.Row]) -> List[sqlite3.Row]:
+        result = list(rows)
+        for row in rows:
+            result.extend(conn.execute("SELECT * FROM media WHERE parent = ?", (row["sha256"],)).fetchall())
+        return result
+
+    def evict(self, now: Optional[float] = None, dry_run: bool = False) -> Dict[str, Any]:
+        # Grids older than the grid retention, originals (with their
+        # renditions) unused for the original retention, then the least
+        # recently used originals until the store fits in max_bytes.
+        # Interrupted downloads left in incoming/ for a day are removed too.
+        now = now or time.time()
+        conn = self._connect()
+        stats = {"grids": 0, "originals": 0, "renditions": 0, "incoming": 0, "bytes_freed": 0}
+        with conn:
+            grids = conn.execute("SELECT * FROM media WHERE kind = 'grid' AND last_used_at < ?",
+                                 (now - self.grid_retention,)).fetchall()
+            stats["grids"] = len(grids)
+            stats["bytes_freed"] += self._delete(conn, grids, dry_run)
+
+            originals = conn.execute("SELECT * FROM media WHERE kind = 'original' AND last_used_at < ?",
+                                     (now - self.original_retention,)).fetchall()
+            if self.max_bytes:
+                total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM media").fetchone()[0]
+                excess = total - stats["bytes_freed"] - self.max_bytes
+                expired = {row["sha256"] for row in originals}
+                excess -= sum(row["size"] for row in self._with_renditions(conn, originals))
+                if excess > 0:
+                    for row in conn.execute("SELECT * FROM media WHERE kind = 'original' ORDER BY last_used_at"):
+                        if excess <= 0:
+                            break
+                        if row["sha256"] in expired:
+                            continue
+                        originals.append(row)
+                        excess -= sum(r["size"] for r in self._with_renditions(conn, [row]))
+
+            doomed = self._with_renditions(conn, originals)
+            stats["originals"] = len(originals)
+            stats["renditions"] = len(doomed) - len(originals)
+            stats["bytes_freed"] += self._delete(conn, doomed, dry_run)
+
+        for name in os.listdir(self.incoming_dir):
+            path = os.path.join(self.incoming_dir, name)
+            try:
+                if now - os.path.getmtime(path) > 86400:
+                    stats["incoming"] += 1
+                    if not dry_run:
+                        os.remove(path)
+            except OSError:
+                pass
+
+        self._last_evict = now
+        if not dry_run and (stats["grids"] or stats["originals"]):
+            logger.info(f"Evicted {stats['grids']} grids, {stats['originals']} originals and "
+                        f"{stats['renditions']} renditions ({stats['bytes_freed']} bytes)")
+        return stats
+
+    def maybe_evict(self):
+        # Cheap to call after every write; runs evict() at most once per interval
+        if time.time() - self._last_evict >= self.evict_interval:
+            try:
+                self.evict()
+            except Exception as e:
+                logger.warning(f"Media eviction failed: {str(e)}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        rows = self._connect().execute("SELECT kind, COUNT(*), COALESCE(SUM(size), 0) FROM media GROUP BY kind")
+        return {kind: {"files": count, "bytes": size} for kind, count, size in rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the content-addressed media store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    importer = subparsers.add_parser("import", help="Move a flat directory of images into the store")
+    importer.add_argument("directory", help="e.g. src/web_interface/static/generated_images")
+    importer.add_argument("--kind", choices=KINDS, default=None,
+                          help="Kind for every file (default: 'grid' for *grid* names, else 'original')")
+    importer.add_argument("--copy", action="store_true", help="Copy instead of moving the files")
+    evict = subparsers.add_parser("evict", help="Apply the retention policies now")
+    evict.add_argument("--dry-run", action="store_true")
+    subparsers.add_parser("stats", help="Files and bytes per kind")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    store = MediaStore()
+
+    if args.command == "import":
+        imported = {}
+        for name in sorted(os.listdir(args.directory)):
+            path = os.path.join(args.directory, name)
+            if not os.path.isfile(path) or os.path.splitext(name)[1].lower() not in _EXTENSIONS:
+                continue
+            kind = args.kind or ("grid" if "grid" in name else "original")
+            item = store.put_file(path, kind, source=name, move=not args.copy)
+            imported[name] = item["url"]
+        print(json.dumps({"imported": len(imported), "urls": imported}, indent=2))
+    elif args.command == "evict":
+        print(json.dumps(store.evict(dry_run=args.dry_run), indent=2))
+    else:
+        print(json.dumps(store.get_stats(), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
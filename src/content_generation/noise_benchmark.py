@@ -0,0 +1,170 @@
+"""
+Noise Benchmark - Speed and rank agreement of ImageAnalyzer noise estimators
+
+Usage:
+    python -m src.content_generation.noise_benchmark [--grids DIR] [--count N] [--json]
+
+Without --grids (or when the directory holds no images) a deterministic set of
+synthetic 2x2 grids is generated, with a different noise level in each quadrant.
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import glob
+import argparse
+import logging
+from typing import Dict, List, Any
+
+import numpy as np
+from PIL import Image
+
+from .image_analyzer import ImageAnalyzer, NOISE_METHODS
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_METHOD = "nlmeans"
+NOISE_LEVELS = (0.0, 2.0, 4.0, 8.0, 12.0, 16.0)
+
+
+def make_fixture_grids(count: int = 12, size: int = 1024, seed: int = 1234) -> List[Image.Image]:
+    rng = np.random.default_rng(seed)
+    cell = size // 2
+    yy, xx = np.mgrid[0:cell, 0:cell].astype(np.float32) / cell
+
+    grids = []
+    for _ in range(count):
+        grid = np.zeros((size, size, 3), dtype=np.float32)
+        for index in range(4):
+            # Smooth gradient background with a few hard-edged shapes on top
+            base = rng.uniform(40, 200, size=3)
+            slope = rng.uniform(-60, 60, size=(2, 3))
+            quadrant = base + xx[..., None] * slope[0] + yy[..., None] * slope[1]
+
+            for _ in range(rng.integers(3, 9)):
+                cx, cy = rng.uniform(0.1, 0.9, size=2)
+                radius = rng.uniform(0.05, 0.25)
+                mask = (xx - cx) ** 2 + (yy - cy) ** 2 < radius ** 2
+                quadrant[mask] = rng.uniform(0, 255, size=3)
+
+            sigma = rng.choice(NOISE_LEVELS)
+            quadrant += rng.normal(0.0, sigma, size=quadrant.shape)
+
+            top = (index // 2) * cell
+            left = (index % 2) * cell
+            grid[top:top + cell, left:left + cell] = quadrant
+
+        image = Image.fromarray(np.clip(grid, 0, 255).astype(np.uint8), "RGB")
+
+        # Round-trip through JPEG so the fixtures carry compression artifacts like real grids
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=90)
+        buffer.seek(0)
+        grids.append(Image.open(buffer).convert("RGB"))
+
+    return grids
+
+
+def load_grids(directory: str) -> List[Image.Image]:
+    paths = []
+    for pattern in ("*.jpg", "*.jpeg", "*.png", "*.webp"):
+        paths.extend(glob.glob(os.path.join(directory, pattern)))
+
+    grids = []
+    for path in sorted(paths):
+        try:
+            grids.append(Image.open(path).convert("RGB"))
+        except Exception as e:
+            logger.warning(f"Skipping unreadable image {path}: {str(e)}")
+    return grids
+
+
+def _rank(values: np.ndarray) -> np.ndarray:
+    ranks = np.empty(len(values), dtype=np.float64)
+    ranks[np.argsort(values, kind="mergesort")] = np.arange(len(values))
+    return ranks
+
+
+def spearman(a: np.ndarray, b: np.ndarray) -> float:
+    if len(a) < 2:
+        return 1.0
+    return float(np.corrcoef(_rank(a), _rank(b))[0, 1])
+
+
+def run_benchmark(grids: List[Image.Image]) -> Dict[str, Any]:
+    analyzer = ImageAnalyzer(noise_method=REFERENCE_METHOD)
+
+    # Decode and convert once up front so only the estimators themselves are timed
+    quadrants = []
+    for grid in grids:
+        gray = analyzer._to_gray(analyzer._to_array(grid))
+        quadrants.append(analyzer.grid_quadrant_views(gray))
+
+    values: Dict[str, np.ndarray] = {}
+    timings: Dict[str, float] = {}
+    for method in NOISE_METHODS:
+        method_values = np.zeros((len(grids), 4), dtype=np.float64)
+        start = time.perf_counter()
+        for g, views in enumerate(quadrants):
+            for q, view in enumerate(views):
+                method_values[g, q] = analyzer.calculate_noise(view, method=method)
+        timings[method] = time.perf_counter() - start
+        values[method] = method_values
+
+    reference = values[REFERENCE_METHOD]
+    reference_time = timings[REFERENCE_METHOD]
+    report = {"grids": len(grids), "reference": REFERENCE_METHOD, "methods": {}}
+
+    for method in NOISE_METHODS:
+        method_values = values[method]
+        report["methods"][method] = {
+            "ms_per_grid": 1000.0 * timings[method] / max(len(grids), 1),
+            "speedup": reference_time / timings[method] if timings[method] else float("inf"),
+            # Agreement over every quadrant of the fixture set
+            "spearman": spearman(method_values.ravel(), reference.ravel()),
+            # Share of grids where the estimator picks the same least-noisy quadrant
+            "top1_agreement": float(np.mean(np.argmin(method_values, axis=1) == np.argmin(reference, axis=1))),
+            # Mean per-grid rank correlation of the four quadrants
+            "within_grid_spearman": float(np.mean([spearman(m, r) for m, r in zip(method_values, reference)])),
+            "mean_value": float(method_values.mean()),
+            "reference_mean_value": float(reference.mean())
+        }
+
+    return report
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    lines = [
+        f"Noise estimator benchmark on {report['grids']} grids (reference: {report['reference']})",
+        f"{'method':<12} {'ms/grid':>10} {'speedup':>8} {'spearman':>9} {'top-1':>7} {'in-grid':>8} {'mean':>8}"
+    ]
+    for method, stats in report["methods"].items():
+        lines.append(
+            f"{method:<12} {stats['ms_per_grid']:>10.1f} {stats['speedup']:>7.1f}x "
+            f"{stats['spearman']:>9.3f} {stats['top1_agreement']:>7.2f} "
+            f"{stats['within_grid_spearman']:>8.3f} {stats['mean_value']:>8.2f}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ImageAnalyzer noise estimators")
+    parser.add_argument("--grids", help="Directory of grid images to use as fixtures")
+    parser.add_argument("--count", type=int, default=12, help="Number of synthetic grids when no directory is given")
+    parser.add_argument("--size", type=int, default=1024, help="Edge length of synthetic grids in pixels")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    grids = load_grids(args.grids) if args.grids else []
+    if not grids:
+        grids = make_fixture_grids(args.count, args.size)
+
+    report = run_benchmark(grids)
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,266 @@
+"""
+Perceptual Hash Index - Near-duplicate lookup for generated images by pHash/dHash Hamming distance
+
+Usage:
+    python -m src.content_generation.phash_index build DIR
+    python -m src.content_generation.phash_index query IMAGE [--max-distance N]
+    python -m src.content_generation.phash_index bench [--size 100000] [--queries 1000]
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import logging
+import sqlite3
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from ..utils.paths import data_path
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS image_hashes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL,
+    phash INTEGER NOT NULL,
+    dhash INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+HASH_BITS = 64
+
+
+def _pack(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.astype(np.uint8)).tobytes(), "big")
+
+
+def phash(gray: np.ndarray) -> int:
+    # DCT hash: low 8x8 frequencies of a 32x32 thumbnail, thresholded at their
+    # median (the DC term is left out of the median). Robust to rescaling and
+    # recompression, so a quadrant and its upscale hash alike.
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    return _pack(low > np.median(low[1:]))
+
+
+def dhash(gray: np.ndarray) -> int:
+    # Gradient hash: sign of horizontal differences on a 9x8 thumbnail
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    return _pack(small[:, 1:] > small[:, :-1])
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _to_signed(value: int) -> int:
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    return np.unpackbits(values.view(np.uint8)).reshape(-1, HASH_BITS).sum(axis=1)
+
+
+class PerceptualHashIndex:
+    # Multi-index hashing: the 64-bit pHash is cut into max_distance + 1
+    # disjoint chunks, each with its own exact-match table. Two hashes within
+    # max_distance bits must agree exactly on at least one chunk (pigeonhole),
+    # so a query only verifies the entries sharing a chunk with it instead of
+    # scanning the archive. Candidates are confirmed on pHash and dHash
+    # distance with vectorised popcounts. Hashes are stored in SQLite, and
+    # rows added by other processes are picked up before every lookup.
+
+    def __init__(self, path: Optional[str] = None, max_distance: Optional[int] = None,
+                 max_dhash_distance: Optional[int] = None):
+        self.path = path or os.getenv("IMAGE_HASH_INDEX_PATH") or data_path("image_hashes.sqlite3")
+        self.max_distance = max_distance if max_distance is not None else int(
+            os.getenv("IMAGE_DUPLICATE_MAX_DISTANCE", 6))
+        self.max_dhash_distance = max_dhash_distance if max_dhash_distance is not None else int(
+            os.getenv("IMAGE_DUPLICATE_MAX_DHASH_DISTANCE", 10))
+
+        chunks = min(HASH_BITS, self.max_distance + 1)
+        bounds = np.linspace(0, HASH_BITS, chunks + 1).astype(int)
+        self._chunks = [(int(start), (1 << int(end - start)) - 1) for start, end in zip(bounds[:-1], bounds[1:])]
+        self._tables: List[Dict[int, List[int]]] = [defaultdict(list) for _ in self._chunks]
+
+        self._phashes = np.zeros(1024, dtype=np.uint64)
+        self._dhashes = np.zeros(1024, dtype=np.uint64)
+        self._sources: List[str] = []
+        self._last_id = 0
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def __len__(self) -> int:
+        return len(self._sources)
+
+    def _insert(self, source: str, phash_value: int, dhash_value: int):
+        # Caller holds self._lock
+        position = len(self._sources)
+        if position == len(self._phashes):
+            self._phashes = np.concatenate([self._phashes, np.zeros_like(self._phashes)])
+            self._dhashes = np.concatenate([self._dhashes, np.zeros_like(self._dhashes)])
+        self._phashes[position] = phash_value
+        self._dhashes[position] = dhash_value
+        self._sources.append(source)
+        for table, (start, mask) in zip(self._tables, self._chunks):
+            table[(phash_value >> start) & mask].append(position)
+
+    def _sync(self):
+        # Caller holds self._lock
+        rows = self._connect().execute(
+            "SELECT id, source, phash, dhash FROM image_hashes WHERE id > ? ORDER BY id", (self._last_id,)
+        ).fetchall()
+        for row_id, source, phash_value, dhash_value in rows:
+            self._insert(source, _to_unsigned(phash_value), _to_unsigned(dhash_value))
+            self._last_id = row_id
+
+    def add(self, source: str, phash_value: int, dhash_value: int):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO image_hashes (source, phash, dhash, created_at) VALUES (?, ?, ?, ?)",
+                (source, _to_signed(phash_value), _to_signed(dhash_value), time.time())
+            )
+
+    def add_many(self, entries: List[Tuple[str, int, int]]):
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO image_hashes (source, phash, dhash, created_at) VALUES (?, ?, ?, ?)",
+                [(source, _to_signed(p), _to_signed(d), now) for source, p, d in entries]
+            )
+
+    def query(self, phash_value: int, dhash_value: Optional[int] = None,
+              max_distance: Optional[int] = None) -> List[Tuple[str, int]]:
+        # Sources within max_distance pHash bits (and, if dhash_value is given,
+        # max_dhash_distance dHash bits), nearest first
+        max_distance = self.max_distance if max_distance is None else max_distance
+        with self._lock:
+            self._sync()
+            count = len(self._sources)
+            if max_distance > self.max_distance:
+                # Beyond what the chunk tables guarantee; fall back to a full scan
+                candidates = np.arange(count)
+            else:
+                candidates = np.unique(np.fromiter(
+                    (position for table, (start, mask) in zip(self._tables, self._chunks)
+                     for position in table.get((phash_value >> start) & mask, ())),
+                    dtype=np.int64
+                ))
+            if not len(candidates):
+                return []
+
+            distances = _popcount(self._phashes[candidates] ^ np.uint64(phash_value))
+            keep = distances <= max_distance
+            if dhash_value is not None:
+                dhash_distances = _popcount(self._dhashes[candidates] ^ np.uint64(dhash_value))
+                keep &= dhash_distances <= self.max_dhash_distance
+            matches = sorted(zip(distances[keep].tolist(), candidates[keep].tolist()))
+            return [(self._sources[position], distance) for distance, position in matches]
+
+    def find_duplicate(self, phash_value: int, dhash_value: Optional[int] = None) -> Optional[Tuple[str, int]]:
+        matches = self.query(phash_value, dhash_value)
+        return matches[0] if matches else None
+
+
+def _file_hashes(path: str) -> Tuple[int, int]:
+    from PIL import Image
+    with Image.open(path) as image:
+        # Only a 32x32 thumbnail is needed, so let the JPEG decoder scale down
+        image.draft("L", (64, 64))
+        gray = np.asarray(image.convert("L"))
+    return phash(gray), dhash(gray)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build, query or benchmark the perceptual hash index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="Index every image in a directory")
+    build.add_argument("directory", help="e.g. src/web_interface/static/generated_images")
+    query = subparsers.add_parser("query", help="List indexed images similar to a file")
+    query.add_argument("image")
+    query.add_argument("--max-distance", type=int, default=None)
+    bench = subparsers.add_parser("bench", help="Time queries against a synthetic index")
+    bench.add_argument("--size", type=int, default=100000)
+    bench.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        index = PerceptualHashIndex()
+        entries = []
+        for pattern in ("*.jpg", "*.jpeg", "*.png", "*.webp"):
+            for path in glob.glob(os.path.join(args.directory, pattern)):
+                try:
+                    entries.append((os.path.basename(path), *_file_hashes(path)))
+                except Exception as e:
+                    logger.warning(f"Skipping {path}: {str(e)}")
+        index.add_many(entries)
+        print(json.dumps({"indexed": len(entries)}))
+
+    elif args.command == "query":
+        matches = PerceptualHashIndex().query(*_file_hashes(args.image), max_distance=args.max_distance)
+        print(json.dumps([{"source": source, "distance": distance} for source, distance in matches], indent=2))
+
+    else:
+        import tempfile
+        rng = np.random.default_rng(7)
+        with tempfile.TemporaryDirectory() as tmp:
+            index = PerceptualHashIndex(path=os.path.join(tmp, "hashes.sqlite3"))
+            hashes = rng.integers(0, 2 ** 63, size=(args.size, 2), dtype=np.int64).astype(np.uint64) << np.uint64(1)
+            index.add_many([(str(i), int(p), int(d)) for i, (p, d) in enumerate(hashes)])
+            start = time.perf_counter()
+            index.query(0)
+            load_seconds = time.perf_counter() - start
+
+            # Half the probes are indexed hashes with a few bits flipped
+            timings = []
+            found = 0
+            for i in range(args.queries):
+                target = int(hashes[rng.integers(args.size), 0])
+                if i % 2 == 0:
+                    for bit in rng.choice(HASH_BITS, size=3, replace=False):
+                        target ^= 1 << int(bit)
+                else:
+                    target = int(rng.integers(0, 2 ** 63)) << 1
+                start = time.perf_counter()
+                found += bool(index.query(target))
+                timings.append(time.perf_counter() - start)
+
+        timings = np.array(timings) * 1000
+        print(json.dumps({
+            "size": args.size,
+            "max_distance": index.max_distance,
+            "load_seconds": round(load_seconds, 3),
+            "query_ms_p50": round(float(np.percentile(timings, 50)), 3),
+            "query_ms_p99": round(float(np.percentile(timings, 99)), 3),
+            "matches": found
+        }, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
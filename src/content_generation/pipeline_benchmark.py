@@ -0,0 +1,239 @@
+"""
+Pipeline Benchmark - Analyzer latency and end-to-end generation throughput against local fake APIs
+
+Usage:
+    python -m src.content_generation.pipeline_benchmark [--packages 12] [--in-flight 4] [--grids 24]
+    python -m src.content_generation.pipeline_benchmark --save baseline.json
+    python -m src.content_generation.pipeline_benchmark --baseline baseline.json [--tolerance 0.25]
+
+The pipeline runs against FakeMidjourneyServer with fixture grids, in a
+temporary data directory, so it costs no credits and leaves no state
+behind. Results are read back from the stage spans and metric histograms
+(utils.metrics) that production exports, so the benchmark measures exactly
+what /metrics reports. With --baseline the run exits non-zero when any
+figure is worse than the baseline by more than the tolerance. The same
+runs, at small sizes, are the regression tests in
+tests/test_pipeline_benchmark.py.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import logging
+import tempfile
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Any
+
+import numpy as np
+
+from .noise_benchmark import make_fixture_grids
+from .fake_midjourney import FakeMidjourneyServer
+from ..utils.metrics import STAGE_METRIC, get_registry
+
+logger = logging.getLogger(__name__)
+
+# Stages timed in the pipeline run; the Midjourney waits are set by the fake
+# server's delays, the rest is our own code and I/O
+STAGES = ("prompt", "imagine_submit", "midjourney_task", "queue_wait", "render", "grid_download",
+          "grid_analysis", "upscale", "final_download", "caption", "generate_content")
+
+# Figures where higher is better; everything else in the flat report is a duration
+_HIGHER_IS_BETTER = ("pipeline.packages_per_minute",)
+
+
+@contextmanager
+def _patched_environ(**settings: str) -> Iterator[None]:
+    previous = {name: os.environ.get(name) for name in settings}
+    os.environ.update(settings)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+@contextmanager
+def benchmark_environment(**overrides: str) -> Iterator[str]:
+    # Queues, caches, indexes and media all go to a throwaway directory, and
+    # no request is held back by the production rate limits. The previous
+    # environment is restored afterwards.
+    with tempfile.TemporaryDirectory() as data_dir:
+        settings = {"INSTANEXUS_DATA_DIR": data_dir, "IMAGE_SCORE_CACHE_ENABLED": "false",
+                    "IMAGE_CALIBRATION_ENABLED": "false"}
+        for name in ("IMAGINE", "UPSCALE", "STATUS"):
+            settings[f"RATE_LIMIT_MIDJOURNEY_{name}"] = "100000/1"
+        settings.update(overrides)
+
+        with _patched_environ(**settings):
+            yield data_dir
+
+
+def _histograms(name: str, label: str) -> Dict[str, Dict[str, Any]]:
+    series = get_registry().snapshot()["histograms"].get(name, [])
+    return {entry["labels"].get(label): entry for entry in series}
+
+
+def benchmark_analyzer(grids: int = 24, size: int = 1024) -> Dict[str, Any]:
+    # Whole-grid scoring (four quadrants, four metrics each) with the score
+    # cache off, so every call computes
+    from .image_analyzer import ImageAnalyzer, METRIC_NAMES
+
+    images = make_fixture_grids(count=grids, size=size)
+    analyzer = ImageAnalyzer()
+    analyzer.score_cache = None
+    analyzer.rank_grid_image(images[0])
+    get_registry().reset()
+
+    timings = []
+    for image in images:
+        start = time.perf_counter()
+        analyzer.rank_grid_image(image)
+        timings.append(time.perf_counter() - start)
+
+    per_metric = _histograms("instanexus_image_metric_seconds", "metric")
+    timings = np.array(timings) * 1000
+    return {
+        "grids": grids,
+        "grid_size": size,
+        "noise_method": analyzer.noise_method,
+        "grid_ms_p50": round(float(np.percentile(timings, 50)), 3),
+        "grid_ms_p95": round(float(np.percentile(timings, 95)), 3),
+        "metric_ms_p50": {name: round(per_metric[name]["p50"] * 1000, 3) for name in METRIC_NAMES if name in per_metric}
+    }
+
+
+def benchmark_pipeline(packages: int = 12, in_flight: int = 4, queue_seconds: float = 0.2,
+                       render_seconds: float = 1.0, upscale_seconds: float = 0.5, image_size: int = 1024,
+                       openai_latency: float = 0.05) -> Dict[str, Any]:
+    with FakeMidjourneyServer(queue_seconds=queue_seconds, render_seconds=render_seconds,
+                              upscale_seconds=upscale_seconds, image_size=image_size) as server, \
+            _patched_environ(MIDJOURNEY_API_URL=server.url,
+                             MIDJOURNEY_API_KEY=os.getenv("MIDJOURNEY_API_KEY") or "benchmark"):
+        from .ai_content_generator import AIContentGenerator
+
+        class BenchmarkGenerator(AIContentGenerator):
+            # Prompt and caption text come from OpenAI in production; here a
+            # fixed delay stands in for the round trip, and random tokens
+            # keep the near-duplicate filters from rejecting any prompt
+            def generate_image_prompt(self, theme: Optional[str] = None) -> str:
+                time.sleep(openai_latency)
+                return f"{theme or 'Historical'} scene " + " ".join(uuid.uuid4().hex for _ in range(4))
+
+            def generate_caption(self, image_prompt: str, theme: Optional[str] = None) -> str:
+                time.sleep(openai_latency)
+                return f"A scene from history ({uuid.uuid4().hex})"
+
+        generator = BenchmarkGenerator()
+        get_registry().reset()
+        try:
+            start = time.perf_counter()
+            results = generator.generate_batch_content(packages, max_in_flight=in_flight)
+            wall_seconds = time.perf_counter() - start
+        finally:
+            generator.task_tracker.stop()
+            generator.rendition_engine.close()
+        requests_made = dict(server.request_counts)
+
+    stages = _histograms(STAGE_METRIC, "stage")
+    succeeded = sum(1 for content in results if content.get("success"))
+    return {
+        "packages": packages,
+        "in_flight": in_flight,
+        "succeeded": succeeded,
+        "errors": sorted({content.get("error") for content in results if not content.get("success")}),
+        "wall_seconds": round(wall_seconds, 3),
+        "packages_per_minute": round(60.0 * succeeded / wall_seconds, 2) if wall_seconds else 0.0,
+        "fake_server": {"queue_seconds": queue_seconds, "render_seconds": render_seconds,
+                        "upscale_seconds": upscale_seconds, "requests": requests_made},
+        "stage_ms": {
+            name: {"count": stages[name]["count"], "p50": round(stages[name]["p50"] * 1000, 3),
+                   "p95": round(stages[name]["p95"] * 1000, 3)}
+            for name in STAGES if name in stages
+        }
+    }
+
+
+def flatten(report: Dict[str, Any]) -> Dict[str, float]:
+    # The figures compared against a baseline, as "section.name" -> value
+    flat = {}
+    analyzer = report.get("analyzer")
+    if analyzer:
+        flat["analyzer.grid_ms_p50"] = analyzer["grid_ms_p50"]
+        for name, value in analyzer["metric_ms_p50"].items():
+            flat[f"analyzer.{name}_ms_p50"] = value
+    pipeline = report.get("pipeline")
+    if pipeline:
+        flat["pipeline.packages_per_minute"] = pipeline["packages_per_minute"]
+        # Queue and render time is whatever the fake server was told to take
+        for name, stage in pipeline["stage_ms"].items():
+            if name not in ("midjourney_task", "queue_wait", "render", "upscale", "generate_content"):
+                flat[f"pipeline.{name}_ms_p50"] = stage["p50"]
+    return flat
+
+
+def compare(current: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    # Figures that regressed by more than the tolerance (a fraction)
+    regressions = []
+    for name, before in baseline.items():
+        after = current.get(name)
+        if after is None or not before:
+            continue
+        if name in _HIGHER_IS_BETTER:
+            worse = (before - after) / before
+        else:
+            worse = (after - before) / before
+        if worse > tolerance:
+            regressions.append(f"{name}: {before} -> {after} ({worse:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image analysis and the generation pipeline")
+    parser.add_argument("--packages", type=int, default=12, help="Content packages in the pipeline run")
+    parser.add_argument("--in-flight", type=int, default=4)
+    parser.add_argument("--grids", type=int, default=24, help="Fixture grids in the analyzer run")
+    parser.add_argument("--grid-size", type=int, default=1024)
+    parser.add_argument("--render-seconds", type=float, default=1.0, help="Fake Midjourney render time")
+    parser.add_argument("--openai-latency", type=float, default=0.05, help="Simulated prompt/caption latency")
+    parser.add_argument("--skip-pipeline", action="store_true", help="Only benchmark the analyzer")
+    parser.add_argument("--save", help="Write the comparable figures to this file as a new baseline")
+    parser.add_argument("--baseline", help="Fail if any figure is worse than in this file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed regression, as a fraction")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    with benchmark_environment():
+        report: Dict[str, Any] = {"analyzer": benchmark_analyzer(args.grids, args.grid_size)}
+        if not args.skip_pipeline:
+            report["pipeline"] = benchmark_pipeline(args.packages, args.in_flight,
+                                                    render_seconds=args.render_seconds,
+                                                    image_size=args.grid_size,
+                                                    openai_latency=args.openai_latency)
+
+    flat = flatten(report)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(flat, f, indent=2, sort_keys=True)
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(flat, json.load(f), args.tolerance)
+        report["regressions"] = regressions
+        status = 1 if regressions else 0
+    if report.get("pipeline") and report["pipeline"]["succeeded"] < report["pipeline"]["packages"]:
+        status = 1
+
+    print(json.dumps(report, indent=2))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+"""
+Renditions - Instagram-ready and web-sized variants of generated images, built in a process pool
+
+Usage:
+    python -m src.content_generation.renditions DIR [--workers N]
+"""
+
+import os
+import sys
+import glob
+import json
+import math
+import argparse
+import tempfile
+import multiprocessing
+import logging
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import repeat
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Any
+
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+# name -> (width, height, mode, formats). "crop" fills the box and trims the
+# overflow (Instagram feed sizes); "fit" keeps the whole image inside it.
+RENDITIONS: Dict[str, Tuple[int, int, str, Tuple[str, ...]]] = {
+    "instagram_square": (1080, 1080, "crop", ("jpeg",)),
+    "instagram_portrait": (1080, 1350, "crop", ("jpeg",)),
+    "web": (1280, 1280, "fit", ("webp", "jpeg")),
+    "thumbnail": (320, 320, "crop", ("webp", "jpeg"))
+}
+
+# Encoder settings per (rendition group, format). Instagram recompresses every
+# upload, so its renditions keep full chroma and a high quality to avoid
+# stacking two rounds of artefacts; web variants are tuned for size.
+_ENCODERS = {
+    ("instagram", "jpeg"): {"quality": 92, "subsampling": 0, "optimize": True, "progressive": True},
+    ("web", "jpeg"): {"quality": 82, "optimize": True, "progressive": True},
+    ("web", "webp"): {"quality": 80, "method": 4},
+    ("thumbnail", "jpeg"): {"quality": 75, "optimize": True, "progressive": True},
+    ("thumbnail", "webp"): {"quality": 70, "method": 4}
+}
+
+_EXTENSIONS = {"jpeg": "jpg", "webp": "webp"}
+
+# Lanczos after a box reduce(): the reduce does the heavy downscaling cheaply
+# and the final resample only ever covers a factor below this gap
+_REDUCING_GAP = 2.0
+
+
+def _scale_for(source: Tuple[int, int], width: int, height: int, mode: str) -> float:
+    ratios = (width / source[0], height / source[1])
+    return max(ratios) if mode == "crop" else min(ratios)
+
+
+def rendition_filename(image_path: str, name: str, fmt: str) -> str:
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    return f"{stem}_{name}.{_EXTENSIONS[fmt]}"
+
+
+def render_renditions(image_path: str, output_dir: str,
+                      specs: Optional[Dict[str, Tuple[int, int, str, Tuple[str, ...]]]] = None) -> Dict[str, Any]:
+    # The source is decoded once. For JPEGs, draft() asks libjpeg to scale
+    # during decoding (by 1/2, 1/4 or 1/8) to the smallest size that still
+    # covers the largest rendition, so a 2048px upscale is never fully
+    # decoded just to produce 1080px output. Every rendition is then resized
+    # from that single decoded image.
+    specs = specs or RENDITIONS
+    os.makedirs(output_dir, exist_ok=True)
+    webp = features.check("webp")
+
+    with Image.open(image_path) as image:
+        source_size = image.size
+        scale = max(min(1.0, _scale_for(source_size, w, h, mode)) for w, h, mode, _ in specs.values())
+        image.draft("RGB", (math.ceil(source_size[0] * scale), math.ceil(source_size[1] * scale)))
+        base = ImageOps.exif_transpose(image).convert("RGB")
+        icc_profile = image.info.get("icc_profile")
+
+    results: Dict[str, Any] = {"source": image_path, "source_size": list(source_size),
+                               "decoded_size": list(base.size), "renditions": {}}
+    for name, (width, height, mode, formats) in specs.items():
+        if mode == "crop":
+            # ImageOps.fit has no reducing_gap, so large downscales are box-reduced first
+            factor = int(min(base.width / width, base.height / height) / _REDUCING_GAP)
+            resized = ImageOps.fit(base.reduce(factor) if factor > 1 else base, (width, height), Image.LANCZOS)
+        else:
+            fit = min(1.0, _scale_for(base.size, width, height, mode))
+            size = (max(1, round(base.width * fit)), max(1, round(base.height * fit)))
+            resized = base.resize(size, Image.LANCZOS, reducing_gap=_REDUCING_GAP) if fit < 1.0 else base
+
+        group = "instagram" if name.startswith("instagram") else name
+        variants = {}
+        for fmt in formats:
+            if fmt == "webp" and not webp:
+                continue
+            path = os.path.join(output_dir, rendition_filename(image_path, name, fmt))
+            options = dict(_ENCODERS.get((group, fmt), {"quality": 85}))
+            if icc_profile:
+                options["icc_profile"] = icc_profile
+            resized.save(path, format=fmt.upper(), **options)
+            variants[fmt] = {"path": path, "width": resized.width, "height": resized.height,
+                             "bytes": os.path.getsize(path)}
+        results["renditions"][name] = variants
+    return results
+
+
+def _render_file(image_path: str, output_dir: Optional[str]) -> Dict[str, Any]:
+    try:
+        return render_renditions(image_path, output_dir or os.path.join(os.path.dirname(image_path), "renditions"))
+    except Exception as e:
+        return {"source": image_path, "error": str(e)}
+
+
+def _ping(_: int) -> int:
+    return os.getpid()
+
+
+class RenditionEngine:
+    # Process pool for render_renditions(), following ScoringEngine: started
+    # lazily on first use, and only file paths and small result dicts cross
+    # the process boundary. Workers are spawned rather than forked: the pool
+    # is usually started from a generation thread while the task tracker and
+    # HTTP pool threads are running, and a child forked from a multi-threaded
+    # process can inherit a lock held by one of them and hang forever.
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers or int(os.getenv("RENDITION_WORKERS", 0)) or min(4, os.cpu_count() or 1)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        with self._lock:
+            if self._executor is not None:
+                return
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            pids = set(self._executor.map(_ping, range(self.workers)))
+            logger.info(f"Rendition engine started with {len(pids)} worker processes")
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def _ensure_started(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self.start()
+        return self._executor
+
+    def submit(self, image_path: str, output_dir: Optional[str] = None) -> Future:
+        return self._ensure_started().submit(_render_file, image_path, output_dir)
+
+    def render_file(self, image_path: str, output_dir: Optional[str] = None) -> Dict[str, Any]:
+        result = self.submit(image_path, output_dir).result()
+        if "error" in result:
+            logger.warning(f"Error rendering {image_path}: {result['error']}")
+        return result
+
+    def render_files(self, paths: Iterable[str], output_dir: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        paths = list(paths)
+        logger.info(f"Rendering {len(paths)} images")
+        for result in self._ensure_started().map(_render_file, paths, repeat(output_dir)):
+            if "error" in result:
+                logger.warning(f"Error rendering {result['source']}: {result['error']}")
+            yield result
+
+
+def store_renditions(store, result: Dict[str, Any]) -> Dict[str, Dict[str, str]]:
+    # Move the files of a render_renditions() result into a MediaStore, each
+    # as a child of its original so eviction removes them together.
+    # Returns name -> format -> /media URL.
+    parent = store.parse_url(os.path.basename(result["source"]))
+    urls: Dict[str, Dict[str, str]] = {}
+    for name, variants in result.get("renditions", {}).items():
+        urls[name] = {
+            fmt: store.put_file(variant["path"], "rendition", source=name,
+                                parent=parent["sha256"] if parent else None)["url"]
+            for fmt, variant in variants.items()
+        }
+    return urls
+
+
+def stored_renditions(store, image_url: str) -> Dict[str, Dict[str, str]]:
+    # name -> format -> /media URL of the renditions stored for an original,
+    # the same shape as store_renditions() returns; empty for images
+    # without any, which callers serve as is
+    parsed = store.parse_url(image_url)
+    if parsed is None:
+        return {}
+    formats = {ext: fmt for fmt, ext in _EXTENSIONS.items()}
+    urls: Dict[str, Dict[str, str]] = {}
+    for item in store.renditions(parsed["sha256"]):
+        if item["source"] in RENDITIONS and item["ext"] in formats:
+            urls.setdefault(item["source"], {})[formats[item["ext"]]] = item["url"]
+    return urls
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build renditions for a directory of generated images")
+    parser.add_argument("directory", help="Directory of images, e.g. a media store shard or an export")
+    parser.add_argument("--workers", type=int, help="Number of worker processes")
+    parser.add_argument("--store", action="store_true",
+                        help="Add the renditions to the media store instead of writing them next to the images")
+    args = parser.parse_args()
+
+    paths: List[str] = []
+    for pattern in ("*.jpg", "*.jpeg", "*.png", "*.webp"):
+        paths.extend(glob.glob(os.path.join(args.directory, pattern)))
+
+    with RenditionEngine(workers=args.workers) as engine:
+        if not args.store:
+            for result in engine.render_files(sorted(paths)):
+                print(json.dumps(result))
+            return 0
+
+        from .media_store import MediaStore
+        store = MediaStore()
+        with tempfile.TemporaryDirectory(dir=store.incoming_dir) as scratch:
+            for result in engine.render_files(sorted(paths), scratch):
+                if "error" not in result:
+                    result["urls"] = store_renditions(store, result)
+                print(json.dumps(result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""
+Score Cache - Persistent, content-addressed cache of raw ImageAnalyzer metrics
+"""
+
+import os
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from typing import Optional
+
+import numpy as np
+
+from ..utils.paths import data_path
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scores (
+    content_hash TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    metric_version TEXT NOT NULL,
+    shape TEXT NOT NULL,
+    raw BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (content_hash, kind, metric_version)
+);
+CREATE INDEX IF NOT EXISTS idx_scores_last_access ON scores (last_access);
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_urls_last_access ON urls (last_access);
+"""
+
+
+def content_hash(img_array: np.ndarray) -> str:
+    # Keyed on decoded pixels rather than file bytes, so the same image
+    # re-encoded or served from a different URL still hits
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{img_array.shape}:{img_array.dtype.str}".encode())
+    digest.update(np.ascontiguousarray(img_array).data)
+    return digest.hexdigest()
+
+
+class ScoreCache:
+    # Only raw metrics are stored. Weighted totals are always recomputed from
+    # the analyzer's current weights and normalization, so changing either
+    # takes effect immediately without touching pixels. Entries are keyed by
+    # the analyzer's metric_version, so changing how a raw metric is computed
+    # (e.g. the noise estimator) never serves stale values.
+
+    def __init__(self, path: Optional[str] = None, max_entries: Optional[int] = None):
+        self.path = path or os.getenv("IMAGE_SCORE_CACHE_PATH") or data_path("score_cache.sqlite3")
+        self.max_entries = max_entries or int(os.getenv("IMAGE_SCORE_CACHE_MAX_ENTRIES", 100000))
+        # Eviction runs every this many writes instead of on every write
+        self.evict_interval = max(1, min(1000, self.max_entries // 10))
+
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @classmethod
+    def from_env(cls) -> Optional["ScoreCache"]:
+        if os.getenv("IMAGE_SCORE_CACHE_ENABLED", "true").lower() != "true":
+            return None
+        try:
+            return cls()
+        except Exception as e:
+            logger.warning(f"Score cache unavailable, scoring without it: {str(e)}")
+            return None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str, kind: str, metric_version: str) -> Optional[np.ndarray]:
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT shape, raw FROM scores WHERE content_hash = ? AND kind = ? AND metric_version = ?",
+                (key, kind, metric_version)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            with conn:
+                conn.execute(
+                    "UPDATE scores SET last_access = ? WHERE content_hash = ? AND kind = ? AND metric_version = ?",
+                    (time.time(), key, kind, metric_version)
+                )
+            self.hits += 1
+            shape = tuple(int(dim) for dim in row[0].split(",") if dim)
+            return np.frombuffer(row[1], dtype=np.float64).reshape(shape).copy()
+        except Exception as e:
+            logger.warning(f"Score cache read failed: {str(e)}")
+            return None
+
+    def put(self, key: str, kind: str, metric_version: str, raw_metrics: np.ndarray):
+        raw_metrics = np.ascontiguousarray(raw_metrics, dtype=np.float64)
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO scores "
+                    "(content_hash, kind, metric_version, shape, raw, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, kind, metric_version, ",".join(str(dim) for dim in raw_metrics.shape),
+                     raw_metrics.tobytes(), now, now)
+                )
+            self._after_write()
+        except Exception as e:
+            logger.warning(f"Score cache write failed: {str(e)}")
+
+    def get_url_hash(self, url: str) -> Optional[str]:
+        try:
+            row = self._connect().execute("SELECT content_hash FROM urls WHERE url = ?", (url,)).fetchone()
+            return row[0] if row else None
+        except Exception as e:
+            logger.warning(f"Score cache read failed: {str(e)}")
+            return None
+
+    def put_url_hash(self, url: str, key: str):
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO urls (url, content_hash, last_access) VALUES (?, ?, ?)",
+                    (url, key, time.time())
+                )
+            self._after_write()
+        except Exception as e:
+            logger.warning(f"Score cache write failed: {str(e)}")
+
+    def _after_write(self):
+        with self._writes_lock:
+            self._writes += 1
+            due = self._writes % self.evict_interval == 0
+        if due:
+            self.evict()
+
+    def evict(self):
+        # Least recently used entries go first once a table exceeds max_entries
+        with self._connect() as conn:
+            for table in ("scores", "urls"):
+                count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                excess = count - self.max_entries
+                if excess > 0:
+                    conn.execute(
+                        f"DELETE FROM {table} WHERE rowid IN "
+                        f"(SELECT rowid FROM {table} ORDER BY last_access LIMIT ?)",
+                        (excess,)
+                    )
+                    logger.info(f"Evicted {excess} entries from score cache table {table}")
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM scores")
+            conn.execute("DELETE FROM urls")
@@ -0,0 +1,290 @@
+"""
+Scoring Engine - Multi-process ImageAnalyzer scoring with a persistent, pre-warmed worker pool
+
+Usage:
+    python -m src.content_generation.scoring_engine DIR [--grid] [--workers N]
+"""
+
+import os
+import sys
+import glob
+import json
+import argparse
+import logging
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing import shared_memory
+from typing import Dict, Iterable, Iterator, List, Optional, Any
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from .image_analyzer import ImageAnalyzer
+from .score_cache import content_hash
+
+logger = logging.getLogger(__name__)
+
+# Per-process analyzer, created once by the pool initializer
+_worker_analyzer = None
+
+
+def _init_worker(noise_method: str):
+    global _worker_analyzer
+    # The pool already runs one process per core; OpenCV's own thread pool
+    # would only oversubscribe the machine
+    cv2.setNumThreads(1)
+    _worker_analyzer = ImageAnalyzer(noise_method=noise_method)
+
+    # Run every metric once so OpenCV's lazy initialisation happens here
+    # rather than inside the first timed batch
+    _worker_analyzer.calculate_raw_metrics(np.zeros((64, 64), dtype=np.uint8))
+
+
+def _ping(_: int) -> int:
+    return os.getpid()
+
+
+def _raw_metrics(gray: np.ndarray, grid: bool) -> np.ndarray:
+    if grid:
+        return np.stack([_worker_analyzer.calculate_raw_metrics(view)
+                         for view in _worker_analyzer.grid_quadrant_views(gray)])
+    return _worker_analyzer.calculate_raw_metrics(gray)
+
+
+def _score_file(path: str, grid: bool, with_hash: bool = False) -> Dict[str, Any]:
+    # Workers decode files themselves, so only the path and a few floats cross
+    # the process boundary. with_hash also returns the pixel hash the score
+    # cache is keyed on, which only the decoded image can give.
+    try:
+        with Image.open(path) as image:
+            img_array = _worker_analyzer._to_array(image)
+        result = {"path": path, "raw": _raw_metrics(_worker_analyzer._to_gray(img_array), grid)}
+        if with_hash:
+            result["hash"] = content_hash(img_array)
+        return result
+    except Exception as e:
+        return {"path": path, "error": str(e)}
+
+
+def _file_key(path: str) -> Optional[str]:
+    # Stands in for the file in the score cache's URL table; a rewritten file
+    # gets a new key, so it is scored again
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f"file://{os.path.abspath(path)}?mtime={stat.st_mtime_ns}&size={stat.st_size}"
+
+
+def _score_shared(name: str, shape: tuple, dtype: str, grid: bool) -> np.ndarray:
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        pixels = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        raw = _raw_metrics(_worker_analyzer._to_gray(pixels), grid)
+        # Views into the segment must be gone before it can be closed
+        del pixels
+        return raw
+    finally:
+        shm.close()
+
+
+class ScoringEngine:
+    def __init__(self, analyzer: Optional[ImageAnalyzer] = None,
+                 workers: Optional[int] = None, chunksize: Optional[int] = None):
+        # Weights and normalization stay in the parent; workers only return
+        # raw metrics, so re-weighting never requires re-scoring
+        self.analyzer = analyzer or ImageAnalyzer()
+        self.workers = workers or int(os.getenv("SCORING_WORKERS", 0)) or os.cpu_count() or 1
+        self.chunksize = chunksize or int(os.getenv("SCORING_CHUNKSIZE", 16))
+
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        with self._lock:
+            if self._executor is not None:
+                return
+            # Spawned, not forked: the engine is started from threaded
+            # processes (batch generation, the web interface), where a forked
+            # child can inherit a lock held by another thread and deadlock
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.analyzer.noise_method,)
+            )
+            # Start and warm every worker now instead of on the first batch
+            pids = set(self._executor.map(_ping, range(self.workers * 2)))
+            logger.info(f"Scoring engine started with {len(pids)} worker processes")
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def _ensure_started(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self.start()
+        return self._executor
+
+    def _with_scores(self, result: Dict[str, Any], grid: bool) -> Dict[str, Any]:
+        if "raw" not in result:
+            return result
+        scores = self.analyzer.weighted_scores(result["raw"])
+        if grid:
+            result["scores"] = scores
+            result["best_index"] = int(np.argmax(scores))
+        else:
+            result["score"] = float(scores)
+        return result
+
+    def _cached_file(self, path: str, kind: str) -> Optional[np.ndarray]:
+        key = self.analyzer.score_cache.get_url_hash(_file_key(path) or "")
+        return self.analyzer.score_cache.get(key, kind, self.analyzer.metric_version) if key else None
+
+    def score_files(self, paths: Iterable[str], grid: bool = False) -> Iterator[Dict[str, Any]]:
+        # Files scored before (same path, size and mtime) are answered from
+        # the score cache in this process; only the rest go to the workers
+        executor = self._ensure_started()
+        cache = self.analyzer.score_cache
+        kind = "grid" if grid else "image"
+        paths = list(paths)
+        hits = {}
+        if cache is not None:
+            for path in paths:
+                raw = self._cached_file(path, kind)
+                if raw is not None:
+                    hits[path] = raw
+        misses = [path for path in paths if path not in hits]
+        logger.info(f"Scoring {len(paths)} files ({'grid' if grid else 'single'} mode, {len(hits)} cached)")
+
+        computed = executor.map(_score_file, misses, repeat(grid), repeat(cache is not None),
+                                chunksize=self.chunksize)
+        for path in paths:
+            if path in hits:
+                yield self._with_scores({"path": path, "raw": hits[path]}, grid)
+                continue
+            result = next(computed)
+            if "error" in result:
+                logger.warning(f"Error scoring {result['path']}: {result['error']}")
+            elif cache is not None:
+                key = result.pop("hash")
+                cache.put(key, kind, self.analyzer.metric_version, result["raw"])
+                file_key = _file_key(path)
+                if file_key:
+                    cache.put_url_hash(file_key, key)
+            yield self._with_scores(result, grid)
+
+    def score_arrays(self, arrays: Iterable[np.ndarray], grid: bool = False) -> Iterator[Dict[str, Any]]:
+        # For pixels that are already decoded in this process (e.g. a grid that
+        # was just downloaded): copy them once into shared memory and send
+        # workers only the segment name, instead of pickling the pixel buffer.
+        # Pixels already in the score cache are not sent at all.
+        executor = self._ensure_started()
+        cache = self.analyzer.score_cache
+        kind = "grid" if grid else "image"
+        max_pending = self.workers * 2
+        pending = deque()
+
+        def finish(entry) -> Dict[str, Any]:
+            index, shm, future, key = entry
+            if shm is None:
+                # Cache hit; future is the cached raw metrics
+                return self._with_scores({"index": index, "raw": future}, grid)
+            try:
+                raw = future.result()
+                if key is not None:
+                    cache.put(key, kind, self.analyzer.metric_version, raw)
+                return self._with_scores({"index": index, "raw": raw}, grid)
+            except Exception as e:
+                logger.warning(f"Error scoring array {index}: {str(e)}")
+                return {"index": index, "error": str(e)}
+            finally:
+                shm.close()
+                shm.unlink()
+
+        try:
+            for index, array in enumerate(arrays):
+                array = np.ascontiguousarray(array)
+                key = content_hash(array) if cache is not None else None
+                raw = cache.get(key, kind, self.analyzer.metric_version) if key is not None else None
+                if raw is not None:
+                    pending.append((index, None, raw, key))
+                else:
+                    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                    try:
+                        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+                        future = executor.submit(_score_shared, shm.name, array.shape, array.dtype.str, grid)
+                    except Exception:
+                        shm.close()
+                        shm.unlink()
+                        raise
+                    pending.append((index, shm, future, key))
+
+                # Bound the number of live segments so memory use stays flat
+                while len(pending) >= max_pending:
+                    yield finish(pending.popleft())
+
+            while pending:
+                yield finish(pending.popleft())
+        finally:
+            # Release segments if the caller stops iterating early
+            for _, shm, future, _ in pending:
+                if shm is None:
+                    continue
+                future.cancel()
+                try:
+                    future.result()
+                except Exception:
+                    pass
+                shm.close()
+                shm.unlink()
+
+    def score_images(self, images: Iterable[Image.Image], grid: bool = False) -> Iterator[Dict[str, Any]]:
+        return self.score_arrays((self.analyzer._to_array(image) for image in images), grid=grid)
+
+    def analyze_grid_files(self, paths: Iterable[str]) -> Dict[str, int]:
+        return {result["path"]: result["best_index"]
+                for result in self.score_files(paths, grid=True) if "best_index" in result}
+
+    def select_best_file(self, paths: List[str]) -> Optional[Dict[str, Any]]:
+        results = [result for result in self.score_files(paths) if "score" in result]
+        if not results:
+            return None
+        return max(results, key=lambda result: result["score"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score an archive of generated images")
+    parser.add_argument("directory", help="Directory of images, e.g. src/web_interface/static/generated_images")
+    parser.add_argument("--grid", action="store_true", help="Treat every image as a 2x2 Midjourney grid")
+    parser.add_argument("--workers", type=int, help="Number of worker processes (default: CPU count)")
+    args = parser.parse_args()
+
+    paths = []
+    for pattern in ("*.jpg", "*.jpeg", "*.png", "*.webp"):
+        paths.extend(glob.glob(os.path.join(args.directory, pattern)))
+
+    with ScoringEngine(workers=args.workers) as engine:
+        for result in engine.score_files(sorted(paths), grid=args.grid):
+            result.pop("raw", None)
+            if "scores" in result:
+                result["scores"] = result["scores"].tolist()
+            print(json.dumps(result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,401 @@
+"""
+Task Tracker - Adaptive, shared status tracking for in-flight Midjourney tasks
+"""
+
+import os
+import hmac
+import json
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Any
+
+from ..utils.http_pool import HttpPool
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("completed", "failed")
+
+
+def _parse_progress(value: Any) -> float:
+    try:
+        return float(str(value).rstrip("%"))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class TrackedTask:
+    def __init__(self, task_id: str, next_poll: float):
+        self.task_id = task_id
+        self.done = threading.Event()
+        self.data: Dict[str, Any] = {}
+        self.status = ""
+        self.next_poll = next_poll
+        self.in_flight = False
+        self.polls = 0
+        self.failures = 0
+        self.waiters = 0
+
+        # Observed render speed, in percent per second
+        self.progress = 0.0
+        self.progress_at = time.monotonic()
+        self.rate: Optional[float] = None
+
+        # When tracking began, the task was first seen processing, and it finished
+        self.tracked_at = self.progress_at
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def timings(self) -> Dict[str, float]:
+        # Seconds from tracking to completion ("total"), split into time queued
+        # at the provider and rendering only if a poll saw the task processing;
+        # when the first poll already finds it finished there is no split to report
+        end = self.finished_at or time.monotonic()
+        timings = {"total": end - self.tracked_at}
+        if self.started_at is not None:
+            timings["queue_wait"] = self.started_at - self.tracked_at
+            timings["render"] = end - self.started_at
+        return timings
+
+
+class MidjourneyTaskTracker:
+    # One background thread tracks every in-flight task. Each task is polled
+    # when its own estimate says it may be finished: the reported progress and
+    # its rate of change give an ETA, tasks without progress back off
+    # exponentially, and every interval is jittered so parallel tasks do not
+    # poll in lockstep. All status lookups due in the same tick go out
+    # together, over the shared keep-alive pool or as one request to a batch
+    # endpoint when MIDJOURNEY_BATCH_STATUS_PATH is set. When a webhook
+    # endpoint is configured, completions are pushed to the receiver and
+    # polling only serves as a slow safety net.
+
+    def __init__(self, http: HttpPool, api_url: str, api_key: Optional[str],
+                 min_interval: Optional[float] = None,
+                 max_interval: Optional[float] = None,
+                 initial_delay: Optional[float] = None,
+                 jitter: Optional[float] = None,
+                 max_concurrent_polls: Optional[int] = None,
+                 batch_status_path: Optional[str] = None,
+                 webhook_url: Optional[str] = None,
+                 webhook_secret: Optional[str] = None,
+                 webhook_port: Optional[int] = None):
+        self.http = http
+        self.api_url = api_url
+        self.api_key = api_key
+
+        self.min_interval = min_interval if min_interval is not None else float(os.getenv("MIDJOURNEY_POLL_MIN_INTERVAL", 1))
+        self.max_interval = max_interval if max_interval is not None else float(os.getenv("MIDJOURNEY_POLL_MAX_INTERVAL", 10))
+        self.initial_delay = initial_delay if initial_delay is not None else float(os.getenv("MIDJOURNEY_POLL_INITIAL_DELAY", 2))
+        self.jitter = jitter if jitter is not None else float(os.getenv("MIDJOURNEY_POLL_JITTER", 0.2))
+        self.max_concurrent_polls = max_concurrent_polls or int(os.getenv("MIDJOURNEY_MAX_CONCURRENT_POLLS", 8))
+        self.batch_status_path = batch_status_path or os.getenv("MIDJOURNEY_BATCH_STATUS_PATH")
+
+        self.webhook_url = webhook_url or os.getenv("MIDJOURNEY_WEBHOOK_URL")
+        self.webhook_secret = webhook_secret or os.getenv("MIDJOURNEY_WEBHOOK_SECRET")
+        self.webhook_port = webhook_port or int(os.getenv("MIDJOURNEY_WEBHOOK_PORT", 0))
+        self.webhook_poll_interval = float(os.getenv("MIDJOURNEY_WEBHOOK_POLL_INTERVAL", 30))
+
+        self.status_requests = 0
+        self.webhook_events = 0
+
+        self._tasks: Dict[str, TrackedTask] = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._executor = None
+        self._receiver = None
+        self._stopped = False
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {
+            "Content-Type": "application/json",
+            "x-api-key": self.api_key or ""
+        }
+
+    def task_config(self) -> Optional[Dict[str, Any]]:
+        # Extra "config" block for task submissions when webhooks are enabled
+        if not self.webhook_url:
+            return None
+        return {"webhook_config": {"endpoint": self.webhook_url, "secret": self.webhook_secret or ""}}
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent_polls, thread_name_prefix="mj-status")
+            self._thread = threading.Thread(target=self._run, name="mj-task-tracker", daemon=True)
+            self._thread.start()
+
+        if self.webhook_url and self.webhook_port and self._receiver is None:
+            self._receiver = TaskWebhookReceiver(self, port=self.webhook_port, secret=self.webhook_secret)
+            self._receiver.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._receiver is not None:
+            self._receiver.stop()
+            self._receiver = None
+
+    def track(self, task_id: str) -> TrackedTask:
+        self.start()
+        with self._cond:
+            task = self._tasks.get(task_id)
+            if task is None:
+                task = TrackedTask(task_id, time.monotonic() + self.initial_delay)
+                self._tasks[task_id] = task
+                self._cond.notify_all()
+            return task
+
+    def wait(self, task_id: str, timeout: float, timings: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+        # If given, timings is filled with TrackedTask.timings()
+        task = self.track(task_id)
+        with self._cond:
+            task.waiters += 1
+        try:
+            if not task.done.wait(timeout):
+                raise TimeoutError(f"Timed out waiting for Midjourney task {task_id}")
+            if timings is not None:
+                timings.update(task.timings())
+            return task.data
+        finally:
+            with self._cond:
+                task.waiters -= 1
+                # Nobody is waiting any more, stop spending status requests on it
+                if task.waiters == 0 and self._tasks.get(task_id) is task:
+                    del self._tasks[task_id]
+
+    def wait_many(self, task_ids: Iterable[str], timeout: float) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        # Yields (task_id, data) in completion order until every task has
+        # finished or the timeout expires. Tasks still running when the caller
+        # stops iterating are no longer polled.
+        pending = {task_id: self.track(task_id) for task_id in task_ids}
+        tasks = dict(pending)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            for task in tasks.values():
+                task.waiters += 1
+        try:
+            while pending:
+                with self._cond:
+                    finished = [task_id for task_id, task in pending.items() if task.done.is_set()]
+                    if not finished:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return
+                        self._cond.wait(remaining)
+                        continue
+                for task_id in finished:
+                    yield task_id, pending.pop(task_id).data
+        finally:
+            with self._cond:
+                for task_id, task in tasks.items():
+                    task.waiters -= 1
+                    if task.waiters == 0 and self._tasks.get(task_id) is task:
+                        del self._tasks[task_id]
+
+    def notify(self, data: Dict[str, Any]):
+        # Entry point for pushed (webhook) status updates
+        task_id = data.get("task_id")
+        with self._cond:
+            task = self._tasks.get(task_id)
+            if task is None:
+                return
+            self.webhook_events += 1
+            self._update(task, data)
+            self._cond.notify_all()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "tracked_tasks": len(self._tasks),
+                "status_requests": self.status_requests,
+                "webhook_events": self.webhook_events
+            }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    now = time.monotonic()
+                    idle = [task for task in self._tasks.values() if not task.in_flight]
+                    due = [task for task in idle if task.next_poll <= now]
+                    if due:
+                        break
+                    timeout = min(task.next_poll for task in idle) - now if idle else None
+                    self._cond.wait(timeout)
+
+                for task in due:
+                    task.in_flight = True
+
+            self._poll(due)
+
+    def _poll(self, tasks: List[TrackedTask]):
+        if self.batch_status_path and len(tasks) > 1:
+            self._executor.submit(self._poll_batch, tasks)
+            return
+        for task in tasks:
+            future = self._executor.submit(self._fetch_status, task.task_id)
+            future.add_done_callback(lambda f, task=task: self._handle(task, f.result()))
+
+    def _fetch_status(self, task_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with self._cond:
+                self.status_requests += 1
+            response = self.http.get(f"{self.api_url}/api/v1/task/{task_id}", headers=self.headers,
+                                     rate_limit="midjourney_status")
+            if response.status_code != 200:
+                logger.error(f"Error getting task status: {response.status_code} - {response.text}")
+                return None
+            data = response.json().get("data", {})
+            logger.debug(f"Status result for {task_id}: {data}")
+            return data
+        except Exception as e:
+            logger.error(f"Error getting task status for {task_id}: {str(e)}")
+            return None
+
+    def _poll_batch(self, tasks: List[TrackedTask]):
+        results: Dict[str, Dict[str, Any]] = {}
+        try:
+            with self._cond:
+                self.status_requests += 1
+            response = self.http.post(
+                f"{self.api_url}{self.batch_status_path}",
+                headers=self.headers,
+                json={"task_ids": [task.task_id for task in tasks]},
+                rate_limit="midjourney_status"
+            )
+            if response.status_code == 200:
+                for data in response.json().get("data", []) or []:
+                    results[data.get("task_id")] = data
+            else:
+                logger.error(f"Error getting batch task status: {response.status_code} - {response.text}")
+        except Exception as e:
+            logger.error(f"Error getting batch task status: {str(e)}")
+
+        for task in tasks:
+            self._handle(task, results.get(task.task_id))
+
+    def _handle(self, task: TrackedTask, data: Optional[Dict[str, Any]]):
+        with self._cond:
+            task.in_flight = False
+            task.polls += 1
+            if data is None:
+                task.failures += 1
+            else:
+                task.failures = 0
+                self._update(task, data)
+            if not task.done.is_set():
+                task.next_poll = time.monotonic() + self._next_interval(task)
+            self._cond.notify_all()
+
+    def _update(self, task: TrackedTask, data: Dict[str, Any]):
+        previous = task.status
+        task.data = data
+        task.status = (data.get("status") or "").lower()
+
+        now = time.monotonic()
+        if task.started_at is None and task.status not in ("pending", "staged", "") \
+                and task.status not in TERMINAL_STATUSES:
+            task.started_at = now
+        progress = _parse_progress((data.get("output") or {}).get("progress"))
+        if progress > task.progress:
+            rate = (progress - task.progress) / max(now - task.progress_at, 1e-3)
+            task.rate = rate if task.rate is None else 0.5 * task.rate + 0.5 * rate
+            task.progress = progress
+            task.progress_at = now
+
+        if task.status in TERMINAL_STATUSES:
+            task.finished_at = now
+            task.done.set()
+            self._tasks.pop(task.task_id, None)
+        elif task.status not in ("processing", "pending", "staged"):
+            logger.warning(f"Unknown status for task {task.task_id}: {task.status}")
+
+        # Every poll at debug level, status changes at info
+        level = logging.INFO if task.status != previous else logging.DEBUG
+        logger.log(level, f"Task {task.task_id} is {task.status} ({task.progress:.0f}% complete)")
+
+    def _next_interval(self, task: TrackedTask) -> float:
+        if task.failures:
+            interval = self.min_interval * (2 ** task.failures)
+        elif task.rate:
+            # Poll again around the estimated completion time
+            interval = (100.0 - task.progress) / task.rate
+        else:
+            # Still queued or no progress reported yet
+            interval = self.initial_delay * (1.5 ** task.polls)
+
+        interval *= random.uniform(1.0 - self.jitter, 1.0 + self.jitter)
+        interval = min(max(interval, self.min_interval), self.max_interval)
+        if self.webhook_url:
+            interval = max(interval, self.webhook_poll_interval)
+        return interval
+
+
+class TaskWebhookReceiver:
+    # A webhook can mark a task completed with any image_url, which the
+    # pipeline then downloads and publishes, so every request must carry the
+    # shared secret. Listens on localhost unless MIDJOURNEY_WEBHOOK_HOST says
+    # otherwise; put it behind the reverse proxy serving MIDJOURNEY_WEBHOOK_URL.
+
+    def __init__(self, tracker: MidjourneyTaskTracker, host: Optional[str] = None,
+                 port: Optional[int] = None, secret: Optional[str] = None):
+        self.tracker = tracker
+        self.host = host or os.getenv("MIDJOURNEY_WEBHOOK_HOST", "127.0.0.1")
+        self.port = port if port is not None else int(os.getenv("MIDJOURNEY_WEBHOOK_PORT", 0))
+        self.secret = secret or os.getenv("MIDJOURNEY_WEBHOOK_SECRET")
+        self._server = None
+        self._thread = None
+
+    def _authorized(self, provided: Optional[str]) -> bool:
+        return provided is not None and hmac.compare_digest(provided.encode(), self.secret.encode())
+
+    def start(self):
+        if not self.secret:
+            raise Exception("MIDJOURNEY_WEBHOOK_SECRET must be set to receive Midjourney webhooks")
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if not receiver._authorized(self.headers.get("X-Webhook-Secret")):
+                    self.send_response(403)
+                    self.end_headers()
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                    receiver.tracker.notify(body.get("data", body))
+                    self.send_response(200)
+                except Exception as e:
+                    logger.warning(f"Invalid Midjourney webhook payload: {str(e)}")
+                    self.send_response(400)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logger.debug(f"Webhook receiver: {format % args}")
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mj-webhook", daemon=True)
+        self._thread.start()
+        logger.info(f"Midjourney webhook receiver listening on {self.host}:{self.port}")
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,234 @@
+"""
+Text Cache - Cached OpenAI responses and near-duplicate detection for prompts and captions
+"""
+
+import os
+import re
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from ..utils.paths import data_path
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS text_responses (
+    cache_key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_text_responses_last_access ON text_responses (last_access);
+CREATE TABLE IF NOT EXISTS text_fingerprints (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    text TEXT NOT NULL,
+    signature BLOB NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_text_fingerprints_kind ON text_fingerprints (kind, id);
+"""
+
+# MinHash over word 3-gram shingles, hashed with (a * x + b) mod p
+_MERSENNE_PRIME = (1 << 31) - 1
+_NUM_PERM = 64
+_BANDS = 16
+_ROWS = _NUM_PERM // _BANDS
+_rng = np.random.default_rng(0x5EED)
+_PERM_A = _rng.integers(1, _MERSENNE_PRIME, size=_NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, _MERSENNE_PRIME, size=_NUM_PERM, dtype=np.uint64)
+
+
+class _Store:
+    def __init__(self, path: Optional[str]):
+        self.path = path or os.getenv("TEXT_CACHE_PATH") or data_path("text_cache.sqlite3")
+        self._local = threading.local()
+        with self.connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+
+class TextResponseCache:
+    def __init__(self, path: Optional[str] = None, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        self.store = _Store(path)
+        self.ttl = ttl if ttl is not None else float(os.getenv("TEXT_CACHE_TTL", 7 * 24 * 3600))
+        self.max_entries = max_entries or int(os.getenv("TEXT_CACHE_MAX_ENTRIES", 10000))
+        self._writes = 0
+
+    def make_key(self, kind: str, theme: Optional[str], template: str, model: str, text_input: str = "") -> str:
+        raw = "\x1f".join([kind, theme or "", template, model, text_input])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        conn = self.store.connect()
+        row = conn.execute("SELECT value, created_at FROM text_responses WHERE cache_key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if time.time() - row[1] > self.ttl:
+            with conn:
+                conn.execute("DELETE FROM text_responses WHERE cache_key = ?", (key,))
+            return None
+        with conn:
+            conn.execute("UPDATE text_responses SET last_access = ? WHERE cache_key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key: str, kind: str, value: str):
+        now = time.time()
+        with self.store.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO text_responses (cache_key, kind, value, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, kind, value, now, now)
+            )
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.evict()
+
+    def invalidate(self, key: str):
+        with self.store.connect() as conn:
+            conn.execute("DELETE FROM text_responses WHERE cache_key = ?", (key,))
+
+    def evict(self):
+        with self.store.connect() as conn:
+            conn.execute("DELETE FROM text_responses WHERE created_at < ?", (time.time() - self.ttl,))
+            count = conn.execute("SELECT COUNT(*) FROM text_responses").fetchone()[0]
+            if count > self.max_entries:
+                conn.execute(
+                    "DELETE FROM text_responses WHERE cache_key IN "
+                    "(SELECT cache_key FROM text_responses ORDER BY last_access LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+
+def shingles(text: str, size: int = 3) -> Set[str]:
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    if len(words) < size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def minhash_signature(text: str) -> np.ndarray:
+    tokens = shingles(text)
+    if not tokens:
+        return np.full(_NUM_PERM, _MERSENNE_PRIME, dtype=np.uint64)
+    # 31-bit token hashes keep a * x + b below 2**63, so uint64 math cannot overflow
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(token.encode(), digest_size=4).digest(), "little") & _MERSENNE_PRIME
+         for token in tokens],
+        dtype=np.uint64
+    )
+    return ((np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % _MERSENNE_PRIME).min(axis=1)
+
+
+class NearDuplicateIndex:
+    # Locality-sensitive index of MinHash signatures: candidates share at
+    # least one band of the signature, and are then confirmed by their
+    # estimated Jaccard similarity. Signatures are persisted, and rows added
+    # by other processes are picked up before every lookup.
+
+    def __init__(self, kind: str, path: Optional[str] = None, threshold: Optional[float] = None,
+                 window: Optional[int] = None, max_age: Optional[float] = None):
+        self.kind = kind
+        self.store = _Store(path)
+        self.threshold = threshold if threshold is not None else float(os.getenv("TEXT_SIMILARITY_THRESHOLD", 0.7))
+        self.window = window or int(os.getenv("TEXT_DEDUP_WINDOW", 5000))
+        self.max_age = max_age if max_age is not None else float(os.getenv("TEXT_DEDUP_MAX_AGE", 30 * 24 * 3600))
+
+        self._lock = threading.Lock()
+        self._items: Dict[int, Tuple[str, np.ndarray, float]] = {}
+        self._buckets: Dict[Tuple[int, bytes], List[int]] = defaultdict(list)
+        self._last_id = 0
+
+    def _band_keys(self, signature: np.ndarray):
+        for band in range(_BANDS):
+            yield band, signature[band * _ROWS:(band + 1) * _ROWS].tobytes()
+
+    def _sync(self):
+        cutoff = time.time() - self.max_age
+        rows = self.store.connect().execute(
+            "SELECT id, text, signature, created_at FROM text_fingerprints "
+            "WHERE kind = ? AND id > ? AND created_at >= ? ORDER BY id",
+            (self.kind, self._last_id, cutoff)
+        ).fetchall()
+        for item_id, text, signature, created_at in rows:
+            signature = np.frombuffer(signature, dtype=np.uint64)
+            self._items[item_id] = (text, signature, created_at)
+            for key in self._band_keys(signature):
+                self._buckets[key].append(item_id)
+            self._last_id = item_id
+
+        # Drop entries that fell out of the window
+        if len(self._items) > self.window or any(entry[2] < cutoff for entry in self._items.values()):
+            keep = sorted(item_id for item_id, entry in self._items.items() if entry[2] >= cutoff)[-self.window:]
+            self._items = {item_id: self._items[item_id] for item_id in keep}
+            self._buckets = defaultdict(list)
+            for item_id, (_, signature, _) in self._items.items():
+                for key in self._band_keys(signature):
+                    self._buckets[key].append(item_id)
+
+    def _best_match(self, signature: np.ndarray) -> Optional[Tuple[str, float]]:
+        candidates = {item_id for key in self._band_keys(signature) for item_id in self._buckets.get(key, ())}
+        best = None
+        for item_id in candidates:
+            entry = self._items.get(item_id)
+            if entry is None:
+                continue
+            similarity = float(np.mean(entry[1] == signature))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (entry[0], similarity)
+        return best
+
+    def _insert(self, conn: sqlite3.Connection, text: str, signature: np.ndarray):
+        # Rows older than max_age are never matched again, so drop them here
+        now = time.time()
+        conn.execute("DELETE FROM text_fingerprints WHERE kind = ? AND created_at < ?", (self.kind, now - self.max_age))
+        conn.execute(
+            "INSERT INTO text_fingerprints (kind, text, signature, created_at) VALUES (?, ?, ?, ?)",
+            (self.kind, text, signature.tobytes(), now)
+        )
+
+    def find_similar(self, text: str) -> Optional[Tuple[str, float]]:
+        signature = minhash_signature(text)
+        with self._lock:
+            self._sync()
+            return self._best_match(signature)
+
+    def add(self, text: str):
+        signature = minhash_signature(text)
+        with self.store.connect() as conn:
+            self._insert(conn, text, signature)
+
+    def add_if_unique(self, text: str) -> Optional[Tuple[str, float]]:
+        # find_similar() and add() as one step: the lookup runs under the
+        # index lock and inside a write transaction, so two threads or
+        # processes checking near-duplicate texts at the same moment cannot
+        # both pass. Returns the match (and adds nothing) or None once added.
+        signature = minhash_signature(text)
+        with self._lock:
+            conn = self.store.connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._sync()
+                match = self._best_match(signature)
+                if match is None:
+                    self._insert(conn, text, signature)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            return match
@@ -2,7 +2,14 @@
 Instagram Bot Module - Core functionality for Instagram automation
 """
 
-from .instagram_client import InstagramClient
-from .session_manager import SessionManager
+from ..utils.lazy import lazy_exports
 
-__all__ = ['InstagramClient', 'SessionManager']
\ No newline at end of file
+_EXPORTS = {
+    'InstagramClient': '.instagram_client',
+    'SessionManager': '.session_manager',
+    'InstagramSessionPool': '.session_pool',
+    'SessionStore': '.session_pool'
+}
+
+__all__ = list(_EXPORTS)
+__getattr__ = lazy_exports(__name__, _EXPORTS)
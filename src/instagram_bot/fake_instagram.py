@@ -0,0 +1,221 @@
+"""
+Fake Instagram - Local stand-in for the Instagram login and publishing endpoints, for offline load tests
+
+Usage:
+    python -m src.instagram_bot.fake_instagram [--port 8767] [--session-seconds 3600]
+
+Then point INSTAGRAM_API_URL at http://127.0.0.1:8767.
+"""
+
+import sys
+import json
+import time
+import uuid
+import zlib
+import argparse
+import logging
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+
+class FakeInstagramServer:
+    # Logins hand out a session id that expires after session_seconds and
+    # can be extended through the refresh endpoint. Publishing is a raw upload
+    # followed by a configure call, as with the real private API. Counters
+    # per endpoint and per account let tests check how often each account
+    # logged in. With posts_per_minute set, further posts answer 429.
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, accounts: Optional[Dict[str, str]] = None,
+                 session_seconds: float = 3600.0, latency: float = 0.0, posts_per_minute: Optional[int] = None):
+        self.host = host
+        self.port = port
+        # None accepts any username/password pair
+        self.accounts = accounts
+        self.session_seconds = session_seconds
+        self.latency = latency
+        self.posts_per_minute = posts_per_minute
+
+        self.sessions: Dict[str, Dict[str, Any]] = {}
+        self.uploads: Dict[str, int] = {}
+        self.media: Dict[str, Dict[str, Any]] = {}
+        self.request_counts = Counter()
+        self.login_counts = Counter()
+        self.post_counts = Counter()
+        self._post_times: Dict[str, list] = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                server._dispatch(self, "POST")
+
+            def do_GET(self):
+                server._dispatch(self, "GET")
+
+            def log_message(self, format, *args):
+                logger.debug(f"Fake Instagram: {format % args}")
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-instagram", daemon=True)
+        self._thread.start()
+        logger.info(f"Fake Instagram server listening on {self.url}")
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _dispatch(self, handler: BaseHTTPRequestHandler, method: str):
+        path = handler.path.split("?", 1)[0]
+        length = int(handler.headers.get("Content-Length", 0))
+        raw = handler.rfile.read(length) if length else b""
+        if self.latency:
+            time.sleep(self.latency)
+
+        if method == "POST" and path == "/api/v1/accounts/login/":
+            return self._login(handler, json.loads(raw or b"{}"))
+
+        username = self._authenticate(handler)
+        if username is None:
+            self._count("unauthorized")
+            return self._send_json(handler, 401, {"status": "fail", "message": "login_required"})
+
+        if method == "POST" and path == "/api/v1/accounts/session/refresh/":
+            self._count("refresh")
+            session_id = self._session_id(handler)
+            with self._lock:
+                self.sessions[session_id]["expires_at"] = time.time() + self.session_seconds
+            return self._send_json(handler, 200, {"status": "ok", "expires_in": self.session_seconds})
+
+        if method == "GET" and path == "/api/v1/accounts/current_user/":
+            self._count("current_user")
+            return self._send_json(handler, 200, {"status": "ok", "user": {"username": username}})
+
+        if method == "POST" and path == "/api/v1/media/upload/":
+            self._count("upload")
+            upload_id = uuid.uuid4().hex
+            with self._lock:
+                self.uploads[upload_id] = len(raw)
+            return self._send_json(handler, 200, {"status": "ok", "upload_id": upload_id})
+
+        if method == "POST" and path == "/api/v1/media/configure/":
+            self._count("configure")
+            return self._configure(handler, username, json.loads(raw or b"{}"))
+
+        self._send_json(handler, 404, {"status": "fail", "message": "not found"})
+
+    def _count(self, kind: str):
+        with self._lock:
+            self.request_counts[kind] += 1
+
+    def _session_id(self, handler: BaseHTTPRequestHandler) -> Optional[str]:
+        for part in handler.headers.get("Cookie", "").split(";"):
+            name, _, value = part.strip().partition("=")
+            if name == "sessionid":
+                return value
+        return None
+
+    def _authenticate(self, handler: BaseHTTPRequestHandler) -> Optional[str]:
+        session = self.sessions.get(self._session_id(handler) or "")
+        if session is None or session["expires_at"] < time.time():
+            return None
+        return session["username"]
+
+    def _login(self, handler: BaseHTTPRequestHandler, body: Dict[str, Any]):
+        self._count("login")
+        username = body.get("username", "")
+        if not username or (self.accounts is not None and self.accounts.get(username) != body.get("password")):
+            return self._send_json(handler, 400, {"status": "fail", "message": "bad_password"})
+
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self.login_counts[username] += 1
+            self.sessions[session_id] = {"username": username, "expires_at": time.time() + self.session_seconds}
+        return self._send_json(handler, 200, {
+            "status": "ok",
+            "logged_in_user": {"username": username, "pk": zlib.crc32(username.encode())},
+            "session_id": session_id,
+            "expires_in": self.session_seconds
+        }, cookies={"sessionid": session_id})
+
+    def _configure(self, handler: BaseHTTPRequestHandler, username: str, body: Dict[str, Any]):
+        now = time.time()
+        with self._lock:
+            if self.posts_per_minute is not None:
+                recent = [t for t in self._post_times.get(username, []) if now - t < 60]
+                self._post_times[username] = recent
+                if len(recent) >= self.posts_per_minute:
+                    retry_after = int(60 - (now - recent[0])) + 1
+                    self.request_counts["throttled"] += 1
+                    return self._send_json(handler, 429, {"status": "fail", "message": "Please wait a few minutes"},
+                                           headers={"Retry-After": str(retry_after)})
+                recent.append(now)
+
+            if body.get("upload_id") not in self.uploads:
+                return self._send_json(handler, 400, {"status": "fail", "message": "unknown upload_id"})
+
+            media_id = uuid.uuid4().hex
+            self.media[media_id] = {"username": username, "caption": body.get("caption", ""), "taken_at": now}
+            self.post_counts[username] += 1
+        return self._send_json(handler, 200, {"status": "ok", "media": {"id": media_id, "code": media_id[:11]}})
+
+    def _send_json(self, handler: BaseHTTPRequestHandler, status: int, payload: Dict[str, Any],
+                   cookies: Optional[Dict[str, str]] = None, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        for name, value in (cookies or {}).items():
+            handler.send_header("Set-Cookie", f"{name}={value}; Path=/; HttpOnly")
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local fake Instagram API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--session-seconds", type=float, default=3600.0)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--posts-per-minute", type=int, default=None, help="Per-account posting limit (429 above it)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    server = FakeInstagramServer(args.host, args.port, session_seconds=args.session_seconds,
+                                 latency=args.latency, posts_per_minute=args.posts_per_minute)
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
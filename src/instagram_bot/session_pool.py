@@ -0,0 +1,377 @@
+"""
+Session Pool - Authenticated Instagram sessions for many accounts over shared connections
+
+Usage:
+    python -m src.instagram_bot.session_pool --fake [--accounts 20] [--posts 5] [--workers 16]
+
+With --fake the run goes against a local FakeInstagramServer and reports
+throughput together with how many logins each account needed.
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import hashlib
+import argparse
+import logging
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.cookiejar import DefaultCookiePolicy
+from typing import Dict, Iterable, Iterator, Optional, Any
+
+from ..utils.http_pool import HttpPool
+from ..utils.rate_limiter import RateLimiter
+from ..utils.paths import data_path
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+
+logger = logging.getLogger(__name__)
+
+
+class AccountSession:
+    def __init__(self, username: str, cookies: Dict[str, str], user_id: Optional[str], expires_at: float,
+                 created_at: Optional[float] = None):
+        self.username = username
+        self.cookies = cookies
+        self.user_id = user_id
+        self.expires_at = expires_at
+        self.created_at = created_at or time.time()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "username": self.username,
+            "cookies": self.cookies,
+            "user_id": self.user_id,
+            "expires_at": self.expires_at,
+            "created_at": self.created_at
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "AccountSession":
+        return cls(data["username"], data["cookies"], data.get("user_id"), data["expires_at"], data.get("created_at"))
+
+    @property
+    def cookie_header(self) -> str:
+        return "; ".join(f"{name}={value}" for name, value in self.cookies.items())
+
+
+class SessionStore:
+    # One Fernet-encrypted file per account, named by a hash of the username.
+    # The key comes from INSTAGRAM_SESSION_KEY, or is derived from SECRET_KEY.
+    # Without the cryptography package or a key, sessions are only kept in
+    # memory and every process start logs in again.
+
+    def __init__(self, directory: Optional[str] = None, key: Optional[str] = None):
+        self.directory = directory or os.getenv("INSTAGRAM_SESSION_DIR") or data_path("sessions")
+        os.makedirs(self.directory, exist_ok=True)
+
+        key = key or os.getenv("INSTAGRAM_SESSION_KEY")
+        if not key and os.getenv("SECRET_KEY"):
+            key = base64.urlsafe_b64encode(hashlib.sha256(os.getenv("SECRET_KEY").encode()).digest()).decode()
+
+        self._fernet = None
+        if Fernet is None:
+            logger.warning("cryptography is not installed; Instagram sessions will not be saved to disk")
+        elif not key:
+            logger.warning("No INSTAGRAM_SESSION_KEY or SECRET_KEY set; Instagram sessions will not be saved to disk")
+        else:
+            self._fernet = Fernet(key.encode())
+
+    @property
+    def enabled(self) -> bool:
+        return self._fernet is not None
+
+    def _path(self, username: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(username.encode()).hexdigest()[:32] + ".session")
+
+    def load(self, username: str) -> Optional[AccountSession]:
+        if not self.enabled:
+            return None
+        try:
+            with open(self._path(username), "rb") as f:
+                data = json.loads(self._fernet.decrypt(f.read()))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, InvalidToken) as e:
+            logger.warning(f"Discarding unreadable session for {username}: {str(e)}")
+            return None
+        return AccountSession.from_dict(data)
+
+    def save(self, session: AccountSession):
+        if not self.enabled:
+            return
+        token = self._fernet.encrypt(json.dumps(session.to_dict()).encode())
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".session")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(token)
+            os.replace(tmp_path, self._path(session.username))
+        except OSError as e:
+            logger.warning(f"Could not save session for {session.username}: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def delete(self, username: str):
+        try:
+            os.remove(self._path(username))
+        except FileNotFoundError:
+            pass
+
+
+def load_credentials() -> Dict[str, str]:
+    # INSTAGRAM_ACCOUNTS_FILE is a JSON object of username -> password; the
+    # single INSTAGRAM_USERNAME/INSTAGRAM_PASSWORD account is added to it
+    credentials = {}
+    accounts_file = os.getenv("INSTAGRAM_ACCOUNTS_FILE")
+    if accounts_file:
+        with open(accounts_file) as f:
+            credentials.update(json.load(f))
+    if os.getenv("INSTAGRAM_USERNAME") and os.getenv("INSTAGRAM_PASSWORD"):
+        credentials[os.getenv("INSTAGRAM_USERNAME")] = os.getenv("INSTAGRAM_PASSWORD")
+    return credentials
+
+
+class InstagramSessionPool:
+    # Sessions are cached in memory and in the SessionStore, so an account
+    # logs in once and then only refreshes: a session used within
+    # refresh_margin seconds of expiry is extended first, and one that has
+    # already expired (or is rejected with a 401) is replaced by a new login.
+    # A lock per account means concurrent callers never log in twice.
+    #
+    # All accounts share one keep-alive HttpPool. Its cookie jar is disabled
+    # so no account's cookies leak into another's requests; each request
+    # carries its own session cookie instead. Posting runs on a thread pool,
+    # one post at a time per account, and draws on the per-account
+    # instagram_post and instagram_login rate limits.
+
+    def __init__(self, base_url: Optional[str] = None, credentials: Optional[Dict[str, str]] = None,
+                 http: Optional[HttpPool] = None, store: Optional[SessionStore] = None,
+                 rate_limiter: Optional[RateLimiter] = None, refresh_margin: Optional[float] = None,
+                 max_workers: Optional[int] = None, per_account_concurrency: Optional[int] = None):
+        self.base_url = (base_url or os.getenv("INSTAGRAM_API_URL", "https://i.instagram.com")).rstrip("/")
+        self.credentials = credentials if credentials is not None else load_credentials()
+        self.max_workers = max_workers or int(os.getenv("INSTAGRAM_POOL_WORKERS", 16))
+        self.refresh_margin = refresh_margin if refresh_margin is not None else float(
+            os.getenv("INSTAGRAM_SESSION_REFRESH_MARGIN", 600))
+        self.per_account_concurrency = per_account_concurrency or int(os.getenv("INSTAGRAM_ACCOUNT_CONCURRENCY", 1))
+
+        self.http = http or HttpPool(pool_maxsize=self.max_workers, rate_limiter=rate_limiter)
+        self.http.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        self.store = store or SessionStore()
+
+        self._sessions: Dict[str, AccountSession] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._slots: Dict[str, threading.Semaphore] = {}
+        self._locks_lock = threading.Lock()
+        self._executor = None
+        self.stats = Counter()
+
+    def _account_lock(self, username: str) -> threading.Lock:
+        with self._locks_lock:
+            if username not in self._locks:
+                self._locks[username] = threading.Lock()
+                self._slots[username] = threading.Semaphore(self.per_account_concurrency)
+            return self._locks[username]
+
+    def _count(self, kind: str):
+        with self._locks_lock:
+            self.stats[kind] += 1
+
+    def session(self, username: str) -> AccountSession:
+        with self._account_lock(username):
+            session = self._sessions.get(username)
+            if session is None:
+                session = self.store.load(username)
+                if session is not None:
+                    self._count("disk_hits")
+            else:
+                self._count("memory_hits")
+
+            now = time.time()
+            if session is None or session.expires_at <= now:
+                session = self._login(username)
+            elif session.expires_at - now < self.refresh_margin:
+                session = self._refresh(session) or self._login(username)
+
+            self._sessions[username] = session
+            return session
+
+    def invalidate(self, username: str):
+        with self._account_lock(username):
+            self._sessions.pop(username, None)
+            self.store.delete(username)
+
+    def _login(self, username: str) -> AccountSession:
+        # Caller holds the account lock
+        if username not in self.credentials:
+            raise Exception(f"No credentials for Instagram account {username}")
+
+        self._count("logins")
+        response = self.http.post(
+            f"{self.base_url}/api/v1/accounts/login/",
+            json={"username": username, "password": self.credentials[username]},
+            rate_limit="instagram_login",
+            rate_limit_key=username
+        )
+        if response.status_code != 200:
+            raise Exception(f"Instagram login failed for {username}: {response.status_code} - {response.text[:200]}")
+
+        data = response.json()
+        cookies = dict(response.cookies)
+        if data.get("session_id"):
+            cookies.setdefault("sessionid", data["session_id"])
+        session = AccountSession(
+            username,
+            cookies,
+            str((data.get("logged_in_user") or {}).get("pk", "")) or None,
+            time.time() + float(data.get("expires_in", 3600))
+        )
+        self.store.save(session)
+        logger.info(f"Logged in to Instagram as {username}")
+        return session
+
+    def _refresh(self, session: AccountSession) -> Optional[AccountSession]:
+        # Caller holds the account lock
+        self._count("refreshes")
+        try:
+            response = self.http.post(
+                f"{self.base_url}/api/v1/accounts/session/refresh/",
+                headers={"Cookie": session.cookie_header}
+            )
+        except Exception as e:
+            logger.warning(f"Session refresh for {session.username} failed: {str(e)}")
+            return None
+        if response.status_code != 200:
+            return None
+
+        session.cookies.update(dict(response.cookies))
+        session.expires_at = time.time() + float(response.json().get("expires_in", 3600))
+        self.store.save(session)
+        return session
+
+    def request(self, username: str, method: str, path: str, rate_limit: Optional[str] = None, **kwargs):
+        # One retry with a fresh login when the server no longer accepts the session
+        for attempt in range(2):
+            session = self.session(username)
+            headers = dict(kwargs.pop("headers", None) or {})
+            headers["Cookie"] = session.cookie_header
+            response = self.http.request(method, f"{self.base_url}{path}", headers=headers,
+                                         rate_limit=rate_limit, rate_limit_key=username if rate_limit else None,
+                                         **kwargs)
+            kwargs["headers"] = headers
+            if response.status_code != 401 or attempt:
+                return response
+            logger.warning(f"Instagram session for {username} was rejected, logging in again")
+            with self._account_lock(username):
+                if self._sessions.get(username) is session:
+                    self._sessions.pop(username)
+                    self.store.delete(username)
+        return response
+
+    def post_photo(self, username: str, image_path: str, caption: str) -> Dict[str, Any]:
+        self._account_lock(username)
+        with self._slots[username]:
+            with open(image_path, "rb") as f:
+                response = self.request(username, "POST", "/api/v1/media/upload/", data=f.read(),
+                                        headers={"Content-Type": "application/octet-stream"})
+            if response.status_code != 200:
+                raise Exception(f"Upload failed for {username}: {response.status_code} - {response.text[:200]}")
+
+            response = self.request(username, "POST", "/api/v1/media/configure/", rate_limit="instagram_post",
+                                    json={"upload_id": response.json()["upload_id"], "caption": caption})
+            if response.status_code != 200:
+                raise Exception(f"Publishing failed for {username}: {response.status_code} - {response.text[:200]}")
+
+        self._count("posts")
+        return response.json()["media"]
+
+    def post_many(self, posts: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        # posts are {"account", "image_path", "caption"} dicts; results are
+        # yielded in completion order with "success" and "media" or "error"
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="instagram-post")
+
+        futures = {
+            self._executor.submit(self.post_photo, post["account"], post["image_path"], post["caption"]): post
+            for post in posts
+        }
+        for future in as_completed(futures):
+            post = futures[future]
+            try:
+                yield {"account": post["account"], "success": True, "media": future.result()}
+            except Exception as e:
+                logger.error(f"Posting for {post['account']} failed: {str(e)}")
+                yield {"account": post["account"], "success": False, "error": str(e)}
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._locks_lock:
+            stats = dict(self.stats)
+        stats["accounts"] = len(self._sessions)
+        stats["http"] = self.http.get_stats()
+        return stats
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.http.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive many Instagram accounts through one session pool")
+    parser.add_argument("--fake", action="store_true", help="Run against a local FakeInstagramServer")
+    parser.add_argument("--accounts", type=int, default=20)
+    parser.add_argument("--posts", type=int, default=5, help="Posts per account")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake server latency per request")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    if not args.fake:
+        parser.error("only --fake runs are supported from the command line")
+
+    from .fake_instagram import FakeInstagramServer
+
+    accounts = {f"account{i}": f"password{i}" for i in range(args.accounts)}
+    with tempfile.TemporaryDirectory() as tmp, FakeInstagramServer(accounts=accounts, latency=args.latency) as server:
+        image_path = os.path.join(tmp, "post.jpg")
+        with open(image_path, "wb") as f:
+            f.write(os.urandom(64 * 1024))
+
+        # Generous limits so the run measures the pool rather than the quotas
+        limiter = RateLimiter(path=os.path.join(tmp, "rate_limits.sqlite3"), limits={
+            "instagram_post": [(args.posts, 1)], "instagram_login": [(5, 1)]
+        })
+        pool = InstagramSessionPool(server.url, accounts, http=HttpPool(pool_maxsize=args.workers, rate_limiter=limiter),
+                                    store=SessionStore(os.path.join(tmp, "sessions")), max_workers=args.workers)
+
+        posts = [{"account": name, "image_path": image_path, "caption": f"post {n}"}
+                 for n in range(args.posts) for name in accounts]
+        start = time.perf_counter()
+        results = list(pool.post_many(posts))
+        elapsed = time.perf_counter() - start
+        stats = pool.get_stats()
+        pool.close()
+
+        print(json.dumps({
+            "posts": len(results),
+            "succeeded": sum(1 for result in results if result["success"]),
+            "seconds": round(elapsed, 3),
+            "posts_per_second": round(len(results) / elapsed, 1) if elapsed else None,
+            "logins": sum(server.login_counts.values()),
+            "max_logins_per_account": max(server.login_counts.values(), default=0),
+            "connections": stats["http"]["connections"],
+            "requests": stats["http"]["requests"]
+        }, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,8 +2,16 @@
 Scheduler Module - Smart scheduling system for Instagram activities
 """
 
-from .scheduler import InstagramScheduler
-from .activity_patterns import ActivityPattern
-from .config_manager import SchedulerConfig
+from ..utils.lazy import lazy_exports
 
-__all__ = ['InstagramScheduler', 'ActivityPattern', 'SchedulerConfig']
\ No newline at end of file
+_EXPORTS = {
+    'InstagramScheduler': '.scheduler',
+    'ActivityPattern': '.activity_patterns',
+    'SchedulerConfig': '.config_manager',
+    'SchedulerEngine': '.engine',
+    'ContentBuffer': '.content_buffer',
+    'BufferFiller': '.content_buffer'
+}
+
+__all__ = list(_EXPORTS)
+__getattr__ = lazy_exports(__name__, _EXPORTS)
@@ -0,0 +1,383 @@
+"""
+Content Buffer - Ready-to-post content kept ahead of scheduled posting slots
+
+Usage:
+    python -m src.scheduler.content_buffer [--account NAME --theme THEME --target N] [--workers N]
+
+The buffer holds finished content packages per (account, theme). A
+BufferFiller compares it with the posts the SchedulerEngine has coming up and
+queues generation jobs in the JobStore to cover the difference, so a posting
+slot only has to take the next ready package instead of waiting on Midjourney.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import sqlite3
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple, Any
+
+from ..content_generation.job_store import JobStore
+from ..content_generation.generation_worker import GenerationWorker
+from ..utils.paths import data_path
+from .engine import SchedulerEngine, read_upcoming
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS content_buffer (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    account TEXT NOT NULL,
+    theme TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_content_buffer_slot ON content_buffer (account, theme, id);
+CREATE TABLE IF NOT EXISTS buffer_refills (
+    job_id INTEGER PRIMARY KEY,
+    account TEXT NOT NULL,
+    theme TEXT NOT NULL,
+    requested_at REAL NOT NULL
+);
+"""
+
+Slot = Tuple[str, str]
+
+
+class ContentBuffer:
+    # Each (account, theme) slot is a FIFO of finished packages in SQLite.
+    # take() reads the oldest row through the slot index and deletes it in
+    # the same transaction, so it costs the same however full the buffer is
+    # and two posting workers can never receive the same package. Packages
+    # older than max_age are skipped and removed by evict().
+
+    def __init__(self, path: Optional[str] = None, capacity: Optional[int] = None, max_age: Optional[float] = None):
+        self.path = path or os.getenv("CONTENT_BUFFER_DB") or data_path("content_buffer.sqlite3")
+        self.capacity = capacity or int(os.getenv("CONTENT_BUFFER_CAPACITY", 10))
+        self.max_age = max_age if max_age is not None else float(os.getenv("CONTENT_BUFFER_MAX_AGE", 7 * 24 * 3600))
+        self._local = threading.local()
+
+        self._stats_lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0, "added": 0}
+
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _insert(self, conn: sqlite3.Connection, account: str, theme: Optional[str], content: Dict[str, Any]):
+        conn.execute(
+            "INSERT INTO content_buffer (account, theme, content, created_at) VALUES (?, ?, ?, ?)",
+            (account, theme or "", json.dumps(content), time.time())
+        )
+
+    def put(self, account: str, theme: Optional[str], content: Dict[str, Any]):
+        self._insert(self._connect(), account, theme, content)
+        with self._stats_lock:
+            self._counts["added"] += 1
+
+    def settle_refill(self, job_id: int, account: str, theme: Optional[str],
+                      content: Optional[Dict[str, Any]] = None) -> bool:
+        # Removes a refill job's row and, when it produced content, adds the
+        # package, in one transaction: a crash between the two cannot lose
+        # or duplicate it, and of two concurrent callers only the one that
+        # deleted the row adds the package. Returns False for the other.
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            claimed = conn.execute("DELETE FROM buffer_refills WHERE job_id = ?", (job_id,)).rowcount == 1
+            if claimed and content is not None:
+                self._insert(conn, account, theme, content)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        if claimed and content is not None:
+            with self._stats_lock:
+                self._counts["added"] += 1
+        return claimed
+
+    def take(self, account: str, theme: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, content FROM content_buffer WHERE account = ? AND theme = ? AND created_at >= ? "
+                "ORDER BY id LIMIT 1",
+                (account, theme or "", time.time() - self.max_age)
+            ).fetchone()
+            if row is not None:
+                conn.execute("DELETE FROM content_buffer WHERE id = ?", (row[0],))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        with self._stats_lock:
+            self._counts["hits" if row else "misses"] += 1
+        if row is None:
+            logger.warning(f"Content buffer empty for {account} ({theme or 'Historical'})")
+            return None
+        return json.loads(row[1])
+
+    def depth(self, account: str, theme: Optional[str] = None) -> int:
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM content_buffer WHERE account = ? AND theme = ? AND created_at >= ?",
+            (account, theme or "", time.time() - self.max_age)
+        ).fetchone()[0]
+
+    def evict(self) -> int:
+        return self._connect().execute(
+            "DELETE FROM content_buffer WHERE created_at < ?", (time.time() - self.max_age,)
+        ).rowcount
+
+    def slot_stats(self) -> Dict[Slot, Dict[str, Any]]:
+        now = time.time()
+        rows = self._connect().execute(
+            "SELECT account, theme, COUNT(*), MIN(created_at) FROM content_buffer WHERE created_at >= ? "
+            "GROUP BY account, theme",
+            (now - self.max_age,)
+        ).fetchall()
+        return {(account, theme): {"depth": count, "oldest_age": now - oldest}
+                for account, theme, count, oldest in rows}
+
+    def get_counts(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return dict(self._counts)
+
+
+def schedule_demand(engine: Optional[SchedulerEngine] = None, handler: str = "post",
+                    horizon: Optional[float] = None, path: Optional[str] = None) -> Dict[Slot, int]:
+    # Number of posts per (account, theme) due within the horizon, from the
+    # engine running in this process or, without one, read from the schedule
+    # database (path, default SCHEDULER_DB) that another process owns
+    horizon = horizon if horizon is not None else float(os.getenv("CONTENT_BUFFER_HORIZON", 24 * 3600))
+    upcoming = engine.upcoming(handler, horizon) if engine is not None else read_upcoming(handler, horizon, path)
+    demand: Dict[Slot, int] = {}
+    for payload, runs in upcoming:
+        slot = (payload.get("account", ""), payload.get("theme") or "")
+        demand[slot] = demand.get(slot, 0) + runs
+    return demand
+
+
+class BufferFiller:
+    # Background producer for a ContentBuffer. Every pass it collects
+    # finished refill jobs from the JobStore into the buffer, then queues
+    # new jobs for slots whose ready plus in-flight packages fall short of
+    # upcoming demand (capped at the buffer capacity). Given a generator it
+    # also runs GenerationWorker threads itself; otherwise separate
+    # generation_worker processes pick the jobs up.
+
+    def __init__(self, buffer: ContentBuffer, demand: Callable[[], Dict[Slot, int]],
+                 store: Optional[JobStore] = None, generator=None, workers: Optional[int] = None,
+                 interval: Optional[float] = None, min_depth: Optional[int] = None):
+        self.buffer = buffer
+        self.demand = demand
+        self.store = store or JobStore()
+        self.generator = generator
+        self.workers = workers or int(os.getenv("CONTENT_BUFFER_WORKERS", 2))
+        self.interval = interval or float(os.getenv("CONTENT_BUFFER_REFILL_INTERVAL", 60))
+        # Fewest packages kept ready for any slot that has posts scheduled
+        self.min_depth = min_depth if min_depth is not None else int(os.getenv("CONTENT_BUFFER_MIN_DEPTH", 1))
+
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._generation_workers: List[GenerationWorker] = []
+        self._stats_lock = threading.Lock()
+        self._refill_lags: Deque[float] = deque(maxlen=1000)
+        self._last_demand: Dict[Slot, int] = {}
+        self._last_pass = 0.0
+
+    def _in_flight(self) -> Dict[Slot, List[Tuple[int, float]]]:
+        rows = self.buffer._connect().execute(
+            "SELECT job_id, account, theme, requested_at FROM buffer_refills"
+        ).fetchall()
+        in_flight: Dict[Slot, List[Tuple[int, float]]] = {}
+        for job_id, account, theme, requested_at in rows:
+            in_flight.setdefault((account, theme), []).append((job_id, requested_at))
+        return in_flight
+
+    def collect(self) -> int:
+        collected = 0
+        for (account, theme), jobs in self._in_flight().items():
+            for job_id, requested_at in jobs:
+                job = self.store.get(job_id)
+                if job is None or job["status"] == "failed":
+                    self.buffer.settle_refill(job_id, account, theme)
+                    continue
+                if job["status"] != "completed":
+                    continue
+                content = job["result"] if job["result"] and job["result"].get("success") else None
+                if self.buffer.settle_refill(job_id, account, theme, content) and content is not None:
+                    collected += 1
+                    with self._stats_lock:
+                        self._refill_lags.append(job["updated_at"] - requested_at)
+        return collected
+
+    def refill(self) -> int:
+        demand = self.demand()
+        depths = {slot: stats["depth"] for slot, stats in self.buffer.slot_stats().items()}
+        in_flight = self._in_flight()
+
+        queued = 0
+        now = time.time()
+        conn = self.buffer._connect()
+        for slot in set(demand) | set(depths) | set(in_flight):
+            account, theme = slot
+            target = min(self.buffer.capacity, max(demand[slot], self.min_depth)) if slot in demand else 0
+            missing = target - depths.get(slot, 0) - len(in_flight.get(slot, []))
+            for _ in range(max(0, missing)):
+                job_id = self.store.enqueue(theme or None, {"buffer_account": account})
+                conn.execute(
+                    "INSERT INTO buffer_refills (job_id, account, theme, requested_at) VALUES (?, ?, ?, ?)",
+                    (job_id, account, theme, now)
+                )
+                queued += 1
+
+        with self._stats_lock:
+            self._last_demand = demand
+            self._last_pass = now
+        if queued:
+            logger.info(f"Queued {queued} generation jobs to refill the content buffer")
+        return queued
+
+    def run_once(self):
+        self.collect()
+        self.buffer.evict()
+        self.refill()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Content buffer refill failed: {str(e)}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._stop.clear()
+        if self.generator is not None:
+            for index in range(self.workers):
+                worker = GenerationWorker(self.generator, self.store, worker_id=f"buffer-{os.getpid()}-{index}",
+                                          idle_interval=min(self.interval, 5))
+                thread = threading.Thread(target=worker.run_forever, name=f"buffer-worker-{index}", daemon=True)
+                thread.start()
+                self._generation_workers.append(worker)
+                self._threads.append(thread)
+
+        thread = threading.Thread(target=self._loop, name="buffer-filler", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for worker in self._generation_workers:
+            worker.stop()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._generation_workers = []
+
+    def get_metrics(self) -> Dict[str, Any]:
+        stats = self.buffer.slot_stats()
+        in_flight = self._in_flight()
+        now = time.time()
+        with self._stats_lock:
+            demand = dict(self._last_demand)
+            lags = list(self._refill_lags)
+            last_pass = self._last_pass
+
+        slots = {}
+        for slot in set(stats) | set(in_flight) | set(demand):
+            # Refill lag of a slot is how long its oldest outstanding job has been waiting
+            pending = in_flight.get(slot, [])
+            slots[f"{slot[0]}/{slot[1] or 'Historical'}"] = {
+                "depth": stats.get(slot, {}).get("depth", 0),
+                "oldest_age": stats.get(slot, {}).get("oldest_age", 0.0),
+                "in_flight": len(pending),
+                "demand": demand.get(slot, 0),
+                "refill_lag": max((now - requested_at for _, requested_at in pending), default=0.0)
+            }
+
+        return {
+            **self.buffer.get_counts(),
+            "slots": slots,
+            "refill_lag_avg": sum(lags) / len(lags) if lags else 0.0,
+            "refill_lag_max": max(lags) if lags else 0.0,
+            "last_pass_age": now - last_pass if last_pass else None
+        }
+
+
+def make_post_handler(buffer: ContentBuffer, post: Callable[[str, Dict[str, Any]], Any],
+                      generator=None, features=None) -> Callable[[Dict[str, Any]], Any]:
+    # SchedulerEngine handler for {"account": ..., "theme": ...} payloads.
+    # Falls back to generating on the spot when the buffer has run dry.
+    # With an ImageFeatureStore, the image is linked to the media id that
+    # post() returns, so its engagement can be used for calibration.
+    def handler(payload: Dict[str, Any]):
+        account = payload["account"]
+        theme = payload.get("theme")
+        content = buffer.take(account, theme)
+        if content is None:
+            if generator is None:
+                raise Exception(f"No buffered content for {account}")
+            content = generator.generate_historical_content(theme)
+            if not content.get("success"):
+                raise Exception(content.get("error", "Content generation failed"))
+        result = post(account, content)
+        if features is not None and isinstance(result, dict) and result.get("id"):
+            features.link_post(content["image_path"], account, result["id"])
+        return result
+
+    return handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep the content buffer filled ahead of scheduled posts")
+    parser.add_argument("--account", help="Keep a fixed number of packages ready for this account")
+    parser.add_argument("--theme", default="", help="Theme for --account")
+    parser.add_argument("--target", type=int, default=None, help="Packages to keep ready for --account")
+    parser.add_argument("--workers", type=int, default=None, help="In-process generation workers")
+    parser.add_argument("--once", action="store_true", help="Run a single refill pass and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    buffer = ContentBuffer()
+    if args.account:
+        target = args.target or buffer.capacity
+        demand = lambda: {(args.account, args.theme): target}
+    else:
+        demand = schedule_demand
+
+    if args.once:
+        filler = BufferFiller(buffer, demand)
+        filler.run_once()
+        print(json.dumps(filler.get_metrics(), indent=2))
+        return 0
+
+    from ..content_generation.ai_content_generator import AIContentGenerator
+    filler = BufferFiller(buffer, demand, generator=AIContentGenerator(), workers=args.workers)
+    filler.start()
+    try:
+        while True:
+            time.sleep(filler.interval)
+            logger.info(f"Content buffer: {json.dumps(filler.get_metrics())}")
+    except KeyboardInterrupt:
+        filler.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,399 @@
+"""
+Scheduler Engine - Timer-heap job scheduler with a worker pool and a persistent schedule
+"""
+
+import os
+import json
+import time
+import heapq
+import uuid
+import logging
+import pathlib
+import sqlite3
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple, Any
+
+from ..utils.paths import data_path
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scheduled_jobs (
+    id TEXT PRIMARY KEY,
+    handler TEXT NOT NULL,
+    run_at REAL NOT NULL,
+    payload TEXT NOT NULL DEFAULT '{}',
+    interval REAL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_scheduled_jobs_status ON scheduled_jobs (status, run_at);
+"""
+
+
+def default_path() -> str:
+    return os.getenv("SCHEDULER_DB") or data_path("scheduler.sqlite3")
+
+
+def _upcoming(conn: sqlite3.Connection, handler: str, horizon: float) -> List[Tuple[Dict[str, Any], int]]:
+    # A recurring job runs once per interval, so it is counted for every run
+    # inside the horizon; that includes the next runs of one that is running
+    # right now. Overdue runs happen immediately.
+    now = time.time()
+    end = now + horizon
+    rows = conn.execute(
+        "SELECT run_at, payload, interval, status FROM scheduled_jobs "
+        "WHERE handler = ? AND run_at <= ? AND (status = 'pending' OR (status = 'running' AND interval IS NOT NULL)) "
+        "ORDER BY run_at",
+        (handler, end)
+    ).fetchall()
+    upcoming = []
+    for run_at, payload, interval, status in rows:
+        if not interval:
+            runs = 1
+        else:
+            first = max(run_at + interval if status == "running" else run_at, now)
+            runs = int((end - first) // interval) + 1 if first <= end else 0
+        if runs:
+            upcoming.append((json.loads(payload), runs))
+    return upcoming
+
+
+def read_upcoming(handler: str, horizon: float, path: Optional[str] = None) -> List[Tuple[Dict[str, Any], int]]:
+    # SchedulerEngine.upcoming() for other processes. The database is opened
+    # read-only: constructing a second engine would recover the schedule and
+    # mark the jobs the owning process is running as interrupted.
+    path = path or default_path()
+    if not os.path.exists(path):
+        return []
+    conn = sqlite3.connect(pathlib.Path(path).absolute().as_uri() + "?mode=ro", uri=True, timeout=30)
+    try:
+        return _upcoming(conn, handler, horizon)
+    finally:
+        conn.close()
+
+
+class _Entry:
+    __slots__ = ("job_id", "handler", "run_at", "payload", "interval", "version")
+
+    def __init__(self, job_id: str, handler: str, run_at: float, payload: Dict[str, Any],
+                 interval: Optional[float], version: int):
+        self.job_id = job_id
+        self.handler = handler
+        self.run_at = run_at
+        self.payload = payload
+        self.interval = interval
+        self.version = version
+
+
+class SchedulerEngine:
+    # Pending jobs sit in a binary heap ordered by run_at, so scheduling is
+    # O(log n) and the dispatcher only ever looks at the head instead of
+    # scanning every job on each tick. Cancelling or rescheduling bumps the
+    # job's version; stale heap entries are skipped when they surface and the
+    # heap is rebuilt once they make up more than half of it.
+    #
+    # Every job is also a row in SQLite. A job is marked running before it is
+    # handed to the worker pool, so after a restart pending jobs are reloaded
+    # (overdue ones run right away) while jobs that were mid-flight are not
+    # replayed unless SCHEDULER_RERUN_INTERRUPTED is set. One engine process
+    # owns a schedule database at a time.
+
+    def __init__(self, path: Optional[str] = None, workers: Optional[int] = None,
+                 rerun_interrupted: Optional[bool] = None):
+        self.path = path or default_path()
+        self.workers = workers or int(os.getenv("SCHEDULER_WORKERS", 8))
+        if rerun_interrupted is None:
+            rerun_interrupted = os.getenv("SCHEDULER_RERUN_INTERRUPTED", "false").lower() == "true"
+        self.rerun_interrupted = rerun_interrupted
+
+        self._handlers: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+        self._jobs: Dict[str, _Entry] = {}
+        self._heap: List[tuple] = []
+        self._version = 0
+        self._cond = threading.Condition()
+        self._local = threading.local()
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._dispatcher: Optional[threading.Thread] = None
+        self._running = False
+
+        self._stats_lock = threading.Lock()
+        self._latencies: Deque[float] = deque(maxlen=int(os.getenv("SCHEDULER_LATENCY_SAMPLES", 10000)))
+        self._counts = {"dispatched": 0, "succeeded": 0, "failed": 0, "cancelled": 0}
+
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+        self._load()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _load(self):
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            if self.rerun_interrupted:
+                conn.execute(
+                    "UPDATE scheduled_jobs SET status = 'pending', updated_at = ? WHERE status = 'running'", (now,)
+                )
+            else:
+                interrupted = conn.execute(
+                    "UPDATE scheduled_jobs SET status = 'failed', error = 'interrupted by restart', updated_at = ? "
+                    "WHERE status = 'running' AND interval IS NULL",
+                    (now,)
+                ).rowcount
+                if interrupted:
+                    logger.warning(f"{interrupted} scheduled jobs were running when the scheduler stopped; "
+                                   f"not replaying them")
+                # Recurring jobs skip the interrupted run and continue with the next one
+                conn.execute(
+                    "UPDATE scheduled_jobs SET status = 'pending', run_at = run_at + interval, updated_at = ? "
+                    "WHERE status = 'running' AND interval IS NOT NULL",
+                    (now,)
+                )
+
+        rows = conn.execute(
+            "SELECT id, handler, run_at, payload, interval FROM scheduled_jobs WHERE status = 'pending'"
+        ).fetchall()
+        with self._cond:
+            for job_id, handler, run_at, payload, interval in rows:
+                self._push(_Entry(job_id, handler, run_at, json.loads(payload), interval, 0))
+        if rows:
+            logger.info(f"Loaded {len(rows)} pending jobs from {self.path}")
+
+    def _push(self, entry: _Entry):
+        # Caller holds self._cond
+        self._version += 1
+        entry.version = self._version
+        self._jobs[entry.job_id] = entry
+        heapq.heappush(self._heap, (entry.run_at, entry.version, entry.job_id))
+
+    def _compact(self):
+        # Caller holds self._cond
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._jobs):
+            self._heap = [(e.run_at, e.version, e.job_id) for e in self._jobs.values()]
+            heapq.heapify(self._heap)
+
+    def register(self, name: str, handler: Callable[[Dict[str, Any]], Any]):
+        self._handlers[name] = handler
+
+    def schedule(self, handler: str, run_at: float, payload: Optional[Dict[str, Any]] = None,
+                 job_id: Optional[str] = None, interval: Optional[float] = None) -> str:
+        return self.schedule_many([{
+            "handler": handler, "run_at": run_at, "payload": payload, "job_id": job_id, "interval": interval
+        }])[0]
+
+    def schedule_many(self, jobs: Iterable[Dict[str, Any]]) -> List[str]:
+        # Scheduling an existing job_id replaces that job
+        now = time.time()
+        entries = [
+            _Entry(job.get("job_id") or uuid.uuid4().hex, job["handler"], float(job["run_at"]),
+                   job.get("payload") or {}, job.get("interval"), 0)
+            for job in jobs
+        ]
+        if not entries:
+            return []
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO scheduled_jobs (id, handler, run_at, payload, interval, status, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, 'pending', ?)",
+                [(e.job_id, e.handler, e.run_at, json.dumps(e.payload), e.interval, now) for e in entries]
+            )
+
+        with self._cond:
+            head = self._heap[0][0] if self._heap else None
+            for entry in entries:
+                self._push(entry)
+            self._compact()
+            if head is None or min(e.run_at for e in entries) < head:
+                self._cond.notify()
+        return [entry.job_id for entry in entries]
+
+    def cancel(self, job_id: str) -> bool:
+        with self._cond:
+            entry = self._jobs.pop(job_id, None)
+            self._compact()
+
+        with self._connect() as conn:
+            updated = conn.execute(
+                "UPDATE scheduled_jobs SET status = 'cancelled', updated_at = ? "
+                "WHERE id = ? AND status IN ('pending', 'running')",
+                (time.time(), job_id)
+            ).rowcount
+
+        if entry is not None or updated:
+            with self._stats_lock:
+                self._counts["cancelled"] += 1
+            return True
+        return False
+
+    def pending_count(self) -> int:
+        with self._cond:
+            return len(self._jobs)
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            "SELECT id, handler, run_at, payload, interval, status, attempts, error FROM scheduled_jobs WHERE id = ?",
+            (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        keys = ("id", "handler", "run_at", "payload", "interval", "status", "attempts", "error")
+        job = dict(zip(keys, row))
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def upcoming(self, handler: str, horizon: float) -> List[Tuple[Dict[str, Any], int]]:
+        # (payload, number of runs) of the jobs for handler due within the next horizon seconds
+        return _upcoming(self._connect(), handler, horizon)
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scheduler-worker")
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="scheduler-dispatch", daemon=True)
+        self._dispatcher.start()
+        logger.info(f"Scheduler engine started ({self.workers} workers, {self.pending_count()} pending jobs)")
+
+    def stop(self, wait: bool = True):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._dispatcher is not None:
+            self._dispatcher.join()
+            self._dispatcher = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def _pop_due(self) -> List[_Entry]:
+        # Caller holds self._cond. Returns every job whose time has come.
+        now = time.time()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, version, job_id = heapq.heappop(self._heap)
+            entry = self._jobs.get(job_id)
+            if entry is None or entry.version != version:
+                continue
+            del self._jobs[job_id]
+            due.append(entry)
+        return due
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                due = []
+                while self._running:
+                    due = self._pop_due()
+                    if due:
+                        break
+                    # Sleep until the head job is due or an earlier one arrives
+                    timeout = self._heap[0][0] - time.time() if self._heap else None
+                    self._cond.wait(timeout)
+                if not self._running:
+                    return
+
+            # A job cancelled since it was popped is no longer pending, so
+            # only the entries whose row actually moved to running are run
+            dispatched_at = time.time()
+            with self._connect() as conn:
+                due = [entry for entry in due if conn.execute(
+                    "UPDATE scheduled_jobs SET status = 'running', attempts = attempts + 1, updated_at = ? "
+                    "WHERE id = ? AND status = 'pending'",
+                    (dispatched_at, entry.job_id)
+                ).rowcount]
+            if not due:
+                continue
+
+            with self._stats_lock:
+                self._counts["dispatched"] += len(due)
+                self._latencies.extend(dispatched_at - entry.run_at for entry in due)
+
+            for entry in due:
+                self._executor.submit(self._run, entry)
+
+    def _run(self, entry: _Entry):
+        handler = self._handlers.get(entry.handler)
+        error = None
+        try:
+            if handler is None:
+                raise KeyError(f"No handler registered for '{entry.handler}'")
+            handler(entry.payload)
+        except Exception as e:
+            error = str(e)
+            logger.error(f"Scheduled job {entry.job_id} ({entry.handler}) failed: {error}")
+
+        with self._stats_lock:
+            self._counts["failed" if error else "succeeded"] += 1
+
+        now = time.time()
+        if entry.interval:
+            # Recurring jobs skip runs they missed instead of firing them in a burst
+            next_run = entry.run_at + entry.interval
+            if next_run <= now:
+                next_run = now + entry.interval - (now - entry.run_at) % entry.interval
+            with self._connect() as conn:
+                rescheduled = conn.execute(
+                    "UPDATE scheduled_jobs SET status = 'pending', run_at = ?, error = ?, updated_at = ? "
+                    "WHERE id = ? AND status = 'running'",
+                    (next_run, error, now, entry.job_id)
+                ).rowcount
+            if rescheduled:
+                with self._cond:
+                    if entry.job_id not in self._jobs:
+                        head = self._heap[0][0] if self._heap else None
+                        entry.run_at = next_run
+                        self._push(entry)
+                        if head is None or next_run < head:
+                            self._cond.notify()
+        else:
+            with self._connect() as conn:
+                conn.execute(
+                    "UPDATE scheduled_jobs SET status = ?, error = ?, updated_at = ? WHERE id = ? AND status = 'running'",
+                    ("failed" if error else "done", error, now, entry.job_id)
+                )
+
+    def purge(self, older_than: float):
+        # Finished rows are kept for inspection; drop those older than the given age in seconds
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM scheduled_jobs WHERE status IN ('done', 'failed', 'cancelled') AND updated_at < ?",
+                (time.time() - older_than,)
+            )
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            latencies = sorted(self._latencies)
+            stats = dict(self._counts)
+
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        stats.update({
+            "pending": self.pending_count(),
+            "latency_p50": percentile(0.50),
+            "latency_p99": percentile(0.99),
+            "latency_max": latencies[-1] if latencies else 0.0
+        })
+        return stats
@@ -2,9 +2,25 @@
 Utils Module - Common utilities and helper functions
 """
 
-from .logger import setup_logger
-from .validators import validate_image, validate_caption
-from .rate_limiter import RateLimiter
-from .config import load_config, save_config
+from .lazy import lazy_exports
 
-__all__ = ['setup_logger', 'validate_image', 'validate_caption', 'RateLimiter', 'load_config', 'save_config']
\ No newline at end of file
+_EXPORTS = {
+    'setup_logger': '.logger',
+    'validate_image': '.validators',
+    'validate_caption': '.validators',
+    'RateLimiter': '.rate_limiter',
+    'get_rate_limiter': '.rate_limiter',
+    'load_config': '.config',
+    'save_config': '.config',
+    'HttpPool': '.http_pool',
+    'get_http_pool': '.http_pool',
+    'get_data_dir': '.paths',
+    'data_path': '.paths',
+    'get_registry': '.metrics',
+    'get_tracer': '.metrics',
+    'span': '.metrics',
+    'record_span': '.metrics'
+}
+
+__all__ = list(_EXPORTS)
+__getattr__ = lazy_exports(__name__, _EXPORTS)
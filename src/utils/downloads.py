@@ -0,0 +1,114 @@
+"""
+Downloads - Streaming, resumable file downloads with on-the-fly hashing
+"""
+
+import io
+import os
+import time
+import hashlib
+import logging
+from typing import Dict, Any, Optional
+
+import requests
+
+from .http_pool import HttpPool
+
+logger = logging.getLogger(__name__)
+
+# Errors after which the partial file is kept and the download resumed
+_RESUMABLE_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError
+)
+
+
+def _rehash_partial(part_path: str, digest, buffer: Optional[io.BytesIO], chunk_size: int) -> int:
+    size = 0
+    with open(part_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+            if buffer is not None:
+                buffer.write(chunk)
+            size += len(chunk)
+    return size
+
+
+def stream_download(http: HttpPool, url: str, dest_path: str, keep_in_memory: bool = False,
+                    max_attempts: Optional[int] = None) -> Dict[str, Any]:
+    # Chunks go straight to "<dest>.part" while the SHA-256 is computed, so
+    # memory use does not grow with the image size. keep_in_memory also
+    # collects the bytes in a BytesIO for callers that decode the file right
+    # away. If the connection drops, the next attempt asks for the rest with
+    # an HTTP Range request. The file only appears at dest_path once complete.
+    max_attempts = max_attempts or int(os.getenv("DOWNLOAD_MAX_ATTEMPTS", 3))
+    chunk_size = int(os.getenv("DOWNLOAD_CHUNK_SIZE", 64 * 1024))
+    part_path = f"{dest_path}.part"
+    resumed = False
+
+    if os.path.exists(dest_path) and not os.path.exists(part_path):
+        # Completed by an earlier run that stopped before using the file
+        digest = hashlib.sha256()
+        buffer = io.BytesIO() if keep_in_memory else None
+        size = _rehash_partial(dest_path, digest, buffer, chunk_size)
+        if buffer is not None:
+            buffer.seek(0)
+        logger.info(f"Reusing completed download of {url}")
+        return {"path": dest_path, "sha256": digest.hexdigest(), "size": size, "resumed": True, "buffer": buffer}
+
+    for attempt in range(1, max_attempts + 1):
+        digest = hashlib.sha256()
+        buffer = io.BytesIO() if keep_in_memory else None
+        offset = _rehash_partial(part_path, digest, buffer, chunk_size) if os.path.exists(part_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+        try:
+            with http.get(url, headers=headers, stream=True, timeout=http.download_timeout) as response:
+                if offset and response.status_code == 206:
+                    mode = "ab"
+                    resumed = True
+                    logger.info(f"Resuming download of {url} at byte {offset}")
+                elif response.status_code == 200:
+                    # Fresh download, or the server ignored the Range header
+                    if offset:
+                        digest = hashlib.sha256()
+                        buffer = io.BytesIO() if keep_in_memory else None
+                        offset = 0
+                    mode = "wb"
+                elif response.status_code == 416:
+                    # The partial file is unusable (e.g. the remote file changed); start over
+                    os.remove(part_path)
+                    continue
+                else:
+                    raise Exception(f"Error downloading image: {response.status_code}")
+
+                size = offset
+                with open(part_path, mode) as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        if not chunk:
+                            continue
+                        f.write(chunk)
+                        digest.update(chunk)
+                        if buffer is not None:
+                            buffer.write(chunk)
+                        size += len(chunk)
+
+            os.replace(part_path, dest_path)
+            if buffer is not None:
+                buffer.seek(0)
+
+            return {
+                "path": dest_path,
+                "sha256": digest.hexdigest(),
+                "size": size,
+                "resumed": resumed,
+                "buffer": buffer
+            }
+
+        except _RESUMABLE_ERRORS as e:
+            if attempt == max_attempts:
+                raise Exception(f"Error downloading image after {attempt} attempts: {str(e)}")
+            logger.warning(f"Download of {url} interrupted (attempt {attempt}/{max_attempts}): {str(e)}")
+            time.sleep(min(2 ** attempt, 10))
+
+    raise Exception(f"Error downloading image: could not complete {url}")
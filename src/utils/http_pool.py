@@ -0,0 +1,211 @@
+"""
+HTTP Pool - Shared keep-alive transport for OpenAI, Midjourney and image downloads
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Dict, Any, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from .rate_limiter import RateLimiter, get_rate_limiter, parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+class HttpPoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts: Dict[str, Dict[str, Any]] = {}
+
+    def _host(self, host: str) -> Dict[str, Any]:
+        entry = self._hosts.get(host)
+        if entry is None:
+            entry = {
+                "requests": 0,
+                "errors": 0,
+                "connections": 0,
+                "total_latency": 0.0,
+                "max_latency": 0.0
+            }
+            self._hosts[host] = entry
+        return entry
+
+    def record_connection(self, host: str):
+        with self._lock:
+            self._host(host)["connections"] += 1
+
+    def record_request(self, host: str, latency: float, error: bool = False):
+        with self._lock:
+            entry = self._host(host)
+            entry["requests"] += 1
+            entry["total_latency"] += latency
+            entry["max_latency"] = max(entry["max_latency"], latency)
+            if error:
+                entry["errors"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            hosts = {host: dict(entry) for host, entry in self._hosts.items()}
+
+        for entry in hosts.values():
+            entry["avg_latency"] = entry["total_latency"] / entry["requests"] if entry["requests"] else 0.0
+            entry["reuse_rate"] = _reuse_rate(entry["requests"], entry["connections"])
+
+        total_requests = sum(entry["requests"] for entry in hosts.values())
+        total_connections = sum(entry["connections"] for entry in hosts.values())
+        total_latency = sum(entry["total_latency"] for entry in hosts.values())
+
+        return {
+            "requests": total_requests,
+            "connections": total_connections,
+            "reuse_rate": _reuse_rate(total_requests, total_connections),
+            "avg_latency": total_latency / total_requests if total_requests else 0.0,
+            "hosts": hosts
+        }
+
+
+def _reuse_rate(requests_made: int, connections: int) -> float:
+    if not requests_made:
+        return 0.0
+    return max(0.0, 1.0 - connections / requests_made)
+
+
+class _CountingAdapter(HTTPAdapter):
+    def __init__(self, stats: HttpPoolStats, **kwargs):
+        self._stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        stats = self._stats
+
+        # urllib3 only opens a socket in _new_conn, so counting there tells us
+        # exactly how many requests had to pay for a fresh TCP/TLS handshake.
+        class CountingHTTPConnectionPool(HTTPConnectionPool):
+            def _new_conn(self):
+                stats.record_connection(self.host)
+                return super()._new_conn()
+
+        class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+            def _new_conn(self):
+                stats.record_connection(self.host)
+                return super()._new_conn()
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool
+        }
+
+
+class HttpPool:
+    def __init__(self,
+                 pool_maxsize: Optional[int] = None,
+                 pool_connections: Optional[int] = None,
+                 max_retries: Optional[int] = None,
+                 backoff_factor: Optional[float] = None,
+                 timeout: Optional[Tuple[float, float]] = None,
+                 download_timeout: Optional[Tuple[float, float]] = None,
+                 rate_limiter: Optional[RateLimiter] = None):
+        # Keep-alive connections kept per host; requests beyond this wait for a free one
+        self.pool_maxsize = pool_maxsize or int(os.getenv("HTTP_POOL_MAXSIZE_PER_HOST", 10))
+        # Number of distinct hosts whose pools are kept open
+        self.pool_connections = pool_connections or int(os.getenv("HTTP_POOL_HOSTS", 10))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("HTTP_MAX_RETRIES", 3))
+        self.backoff_factor = backoff_factor if backoff_factor is not None else float(os.getenv("HTTP_BACKOFF_FACTOR", 0.5))
+
+        connect_timeout = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+        self.timeout = timeout or (connect_timeout, float(os.getenv("HTTP_READ_TIMEOUT", 15)))
+        self.download_timeout = download_timeout or (connect_timeout, float(os.getenv("HTTP_DOWNLOAD_TIMEOUT", 30)))
+
+        self.stats = HttpPoolStats()
+        self._rate_limiter = rate_limiter
+        self.session = requests.Session()
+
+        # Connection failures are retried for every method because the request
+        # never reached the server. Status-based retries are limited to
+        # idempotent methods so a retried POST cannot start a second paid task.
+        retry = Retry(
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=self.max_retries,
+            status=self.max_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET", "HEAD", "OPTIONS"]),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+
+        adapter = _CountingAdapter(
+            self.stats,
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=True,
+            max_retries=retry
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        logger.info(f"HTTP pool initialized ({self.pool_maxsize} connections per host, {self.max_retries} retries)")
+
+    @property
+    def rate_limiter(self) -> RateLimiter:
+        if self._rate_limiter is None:
+            self._rate_limiter = get_rate_limiter()
+        return self._rate_limiter
+
+    def request(self, method: str, url: str, rate_limit: Optional[str] = None,
+                rate_limit_key: Optional[str] = None, **kwargs) -> requests.Response:
+        # rate_limit names the RateLimiter endpoint this call draws a token
+        # from; a 429 answer blocks that endpoint for every process until
+        # Retry-After has passed
+        kwargs.setdefault("timeout", self.timeout)
+        host = urlsplit(url).hostname or ""
+
+        if rate_limit:
+            self.rate_limiter.acquire(rate_limit, key=rate_limit_key)
+
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except Exception:
+            self.stats.record_request(host, time.perf_counter() - start, error=True)
+            raise
+
+        self.stats.record_request(host, time.perf_counter() - start, error=response.status_code >= 400)
+
+        if rate_limit and response.status_code == 429:
+            self.rate_limiter.penalize(rate_limit, parse_retry_after(response.headers.get("Retry-After")),
+                                       key=rate_limit_key)
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return self.stats.snapshot()
+
+    def close(self):
+        self.session.close()
+
+
+def get_http_pool() -> HttpPool:
+    global _default_pool
+    if _default_pool is None:
+        with _default_pool_lock:
+            if _default_pool is None:
+                _default_pool = HttpPool()
+    return _default_pool
@@ -0,0 +1,26 @@
+"""
+Lazy - Package exports imported on first access
+
+Usage:
+    _EXPORTS = {'SchedulerEngine': '.engine'}
+    __all__ = list(_EXPORTS)
+    __getattr__ = lazy_exports(__name__, _EXPORTS)
+"""
+
+import importlib
+from typing import Callable, Dict, Any
+
+
+def lazy_exports(package: str, exports: Dict[str, str]) -> Callable[[str], Any]:
+    # Module-level __getattr__ (PEP 562) for a package __init__: importing the
+    # package, or running one of its modules with python -m, only loads the
+    # submodules whose names are actually used
+    def __getattr__(name: str) -> Any:
+        module = exports.get(name)
+        if module is None:
+            raise AttributeError(f"module {package!r} has no attribute {name!r}")
+        value = getattr(importlib.import_module(module, package), name)
+        setattr(importlib.import_module(package), name, value)
+        return value
+
+    return __getattr__
@@ -0,0 +1,304 @@
+"""
+Metrics - Timing spans, Prometheus-style histograms and JSON traces for the generation pipeline
+
+Usage:
+    with span("render", task_id=task_id):
+        ...
+    record_span("queue_wait", seconds)
+    get_registry().render_prometheus()
+
+Every finished span is observed into the instanexus_stage_seconds histogram
+under its name. Spans opened while another span is active in the same
+thread (or asyncio task) become its children; when the outermost span of a
+trace closes, the whole trace is kept in memory and, if TRACE_PATH is set
+or TRACE_FILE_ENABLED is true, appended to a JSON-lines file.
+"""
+
+import os
+import json
+import time
+import uuid
+import bisect
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Deque, Dict, Iterator, List, Optional, Tuple, Any
+
+from .paths import data_path
+
+logger = logging.getLogger(__name__)
+
+# Seconds; spans range from sub-millisecond metric computations to renders of several minutes
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+                   30.0, 60.0, 120.0, 300.0, 600.0)
+
+STAGE_METRIC = "instanexus_stage_seconds"
+
+_HELP = {
+    STAGE_METRIC: "Duration of generation pipeline stages",
+    "instanexus_image_metric_seconds": "Duration of each ImageAnalyzer metric computation",
+    "instanexus_generations_total": "Content packages generated, by outcome"
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    # Cumulative-bucket histogram plus a small reservoir of recent samples,
+    # so reports can quote percentiles without Prometheus in between
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, samples: int = 1024):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent: Deque[float] = deque(maxlen=samples)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q / 100.0 * len(ordered)))]
+
+
+class MetricsRegistry:
+    def __init__(self, samples: Optional[int] = None):
+        self.samples = samples or int(os.getenv("METRICS_SAMPLES", 1024))
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, **labels: str):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(samples=self.samples)
+            histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1.0, **labels: str):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        # {"histograms": {name: [{labels, count, sum, p50, p95, p99}]}, "counters": {name: [{labels, value}]}}
+        with self._lock:
+            histograms = {
+                name: [{"labels": dict(key), "count": h.count, "sum": round(h.sum, 6),
+                        "p50": h.percentile(50), "p95": h.percentile(95), "p99": h.percentile(99)}
+                       for key, h in series.items()]
+                for name, series in self._histograms.items()
+            }
+            counters = {name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                        for name, series in self._counters.items()}
+        return {"histograms": histograms, "counters": counters}
+
+    def render_prometheus(self) -> str:
+        # Prometheus text exposition format (version 0.0.4)
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{_labels(key + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(key)} {histogram.sum}")
+                    lines.append(f"{name}_count{_labels(key)} {histogram.count}")
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(key: LabelKey) -> str:
+    if not key:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in key) + "}"
+
+
+class Span:
+    __slots__ = ("name", "trace", "span_id", "parent_id", "start", "duration", "attrs")
+
+    def __init__(self, name: str, trace: "Trace", parent_id: Optional[str], attrs: Dict[str, Any]):
+        self.name = name
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.duration: Optional[float] = None
+        self.attrs = attrs
+
+    def set(self, **attrs: Any):
+        self.attrs.update(attrs)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "span_id": self.span_id, "parent_id": self.parent_id,
+                "start": self.start, "duration": self.duration, "attrs": self.attrs}
+
+
+class Trace:
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = [span.to_dict() for span in self.spans]
+        root = spans[-1] if spans else {}
+        return {"trace_id": self.trace_id, "name": root.get("name"), "start": root.get("start"),
+                "duration": root.get("duration"), "spans": spans}
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("instanexus_span", default=None)
+
+
+class Tracer:
+    def __init__(self, registry: MetricsRegistry, path: Optional[str] = None, keep: Optional[int] = None):
+        self.registry = registry
+        file_enabled = os.getenv("TRACE_FILE_ENABLED", "false").lower() == "true"
+        self.path = path or os.getenv("TRACE_PATH") or (data_path("traces.jsonl") if file_enabled else None)
+        self.max_bytes = int(os.getenv("TRACE_MAX_BYTES", 10 * 1024 * 1024))
+        self.recent: Deque[Dict[str, Any]] = deque(maxlen=keep or int(os.getenv("TRACE_KEEP", 200)))
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attrs: Any) -> Iterator[Span]:
+        parent = _current_span.get()
+        trace = parent.trace if parent is not None else Trace()
+        current = Span(name, trace, parent.span_id if parent is not None else None, attrs)
+        token = _current_span.set(current)
+        started = time.perf_counter()
+        try:
+            yield current
+        except BaseException as e:
+            current.attrs["error"] = type(e).__name__
+            raise
+        finally:
+            current.duration = time.perf_counter() - started
+            _current_span.reset(token)
+            self._finish(current, root=parent is None)
+
+    def record(self, name: str, duration: float, **attrs: Any):
+        # A span measured elsewhere (e.g. by the task tracker), ending now
+        parent = _current_span.get()
+        trace = parent.trace if parent is not None else Trace()
+        span = Span(name, trace, parent.span_id if parent is not None else None, attrs)
+        span.start = time.time() - duration
+        span.duration = duration
+        self._finish(span, root=parent is None)
+
+    def _finish(self, span: Span, root: bool):
+        span.trace.add(span)
+        self.registry.observe(STAGE_METRIC, span.duration, stage=span.name)
+        if root:
+            self._export(span.trace.to_dict())
+
+    def _export(self, trace: Dict[str, Any]):
+        with self._lock:
+            self.recent.append(trace)
+            if not self.path:
+                return
+            try:
+                if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, f"{self.path}.1")
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(trace, default=str) + "\n")
+            except OSError as e:
+                logger.warning(f"Could not write trace to {self.path}: {str(e)}")
+
+    def recent_traces(self, limit: int = 50) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self.recent)[-limit:]
+
+
+_registry = MetricsRegistry()
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+
+def get_registry() -> MetricsRegistry:
+    return _registry
+
+
+def get_tracer() -> Tracer:
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                _tracer = Tracer(_registry)
+    return _tracer
+
+
+def span(name: str, **attrs: Any):
+    return get_tracer().span(name, **attrs)
+
+
+def record_span(name: str, duration: float, **attrs: Any):
+    get_tracer().record(name, duration, **attrs)
+
+
+def start_metrics_server(port: Optional[int] = None, host: str = "0.0.0.0") -> Optional[ThreadingHTTPServer]:
+    # /metrics (Prometheus text) and /traces (recent traces as JSON) for
+    # processes without the web interface, such as generation workers
+    port = port if port is not None else int(os.getenv("METRICS_PORT", 0))
+    if not port:
+        return None
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            if path == "/metrics":
+                body = _registry.render_prometheus().encode()
+                content_type = "text/plain; version=0.0.4"
+            elif path == "/traces":
+                body = json.dumps(get_tracer().recent_traces(), default=str).encode()
+                content_type = "application/json"
+            else:
+                self.send_response(404)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(f"Metrics server: {format % args}")
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Metrics available on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,19 @@
+"""
+Paths - Locations of local runtime data (caches, queues, indexes)
+"""
+
+import os
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def get_data_dir() -> str:
+    data_dir = os.getenv("INSTANEXUS_DATA_DIR", os.path.join(PROJECT_ROOT, "data"))
+    os.makedirs(data_dir, exist_ok=True)
+    return data_dir
+
+
+def data_path(*parts: str) -> str:
+    path = os.path.join(get_data_dir(), *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
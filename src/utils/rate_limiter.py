@@ -0,0 +1,202 @@
+"""
+Rate Limiter - Token buckets per endpoint, shared by every thread and process on the host
+"""
+
+import os
+import time
+import logging
+import sqlite3
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional, Tuple, Any
+
+from .paths import data_path
+
+logger = logging.getLogger(__name__)
+
+# Each limit is a list of (capacity, period in seconds) windows; a request
+# needs a token from every window. Override any of them with an environment
+# variable such as RATE_LIMIT_MIDJOURNEY_IMAGINE="10/60" or
+# RATE_LIMIT_INSTAGRAM_POST="3/3600,25/86400".
+DEFAULT_LIMITS: Dict[str, List[Tuple[float, float]]] = {
+    "midjourney_imagine": [(10, 60)],
+    "midjourney_upscale": [(20, 60)],
+    "midjourney_status": [(120, 60)],
+    "openai": [(60, 60)],
+    # Instagram actions are limited per account (pass the account as key)
+    "instagram_login": [(3, 3600), (10, 86400)],
+    "instagram_post": [(3, 3600), (25, 86400)],
+    "instagram_comment": [(20, 3600), (100, 86400)],
+    "instagram_like": [(60, 3600), (500, 86400)],
+    "instagram_follow": [(20, 3600), (150, 86400)]
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    bucket TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    blocked_until REAL NOT NULL DEFAULT 0
+);
+"""
+
+_default_limiter = None
+_default_limiter_lock = threading.Lock()
+
+
+def parse_limits(value: str) -> List[Tuple[float, float]]:
+    windows = []
+    for part in value.split(","):
+        capacity, period = part.strip().split("/")
+        windows.append((float(capacity), float(period)))
+    return windows
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    # Bucket state lives in SQLite, and every acquire refills and debits its
+    # buckets inside one BEGIN IMMEDIATE transaction, so threads and worker
+    # processes draw from the same budget. A 429 reported through penalize()
+    # empties the endpoint's buckets and blocks it until Retry-After has passed.
+
+    def __init__(self, path: Optional[str] = None, limits: Optional[Dict[str, List[Tuple[float, float]]]] = None):
+        self.path = path or os.getenv("RATE_LIMIT_DB") or data_path("rate_limits.sqlite3")
+        self.default_penalty = float(os.getenv("RATE_LIMIT_DEFAULT_PENALTY", 30))
+        self.max_sleep = float(os.getenv("RATE_LIMIT_MAX_SLEEP", 5))
+
+        self.limits = {name: list(windows) for name, windows in DEFAULT_LIMITS.items()}
+        for name in list(self.limits):
+            override = os.getenv(f"RATE_LIMIT_{name.upper()}")
+            if override:
+                self.limits[name] = parse_limits(override)
+        if limits:
+            self.limits.update(limits)
+
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _buckets(self, endpoint: str, key: Optional[str]) -> List[Tuple[str, float, float]]:
+        prefix = f"{endpoint}:{key}" if key else endpoint
+        return [(f"{prefix}:{int(period)}", capacity, capacity / period)
+                for capacity, period in self.limits.get(endpoint, [])]
+
+    def _take(self, endpoint: str, key: Optional[str], cost: float) -> float:
+        # Returns 0 when the tokens were taken, otherwise the seconds to wait
+        buckets = self._buckets(endpoint, key)
+        if not buckets:
+            return 0.0
+        # A bucket never holds more than its capacity, so waiting would never end
+        capacity = min(capacity for _, capacity, _ in buckets)
+        if cost > capacity:
+            raise ValueError(f"Cost {cost} exceeds the {endpoint} rate limit capacity of {capacity}")
+
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            state = {}
+            wait = 0.0
+            for name, capacity, rate in buckets:
+                row = conn.execute(
+                    "SELECT tokens, updated_at, blocked_until FROM rate_buckets WHERE bucket = ?", (name,)
+                ).fetchone()
+                tokens, updated_at, blocked_until = row if row else (capacity, now, 0.0)
+                tokens = min(capacity, tokens + (now - updated_at) * rate)
+                state[name] = (tokens, blocked_until)
+
+                if blocked_until > now:
+                    wait = max(wait, blocked_until - now)
+                elif tokens < cost:
+                    wait = max(wait, (cost - tokens) / rate)
+
+            if wait == 0.0:
+                for name, (tokens, blocked_until) in state.items():
+                    conn.execute(
+                        "INSERT OR REPLACE INTO rate_buckets (bucket, tokens, updated_at, blocked_until) "
+                        "VALUES (?, ?, ?, ?)",
+                        (name, tokens - cost, now, blocked_until)
+                    )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def acquire(self, endpoint: str, key: Optional[str] = None, cost: float = 1.0,
+                timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._take(endpoint, key, cost)
+            if wait == 0.0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            logger.debug(f"Rate limit for {endpoint}{f' ({key})' if key else ''} reached, waiting {wait:.2f}s")
+            # Sleep in short slices so a budget freed by another process is noticed
+            time.sleep(min(wait, self.max_sleep))
+
+    def try_acquire(self, endpoint: str, key: Optional[str] = None, cost: float = 1.0) -> bool:
+        return self._take(endpoint, key, cost) == 0.0
+
+    def penalize(self, endpoint: str, retry_after: Optional[float] = None, key: Optional[str] = None):
+        delay = retry_after if retry_after is not None else self.default_penalty
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for name, _, _ in self._buckets(endpoint, key):
+                conn.execute(
+                    "INSERT OR REPLACE INTO rate_buckets (bucket, tokens, updated_at, blocked_until) "
+                    "VALUES (?, 0, ?, ?)",
+                    (name, now + delay, now + delay)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        logger.warning(f"Rate limited on {endpoint}{f' ({key})' if key else ''}, backing off for {delay:.1f}s")
+
+    def get_state(self, endpoint: str, key: Optional[str] = None) -> Dict[str, Any]:
+        now = time.time()
+        state = {}
+        for name, capacity, rate in self._buckets(endpoint, key):
+            row = self._connect().execute(
+                "SELECT tokens, updated_at, blocked_until FROM rate_buckets WHERE bucket = ?", (name,)
+            ).fetchone()
+            tokens, updated_at, blocked_until = row if row else (capacity, now, 0.0)
+            state[name] = {
+                "tokens": min(capacity, tokens + max(0.0, now - updated_at) * rate),
+                "capacity": capacity,
+                "blocked_for": max(0.0, blocked_until - now)
+            }
+        return state
+
+
+def get_rate_limiter() -> RateLimiter:
+    global _default_limiter
+    if _default_limiter is None:
+        with _default_limiter_lock:
+            if _default_limiter is None:
+                _default_limiter = RateLimiter()
+    return _default_limiter
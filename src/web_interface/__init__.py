@@ -2,8 +2,14 @@
 Web Interface Module - Flask-based web UI for managing the Instagram bot
 """
 
-from .app import create_app
-from .routes import register_routes
-from .auth import login_required, current_user
+from ..utils.lazy import lazy_exports
 
-__all__ = ['create_app', 'register_routes', 'login_required', 'current_user']
\ No newline at end of file
+_EXPORTS = {
+    'create_app': '.app',
+    'register_routes': '.routes',
+    'login_required': '.auth',
+    'current_user': '.auth'
+}
+
+__all__ = list(_EXPORTS)
+__getattr__ = lazy_exports(__name__, _EXPORTS)
@@ -0,0 +1,85 @@
+"""
+App - Flask application factory for the web interface
+
+Usage:
+    gunicorn -c gunicorn.conf.py src.web_interface.wsgi:app
+    python run_web_interface.py
+"""
+
+import os
+import logging
+import threading
+from typing import Dict, List, Optional, Any
+
+from flask import Flask, Response, jsonify, request
+
+from .jobs import init_jobs
+from .media import init_media
+from ..utils.metrics import get_registry, get_tracer
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationWorkerThreads:
+    # Optional GenerationWorker threads inside each web process, for setups
+    # without separate `python -m src.content_generation.generation_worker`
+    # processes. Jobs are claimed atomically from the shared JobStore, so any
+    # mix of web processes and standalone workers can drain the same queue.
+
+    def __init__(self, store, count: int):
+        self.store = store
+        self.count = count
+        self.workers: List[Any] = []
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        if self.count <= 0 or self._threads:
+            return
+        from ..content_generation.ai_content_generator import AIContentGenerator
+        from ..content_generation.generation_worker import GenerationWorker
+
+        generator = AIContentGenerator()
+        base_id = f"web:{os.getpid()}"
+        for index in range(self.count):
+            worker = GenerationWorker(generator, self.store, worker_id=f"{base_id}:{index}")
+            thread = threading.Thread(target=worker.run_forever, name=f"generation-worker-{index}", daemon=True)
+            thread.start()
+            self.workers.append(worker)
+            self._threads.append(thread)
+        logger.info(f"Started {self.count} in-process generation workers")
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+
+def create_app(config: Optional[Dict[str, Any]] = None) -> Flask:
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "dev")
+    app.config["GENERATION_WORKERS"] = int(os.getenv("WEB_GENERATION_WORKERS", 2))
+    app.config.update(config or {})
+
+    init_jobs(app)
+    init_media(app)
+
+    @app.route("/healthz")
+    def healthz():
+        return jsonify({"status": "ok"})
+    
+    # Stage timings of the generations run by this process's worker threads.
+    # Under gunicorn each worker process exposes its own series.
+    @app.route("/metrics")
+    def metrics():
+        return Response(get_registry().render_prometheus(), mimetype="text/plain; version=0.0.4")
+    
+    @app.route("/api/traces")
+    def traces():
+        limit = min(int(request.args.get("limit", 50)), 500)
+        return jsonify({"traces": get_tracer().recent_traces(limit)})
+
+    # Started per process: under gunicorn this runs in each worker after
+    # the fork, so no worker inherits another's threads
+    workers = GenerationWorkerThreads(app.extensions["generation_jobs"], app.config["GENERATION_WORKERS"])
+    workers.start()
+    app.extensions["generation_workers"] = workers
+    return app
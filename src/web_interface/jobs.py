@@ -0,0 +1,358 @@
+"""
+Jobs - Background generation and image analysis jobs for the web interface
+
+Endpoints (all JSON unless noted):
+    POST /api/jobs/generation             queue one or more generation jobs
+    GET  /api/jobs/generation             recent generation jobs
+    GET  /api/jobs/generation/<id>        status and stage of a job
+    GET  /api/jobs/generation/<id>/result content package of a finished job
+    POST /api/jobs/analysis               queue scoring of image or grid URLs
+    GET  /api/jobs/analysis/<id>          status and progress
+    GET  /api/jobs/analysis/<id>/result   scores of a finished analysis
+    GET  /api/jobs/events                 server-sent events for every job change (text/event-stream)
+
+Requests only ever enqueue or read job rows, so no web worker is held for
+the minutes a Midjourney generation takes. Generation jobs go to the shared
+JobStore and are run by GenerationWorker threads or processes; analysis jobs
+are short and run on a thread pool in the web process that accepted them.
+Both are kept in SQLite, so any web worker can answer for any job.
+"""
+
+import os
+import json
+import time
+import socket
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Any
+
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
+
+from ..content_generation.job_store import JobStore
+from ..utils.paths import data_path
+
+logger = logging.getLogger(__name__)
+
+_ANALYSIS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS analysis_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    owner TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_analysis_jobs_updated ON analysis_jobs (updated_at);
+"""
+
+# Fields of a generation job that are safe and useful to show in the UI
+_GENERATION_FIELDS = ("id", "theme", "status", "stage", "prompt", "image_path", "error", "attempts",
+                      "created_at", "updated_at")
+
+
+class AnalysisJobStore:
+    # Analysis jobs are run by the process that accepted them. A running job
+    # that has not moved for WEB_ANALYSIS_TIMEOUT seconds belonged to a web
+    # worker that died or was recycled, and is reported as failed.
+
+    def __init__(self, path: Optional[str] = None, timeout: Optional[float] = None):
+        self.path = path or os.getenv("WEB_JOBS_DB") or data_path("web_jobs.sqlite3")
+        self.timeout = timeout or float(os.getenv("WEB_ANALYSIS_TIMEOUT", 600))
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(_ANALYSIS_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _decode(self, row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        if job["status"] in ("queued", "running") and time.time() - job["updated_at"] > self.timeout:
+            job["status"] = "failed"
+            job["error"] = job["error"] or "Interrupted"
+        return job
+
+    def create(self, params: Dict[str, Any], total: int, owner: str) -> int:
+        now = time.time()
+        cursor = self._connect().execute(
+            "INSERT INTO analysis_jobs (params, status, total, owner, created_at, updated_at) "
+            "VALUES (?, 'queued', ?, ?, ?, ?)",
+            (json.dumps(params), total, owner, now, now)
+        )
+        return cursor.lastrowid
+
+    def update(self, job_id: int, **fields):
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"])
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._connect().execute(f"UPDATE analysis_jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        return self._decode(self._connect().execute(
+            "SELECT * FROM analysis_jobs WHERE id = ?", (job_id,)
+        ).fetchone())
+
+    def list_updated(self, since: float, ids: Optional[List[int]] = None, limit: int = 500) -> List[Dict[str, Any]]:
+        if ids:
+            placeholders = ", ".join("?" for _ in ids)
+            rows = self._connect().execute(
+                f"SELECT * FROM analysis_jobs WHERE updated_at > ? AND id IN ({placeholders}) "
+                "ORDER BY updated_at LIMIT ?", (since, *ids, limit)
+            ).fetchall()
+        else:
+            rows = self._connect().execute(
+                "SELECT * FROM analysis_jobs WHERE updated_at > ? ORDER BY updated_at LIMIT ?", (since, limit)
+            ).fetchall()
+        return [self._decode(row) for row in rows]
+
+
+class AnalysisRunner:
+    # Thread pool for analysis jobs. Scoring is mostly OpenCV and downloads,
+    # both of which release the GIL, and the ImageAnalyzer is created on
+    # first use so web workers that never analyse anything stay light.
+
+    def __init__(self, store: AnalysisJobStore, workers: Optional[int] = None):
+        self.store = store
+        self.workers = workers or int(os.getenv("WEB_ANALYSIS_WORKERS", 4))
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._executor = None
+        self._analyzer = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                from ..content_generation.image_analyzer import ImageAnalyzer
+                self._analyzer = ImageAnalyzer()
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="analysis")
+            return self._executor
+
+    def submit(self, params: Dict[str, Any]) -> int:
+        total = len(params.get("urls") or []) + len(params.get("grid_urls") or [])
+        job_id = self.store.create(params, total, self.owner)
+        self._ensure_started().submit(self._run, job_id, params)
+        return job_id
+
+    def _run(self, job_id: int, params: Dict[str, Any]):
+        self.store.update(job_id, status="running")
+        try:
+            results = []
+            for url in params.get("urls") or []:
+                results.append({"url": url, "score": self._analyzer.score_url(url)})
+                self.store.update(job_id, done=len(results))
+            for url in params.get("grid_urls") or []:
+                image = self._analyzer.download_image(url)
+                if image is None:
+                    results.append({"url": url, "error": "Could not download image"})
+                else:
+                    ranking = self._analyzer.rank_grid_image(image)
+                    results.append({"url": url, "ranking": [{"quadrant": index + 1, "score": score}
+                                                            for index, score in ranking]})
+                self.store.update(job_id, done=len(results))
+
+            scored = [r for r in results if "score" in r]
+            best = max(scored, key=lambda r: r["score"]) if scored else None
+            self.store.update(job_id, status="completed", result={"results": results, "best": best})
+        except Exception as e:
+            logger.error(f"Analysis job {job_id} failed: {str(e)}")
+            self.store.update(job_id, status="failed", error=str(e))
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+
+def _generation_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    view = {field: job.get(field) for field in _GENERATION_FIELDS}
+    view["kind"] = "generation"
+    view["status_url"] = f"/api/jobs/generation/{job['id']}"
+    return view
+
+
+def _analysis_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "kind": "analysis",
+        "id": job["id"],
+        "status": job["status"],
+        "progress": {"done": job["done"], "total": job["total"]},
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "status_url": f"/api/jobs/analysis/{job['id']}"
+    }
+
+
+def _int_list(value: Optional[str]) -> Optional[List[int]]:
+    if not value:
+        return None
+    return [int(part) for part in value.split(",") if part.strip().isdigit()]
+
+
+jobs_bp = Blueprint("jobs", __name__, url_prefix="/api/jobs")
+
+
+def _stores():
+    return current_app.extensions["generation_jobs"], current_app.extensions["analysis_runner"]
+
+
+@jobs_bp.route("/generation", methods=["POST"])
+def submit_generation():
+    generation_jobs, _ = _stores()
+    body = request.get_json(silent=True) or {}
+    count = int(body.get("count", 1))
+    max_batch = current_app.config["MAX_JOBS_PER_REQUEST"]
+    if not 1 <= count <= max_batch:
+        return jsonify({"error": f"count must be between 1 and {max_batch}"}), 400
+
+    options = {name: body[name] for name in ("upscale_top_k", "upscale_strategy") if body.get(name) is not None}
+    ids = [generation_jobs.enqueue(body.get("theme"), options) for _ in range(count)]
+    return jsonify({
+        "jobs": [{"id": job_id, "status_url": f"/api/jobs/generation/{job_id}",
+                  "result_url": f"/api/jobs/generation/{job_id}/result"} for job_id in ids],
+        "events_url": f"/api/jobs/events?generation={','.join(map(str, ids))}"
+    }), 202
+
+
+@jobs_bp.route("/generation", methods=["GET"])
+def list_generation():
+    generation_jobs, _ = _stores()
+    limit = min(int(request.args.get("limit", 50)), 500)
+    jobs = generation_jobs.list_jobs(request.args.get("status"), limit)
+    return jsonify({"jobs": [_generation_view(job) for job in jobs]})
+
+
+@jobs_bp.route("/generation/<int:job_id>", methods=["GET"])
+def generation_status(job_id: int):
+    generation_jobs, _ = _stores()
+    job = generation_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(_generation_view(job))
+
+
+@jobs_bp.route("/generation/<int:job_id>/result", methods=["GET"])
+def generation_result(job_id: int):
+    generation_jobs, _ = _stores()
+    job = generation_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job["status"] == "completed":
+        return jsonify({"id": job_id, "status": "completed", "result": job["result"]})
+    if job["status"] == "failed":
+        return jsonify({"id": job_id, "status": "failed", "error": job["error"]}), 409
+    # Not finished yet: point the client back at the status endpoint
+    return jsonify({"id": job_id, "status": job["status"], "stage": job["stage"]}), 202
+
+
+@jobs_bp.route("/analysis", methods=["POST"])
+def submit_analysis():
+    _, runner = _stores()
+    body = request.get_json(silent=True) or {}
+    urls = body.get("urls") or ([body["url"]] if body.get("url") else [])
+    grid_urls = body.get("grid_urls") or ([body["grid_url"]] if body.get("grid_url") else [])
+    total = len(urls) + len(grid_urls)
+    max_batch = current_app.config["MAX_JOBS_PER_REQUEST"] * 10
+    if not 1 <= total <= max_batch:
+        return jsonify({"error": f"Provide between 1 and {max_batch} urls or grid_urls"}), 400
+
+    job_id = runner.submit({"urls": urls, "grid_urls": grid_urls})
+    return jsonify({"id": job_id, "status_url": f"/api/jobs/analysis/{job_id}",
+                    "result_url": f"/api/jobs/analysis/{job_id}/result",
+                    "events_url": f"/api/jobs/events?analysis={job_id}"}), 202
+
+
+@jobs_bp.route("/analysis/<int:job_id>", methods=["GET"])
+def analysis_status(job_id: int):
+    _, runner = _stores()
+    job = runner.store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(_analysis_view(job))
+
+
+@jobs_bp.route("/analysis/<int:job_id>/result", methods=["GET"])
+def analysis_result(job_id: int):
+    _, runner = _stores()
+    job = runner.store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job["status"] == "completed":
+        return jsonify({"id": job_id, "status": "completed", "result": job["result"]})
+    if job["status"] == "failed":
+        return jsonify({"id": job_id, "status": "failed", "error": job["error"]}), 409
+    return jsonify(_analysis_view(job)), 202
+
+
+def _event(name: str, payload: Dict[str, Any]) -> str:
+    return f"event: {name}\ndata: {json.dumps(payload)}\n\n"
+
+
+@jobs_bp.route("/events", methods=["GET"])
+def job_events():
+    # One stream per browser tab covers every job it is watching: each tick
+    # is a single indexed query per store for rows changed since the last
+    # one, however many jobs are in flight. Without ?generation= or
+    # ?analysis= filters every job change is sent. A stream ends after
+    # WEB_EVENTS_MAX_SECONDS; EventSource reconnects on its own and resumes
+    # from the Last-Event-ID it was given.
+    generation_jobs, runner = _stores()
+    generation_ids = _int_list(request.args.get("generation"))
+    analysis_ids = _int_list(request.args.get("analysis"))
+    filtered = generation_ids is not None or analysis_ids is not None
+    interval = current_app.config["EVENTS_INTERVAL"]
+    max_seconds = current_app.config["EVENTS_MAX_SECONDS"]
+    try:
+        since = float(request.headers.get("Last-Event-ID") or request.args.get("since") or time.time())
+    except ValueError:
+        since = time.time()
+
+    def stream() -> Iterator[str]:
+        cursor = since
+        started = time.monotonic()
+        # Tell EventSource how soon to reconnect after the stream closes
+        yield f"retry: {int(interval * 1000)}\n\n"
+        while time.monotonic() - started < max_seconds:
+            changes = []
+            if generation_ids or not filtered:
+                changes += [_generation_view(job) for job in generation_jobs.list_updated(cursor, generation_ids)]
+            if analysis_ids or not filtered:
+                changes += [_analysis_view(job) for job in runner.store.list_updated(cursor, analysis_ids)]
+
+            for change in sorted(changes, key=lambda c: c["updated_at"]):
+                cursor = max(cursor, change["updated_at"])
+                yield f"id: {cursor}\n" + _event(change["kind"], change)
+            if not changes:
+                # Comment line; keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+            time.sleep(interval)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(stream()), mimetype="text/event-stream", headers=headers)
+
+
+def init_jobs(app, generation_jobs: Optional[JobStore] = None, analysis_store: Optional[AnalysisJobStore] = None):
+    app.config.setdefault("MAX_JOBS_PER_REQUEST", int(os.getenv("WEB_MAX_JOBS_PER_REQUEST", 10)))
+    app.config.setdefault("EVENTS_INTERVAL", float(os.getenv("WEB_EVENTS_INTERVAL", 1.0)))
+    app.config.setdefault("EVENTS_MAX_SECONDS", float(os.getenv("WEB_EVENTS_MAX_SECONDS", 300)))
+    app.extensions["generation_jobs"] = generation_jobs or JobStore()
+    app.extensions["analysis_runner"] = AnalysisRunner(analysis_store or AnalysisJobStore())
+    app.register_blueprint(jobs_bp)
@@ -0,0 +1,57 @@
+"""
+Media - Serves the content-addressed media store with immutable caching
+
+    GET /media/<ab>/<cd>/<sha256>.<ext>    (prefix set by MEDIA_URL_PREFIX)
+
+A media URL is derived from the file's SHA-256, so its bytes never change:
+responses carry the hash as a strong ETag and a one-year immutable
+Cache-Control. Browsers and proxies keep the file without revalidating,
+and a client that does revalidate (If-None-Match) gets a 304. Range
+requests are answered too. The path is checked against the hash pattern
+and mapped straight to a file, with no database lookup or directory scan.
+"""
+
+import os
+import logging
+
+from flask import Blueprint, abort, current_app, send_file
+
+from ..content_generation.media_store import FILENAME_PATTERN, MediaStore
+
+logger = logging.getLogger(__name__)
+
+# One year, the conventional maximum for immutable assets
+MEDIA_MAX_AGE = 365 * 24 * 3600
+
+_MIMETYPES = {"jpg": "image/jpeg", "png": "image/png", "webp": "image/webp"}
+
+media_bp = Blueprint("media", __name__)
+
+
+@media_bp.route("/<shard1>/<shard2>/<filename>", methods=["GET"])
+def serve_media(shard1: str, shard2: str, filename: str):
+    match = FILENAME_PATTERN.match(filename)
+    if match is None:
+        abort(404)
+    sha256, ext = match.groups()
+    if shard1 != sha256[:2] or shard2 != sha256[2:4]:
+        abort(404)
+
+    store: MediaStore = current_app.extensions["media_store"]
+    path = store.path_for(sha256, ext)
+    if not os.path.isfile(path):
+        abort(404)
+
+    # conditional=True handles If-None-Match, If-Modified-Since and Range
+    response = send_file(path, mimetype=_MIMETYPES[ext], conditional=True, etag=sha256,
+                         max_age=MEDIA_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_media(app, store: MediaStore = None):
+    store = store or MediaStore()
+    app.extensions["media_store"] = store
+    # Mounted wherever MEDIA_URL_PREFIX says the store's URLs point
+    app.register_blueprint(media_bp, url_prefix=store.url_prefix)
@@ -0,0 +1,13 @@
+"""
+WSGI - Entry point for production servers
+
+Usage:
+    gunicorn -c gunicorn.conf.py src.web_interface.wsgi:app
+"""
+
+from dotenv import load_dotenv
+
+from .app import create_app
+
+load_dotenv()
+app = create_app()
@@ -0,0 +1,24 @@
+"""
+Tests for the analytics aggregation store
+"""
+
+from src.analytics.aggregation import DAY, METRICS, AggregationStore
+
+
+def _snapshots(post_id, first_day, days):
+    # One cumulative snapshot per day, gaining one of each metric per day
+    return [{"account": "account", "post_id": post_id, "timestamp": (first_day + day) * DAY + 3600,
+             **{name: day + 1 for name in METRICS}} for day in range(days)]
+
+
+def test_backfill_keeps_recent_daily_buckets(tmp_path):
+    store = AggregationStore(str(tmp_path), batch_size=1000)
+    store.ingest(_snapshots("recent", 100, 32))
+    recent = store.totals(100 * DAY, 132 * DAY)
+    assert recent["account"]["likes"] == 32
+
+    store.ingest(_snapshots("older", 90, 6))
+
+    assert store.totals(100 * DAY, 132 * DAY) == recent
+    assert store.totals(90 * DAY, 96 * DAY)["account"]["likes"] == 6
+    assert store.daily.dropped == 0
@@ -0,0 +1,91 @@
+"""
+Performance regression tests for image analysis and the generation pipeline
+
+Usage:
+    python -m pytest tests/test_pipeline_benchmark.py
+    PIPELINE_BENCHMARK_BASELINE=baseline.json python -m pytest tests/test_pipeline_benchmark.py
+
+Small versions of the runs in src.content_generation.pipeline_benchmark,
+against FakeMidjourneyServer. Latency budgets are deliberately loose (about
+ten times what a laptop measures), so only a real regression fails them; the
+concurrency check compares two runs on the same machine. With
+PIPELINE_BENCHMARK_BASELINE set, every figure is also compared with a file
+written by `pipeline_benchmark --save`.
+"""
+
+import os
+import json
+
+import pytest
+
+from src.content_generation.pipeline_benchmark import (
+    benchmark_analyzer, benchmark_environment, benchmark_pipeline, compare, flatten
+)
+
+# Fake Midjourney timings per task, in seconds; polling is sped up to match
+FAKE_SERVER = {"queue_seconds": 0.1, "render_seconds": 0.3, "upscale_seconds": 0.2, "image_size": 512,
+               "openai_latency": 0.02}
+PACKAGES = 6
+IN_FLIGHT = 3
+
+# Upper bounds in milliseconds, overridable for slow CI machines
+ANALYZER_GRID_MS = float(os.getenv("PERF_ANALYZER_GRID_MS", 100))
+STAGE_MS = {
+    "grid_analysis": float(os.getenv("PERF_GRID_ANALYSIS_MS", 500)),
+    "grid_download": float(os.getenv("PERF_GRID_DOWNLOAD_MS", 1000)),
+    "final_download": float(os.getenv("PERF_FINAL_DOWNLOAD_MS", 1000))
+}
+# Batch throughput with IN_FLIGHT packages in flight, relative to one at a time
+MIN_CONCURRENCY_SPEEDUP = float(os.getenv("PERF_MIN_CONCURRENCY_SPEEDUP", 1.3))
+
+
+@pytest.fixture(scope="module")
+def environment():
+    with benchmark_environment(MIDJOURNEY_POLL_INITIAL_DELAY="0.2", MIDJOURNEY_POLL_MIN_INTERVAL="0.1",
+                               MIDJOURNEY_POLL_MAX_INTERVAL="0.5") as data_dir:
+        yield data_dir
+
+
+@pytest.fixture(scope="module")
+def analyzer_report(environment):
+    return benchmark_analyzer(grids=4, size=512)
+
+
+@pytest.fixture(scope="module")
+def pipeline_report(environment):
+    return benchmark_pipeline(PACKAGES, IN_FLIGHT, **FAKE_SERVER)
+
+
+def test_analyzer_grid_latency(analyzer_report):
+    assert analyzer_report["grid_ms_p50"] < ANALYZER_GRID_MS, analyzer_report
+
+
+def test_pipeline_completes_every_package(pipeline_report):
+    assert pipeline_report["succeeded"] == PACKAGES, pipeline_report["errors"]
+
+
+@pytest.mark.parametrize("stage", sorted(STAGE_MS))
+def test_pipeline_stage_latency(pipeline_report, stage):
+    assert pipeline_report["stage_ms"][stage]["p50"] < STAGE_MS[stage], pipeline_report["stage_ms"][stage]
+
+
+def test_pipeline_restores_environment(environment):
+    before = {name: os.environ.get(name) for name in ("MIDJOURNEY_API_URL", "MIDJOURNEY_API_KEY")}
+    benchmark_pipeline(1, 1, **FAKE_SERVER)
+    assert {name: os.environ.get(name) for name in before} == before
+
+
+def test_pipeline_runs_packages_concurrently(environment, pipeline_report):
+    # A serial run on the same machine, so the check does not depend on its speed
+    serial = benchmark_pipeline(PACKAGES, 1, **FAKE_SERVER)
+    speedup = pipeline_report["packages_per_minute"] / serial["packages_per_minute"]
+    assert speedup >= MIN_CONCURRENCY_SPEEDUP, (pipeline_report["wall_seconds"], serial["wall_seconds"])
+
+
+@pytest.mark.skipif(not os.getenv("PIPELINE_BENCHMARK_BASELINE"), reason="PIPELINE_BENCHMARK_BASELINE not set")
+def test_no_regression_against_baseline(analyzer_report, pipeline_report):
+    with open(os.environ["PIPELINE_BENCHMARK_BASELINE"]) as f:
+        baseline = json.load(f)
+    tolerance = float(os.getenv("PIPELINE_BENCHMARK_TOLERANCE", 0.25))
+    current = flatten({"analyzer": analyzer_report, "pipeline": pipeline_report})
+    assert compare(current, baseline, tolerance) == []